@@ -0,0 +1,179 @@
+"""
+市場計算のベンチマーク (Market benchmarks)
+
+Saturation decay: the old nightly full-table sweep
+(`UPDATE market_trends SET saturation = CAST(saturation * 0.9 AS INTEGER)`)
+versus lazy decay on read, measured end to end on a real BankSystem:
+MarketTrends.load() at startup, record_uploads() + apply() per upload and
+modifier() over an item's tags per read.
+
+Stock volatility: the old hourly step (random.uniform + one UPDATE per tag)
+versus the vectorized step (NumPy multipliers + one executemany), in both modes.
+
+Usage:
+  python bench_market.py [--tags 10000 100000] [--reads 100000] [--uploads 1000] [--stocks 10000 100000]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+
+from utils.market_trends import MarketTrends
+from utils.stock_volatility import uniform_step, gbm_step
+
+def bench_sweep(n_tags):
+    """Seconds for one nightly decay sweep over n_tags rows."""
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE market_trends (
+            tag_name TEXT PRIMARY KEY,
+            current_price INTEGER DEFAULT 100,
+            saturation INTEGER DEFAULT 0,
+            trend_bonus INTEGER DEFAULT 0
+        )
+    """)
+    with conn:
+        conn.executemany(
+            "INSERT INTO market_trends (tag_name, saturation) VALUES (?, ?)",
+            ((f"tag_{i}", random.randint(0, 500)) for i in range(n_tags))
+        )
+    start = time.perf_counter()
+    with conn:
+        conn.execute("UPDATE market_trends SET saturation = CAST(saturation * 0.9 AS INTEGER) WHERE saturation > 0")
+    elapsed = time.perf_counter() - start
+    conn.close()
+    os.remove(path)
+    return elapsed
+
+def bench_lazy(n_tags, reads, uploads=1000, tags_per_item=20):
+    """
+    Costs of the lazy-decay path against one n_tags database (a real BankSystem):
+    seconds for MarketTrends.load(), per upload (record_uploads write + apply),
+    and per modifier() read (tags_per_item lookups with decay).
+    """
+    # Migration / load logging would interleave with the results table
+    with contextlib.redirect_stdout(io.StringIO()):
+        return asyncio.run(_bench_lazy(n_tags, reads, uploads, tags_per_item))
+
+async def _bench_lazy(n_tags, reads, uploads, tags_per_item):
+    from bot import BankSystem
+
+    directory = tempfile.mkdtemp()
+    bank = BankSystem(os.path.join(directory, "bench.db"), readers=2)
+    await bank.initialize()
+    try:
+        now = time.time()
+        names = [f"tag_{i}" for i in range(n_tags)]
+        await bank.write(lambda db: db.executemany(
+            "INSERT INTO market_trends (tag_name, saturation, saturation_updated) VALUES (?, ?, ?)",
+            ((name, float(random.randint(0, 500)), now - random.uniform(0, 30 * 86400)) for name in names)
+        ))
+        items = [random.sample(names, tags_per_item) for _ in range(1000)]
+
+        trends = MarketTrends(bank)
+        start = time.perf_counter()
+        await trends.load()
+        load = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for i in range(uploads):
+            values = await bank.write(lambda db, tags=items[i % 1000]: MarketTrends.record_uploads(db, tags))
+            trends.apply(values)
+        upload = (time.perf_counter() - start) / uploads
+
+        now = time.time()
+        start = time.perf_counter()
+        for i in range(reads):
+            trends.modifier(items[i % 1000], now)
+        read = (time.perf_counter() - start) / reads
+    finally:
+        await bank.close()
+        shutil.rmtree(directory, ignore_errors=True)
+    return load, upload, read
+
+def _stock_db(n_tags):
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE tag_stocks (
+            tag_name TEXT PRIMARY KEY,
+            current_price REAL DEFAULT 100.0,
+            total_volume INTEGER DEFAULT 0,
+            volatility REAL
+        )
+    """)
+    with conn:
+        conn.executemany(
+            "INSERT INTO tag_stocks (tag_name, current_price, volatility) VALUES (?, ?, ?)",
+            ((f"tag_{i}", random.uniform(1, 500), random.choice([None, 0.01, 0.05])) for i in range(n_tags))
+        )
+    return conn, path
+
+def _old_volatility(conn):
+    rows = conn.execute("SELECT tag_name, current_price FROM tag_stocks").fetchall()
+    for tag, price in rows:
+        new_price = max(1.0, price * (1.0 + random.uniform(-0.05, 0.05)))
+        conn.execute("UPDATE tag_stocks SET current_price = ? WHERE tag_name = ?", (new_price, tag))
+
+def _new_volatility(conn, mode, rng):
+    rows = conn.execute("SELECT rowid, current_price, volatility FROM tag_stocks").fetchall()
+    rowids = [r[0] for r in rows]
+    prices = np.array([r[1] for r in rows], dtype=np.float64)
+    if mode == "gbm":
+        sigma = np.array([r[2] if r[2] is not None else 0.03 for r in rows], dtype=np.float64)
+        new_prices = gbm_step(prices, sigma, rng=rng)
+    else:
+        new_prices = uniform_step(prices, 0.05, rng=rng)
+    conn.executemany("UPDATE tag_stocks SET current_price = ? WHERE rowid = ?", zip(new_prices.tolist(), rowids))
+
+def bench_volatility(n_tags):
+    """Seconds (write transaction held) for one hourly step: old loop, vectorized uniform, vectorized GBM."""
+    conn, path = _stock_db(n_tags)
+    rng = np.random.default_rng()
+    timings = []
+    for step in (_old_volatility, lambda c: _new_volatility(c, "uniform", rng), lambda c: _new_volatility(c, "gbm", rng)):
+        start = time.perf_counter()
+        with conn:
+            step(conn)
+        timings.append(time.perf_counter() - start)
+    conn.close()
+    os.remove(path)
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description="Market benchmarks")
+    parser.add_argument("--tags", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--reads", type=int, default=100000)
+    parser.add_argument("--uploads", type=int, default=1000)
+    parser.add_argument("--stocks", type=int, nargs="+", default=[10000, 100000])
+    args = parser.parse_args()
+
+    print("== Saturation decay: nightly sweep vs lazy decay on read ==")
+    # The sweep runs once a night; the lazy path pays load() once at startup and
+    # a write-back on every upload, so compare totals for your own traffic rather than a ratio.
+    print(f"{'tags':>10} | {'sweep (ms)':>10} | {'load (ms)':>9} | {'upload (us)':>11} | {'read (us)':>9}")
+    for n in args.tags:
+        sweep = bench_sweep(n)
+        load, upload, read = bench_lazy(n, args.reads, args.uploads)
+        print(f"{n:>10,} | {sweep * 1000:>10.2f} | {load * 1000:>9.2f} | {upload * 1e6:>11.1f} | {read * 1e6:>9.2f}")
+
+    print()
+    print("== Stock volatility: per-row UPDATE loop vs vectorized executemany ==")
+    print(f"{'tags':>10} | {'loop (ms)':>10} | {'uniform (ms)':>12} | {'gbm (ms)':>10} | {'speedup':>7}")
+    for n in args.stocks:
+        old, uniform, gbm = bench_volatility(n)
+        print(f"{n:>10,} | {old * 1000:>10.1f} | {uniform * 1000:>12.1f} | {gbm * 1000:>10.1f} | {old / uniform:>6.1f}x")
+
+if __name__ == "__main__":
+    main()
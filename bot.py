@@ -1,9 +1,13 @@
 import discord
 import aiosqlite
+import asyncio
 import os
+import time
+from contextlib import asynccontextmanager
 from discord.ext import commands
 
 from dotenv import load_dotenv
+from utils.migrations import BackgroundMigrator, migrate
 
 # -----------------------------------------------------------
 # 設定 (Configuration)
@@ -13,144 +17,288 @@ load_dotenv()
 TOKEN = os.getenv("DISCORD_TOKEN")
 HF_TOKEN = os.getenv("HF_TOKEN")
 DB_NAME = "economy.db"
+DB_READERS = int(os.getenv("DB_READERS", "4"))
 
 # -----------------------------------------------------------
-# Bank システム (Bank System)
+# 接続プール (Connection Pool)
 # -----------------------------------------------------------
-class BankSystem:
-    def __init__(self, db_path):
+class ConnectionPool:
+    """Long-lived aiosqlite connections: a fixed set of readers plus one writer.
+
+    Pragmas are applied once per connection and each connection keeps its own
+    prepared statement cache, so commands no longer pay for a fresh thread,
+    file open and WAL pragma on every call.
+    """
+
+    PRAGMAS = (
+        "PRAGMA busy_timeout = 60000",
+        "PRAGMA temp_store = MEMORY",
+    )
+
+    def __init__(self, db_path, readers=4, cached_statements=256):
         self.db_path = db_path
+        self.reader_count = max(1, readers)
+        self.cached_statements = cached_statements
+        self._readers = asyncio.Queue()
+        self._all_readers = []
+        self._writer = None
+        self._writer_lock = asyncio.Lock()
+        self._wait = {
+            'reader': {'count': 0, 'total': 0.0, 'max': 0.0},
+            'writer': {'count': 0, 'total': 0.0, 'max': 0.0},
+        }
 
-    async def initialize(self):
-        async with aiosqlite.connect(self.db_path, timeout=60.0) as db:
-            await db.execute("PRAGMA journal_mode=WAL")
-            # Bank table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS bank (
-                    user_id INTEGER,
-                    guild_id INTEGER,
-                    balance INTEGER DEFAULT 0,
-                    PRIMARY KEY (user_id, guild_id)
-                )
-            """)
-            # Market Items table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS market_items (
-                    item_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    seller_id INTEGER NOT NULL,
-                    image_url TEXT NOT NULL,
-                    image_hash TEXT,
-                    aesthetic_score REAL NOT NULL,
-                    price INTEGER NOT NULL,
-                    status TEXT DEFAULT 'on_sale',
-                    tags TEXT,
-                    grade TEXT,
-                    thread_id INTEGER,
-                    message_id INTEGER,
-                    buyer_id INTEGER,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Indices for market_items
-            await db.execute("CREATE INDEX IF NOT EXISTS idx_market_status ON market_items(status)")
-            await db.execute("CREATE INDEX IF NOT EXISTS idx_market_buyer ON market_items(buyer_id)")
-            await db.execute("CREATE INDEX IF NOT EXISTS idx_market_hash ON market_items(image_hash)")
-
-            # Market Trends table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS market_trends (
-                    tag_name TEXT PRIMARY KEY,
-                    current_price INTEGER DEFAULT 100,
-                    saturation INTEGER DEFAULT 0,
-                    trend_bonus INTEGER DEFAULT 0
-                )
-            """)
-            
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS user_galleries (
-                    user_id INTEGER PRIMARY KEY,
-                    thread_id INTEGER
-                )
-            """)
-            
-            # Daily Trends table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS daily_trends (
-                    date_key TEXT PRIMARY KEY,
-                    pose TEXT,
-                    costume TEXT,
-                    body TEXT
-                )
-            """)
-            
-            # Tag Metadata table (Danbooru Cache)
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS tag_metadata (
-                    tag_name TEXT PRIMARY KEY,
-                    post_count INTEGER,
-                    last_updated TIMESTAMP
-                )
-            """)
-            
-            # Tag Stock Market table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS tag_stocks (
-                    tag_name TEXT PRIMARY KEY,
-                    current_price REAL DEFAULT 100.0,
-                    total_volume INTEGER DEFAULT 0
-                )
-            """)
-
-            # User Stocks table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS user_stocks (
-                    user_id INTEGER,
-                    tag_name TEXT,
-                    amount INTEGER DEFAULT 0,
-                    average_cost REAL DEFAULT 0,
-                    PRIMARY KEY (user_id, tag_name)
-                )
-            """)
-            
-            # Migration check
-            try:
-                await db.execute("ALTER TABLE market_items ADD COLUMN image_hash TEXT")
-            except Exception:
-                pass 
-            try:
-                await db.execute("ALTER TABLE market_items ADD COLUMN tags TEXT")
-            except Exception:
-                pass
-            try:
-                await db.execute("ALTER TABLE market_items ADD COLUMN grade TEXT")
-            except Exception:
-                pass
-            try:
-                await db.execute("ALTER TABLE market_items ADD COLUMN thread_id INTEGER")
-            except Exception:
-                pass
+    async def _connect(self, read_only=False):
+        # The writer runs in autocommit mode; WriteQueue issues BEGIN/COMMIT itself.
+        extra = {} if read_only else {'isolation_level': None}
+        db = await aiosqlite.connect(
+            self.db_path, timeout=60.0, cached_statements=self.cached_statements, **extra
+        )
+        for pragma in self.PRAGMAS:
+            await db.execute(pragma)
+        if read_only:
+            await db.execute("PRAGMA query_only = ON")
+        return db
+
+    async def open(self):
+        if self._writer is not None: return
+        # The writer switches the file to WAL first so readers never block it.
+        self._writer = await self._connect()
+        await self._writer.execute("PRAGMA journal_mode=WAL")
+        for _ in range(self.reader_count):
+            db = await self._connect(read_only=True)
+            self._all_readers.append(db)
+            self._readers.put_nowait(db)
+
+    async def close(self):
+        for db in self._all_readers:
+            await db.close()
+        self._all_readers.clear()
+        self._readers = asyncio.Queue()
+        if self._writer is not None:
+            await self._writer.close()
+            self._writer = None
+
+    def _record_wait(self, kind, started):
+        waited = time.perf_counter() - started
+        stats = self._wait[kind]
+        stats['count'] += 1
+        stats['total'] += waited
+        if waited > stats['max']: stats['max'] = waited
+
+    @asynccontextmanager
+    async def reader(self):
+        """Borrows a read-only connection."""
+        started = time.perf_counter()
+        db = await self._readers.get()
+        self._record_wait('reader', started)
+        try:
+            yield db
+        finally:
+            self._readers.put_nowait(db)
+
+    @asynccontextmanager
+    async def writer(self):
+        """Holds the writer exclusively. An unfinished transaction is rolled back on exit.
+
+        Cogs should go through BankSystem.write() instead; this is for the write
+        queue and schema setup.
+        """
+        started = time.perf_counter()
+        async with self._writer_lock:
+            self._record_wait('writer', started)
             try:
-                await db.execute("ALTER TABLE market_items ADD COLUMN message_id INTEGER")
-            except Exception:
-                pass
+                yield self._writer
+            finally:
+                if self._writer.in_transaction:
+                    await self._writer.rollback()
+
+    def stats(self):
+        """Returns pool wait statistics (seconds) per connection kind."""
+        result = {}
+        for kind, stats in self._wait.items():
+            avg = stats['total'] / stats['count'] if stats['count'] else 0.0
+            result[kind] = {'count': stats['count'], 'avg_wait': avg, 'max_wait': stats['max']}
+        result['readers_idle'] = self._readers.qsize()
+        return result
+
+# -----------------------------------------------------------
+# 書き込みキュー (Single-Writer Group Commit)
+# -----------------------------------------------------------
+class WriteQueue:
+    """Single writer actor that runs transaction closures on the pool's writer.
+
+    A closure is ``async def txn(db)``; it must not commit, roll back or await
+    another write. Jobs that are queued together share one BEGIN/COMMIT (one
+    fsync), and each job runs inside its own SAVEPOINT so a failing job only
+    undoes its own changes. The caller gets the closure's return value, or its
+    exception, once the batch is committed.
+
+    ``on_commit`` (optional ``async fn(db)``) runs after every successful
+    COMMIT on the writer connection, before the callers are resumed. It must
+    not borrow a reader or submit writes.
+    """
+
+    def __init__(self, pool, max_batch=32, on_commit=None):
+        self.pool = pool
+        self.max_batch = max_batch
+        self.on_commit = on_commit
+        self._queue = asyncio.Queue()
+        self._task = None
+        self.batches = 0
+        self.jobs = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
             try:
-                await db.execute("ALTER TABLE market_items ADD COLUMN buyer_id INTEGER")
-            except Exception:
+                await self._task
+            except asyncio.CancelledError:
                 pass
-            
-            # Auction Columns
+            self._task = None
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("書き込みキューは停止しています。"))
+
+    async def submit(self, fn):
+        if self._task is None:
+            raise RuntimeError("書き込みキューは開始されていません。")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((fn, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
             try:
-                await db.execute("ALTER TABLE market_items ADD COLUMN auction_end_time TEXT")
-            except Exception: pass
+                await self._commit_batch(batch)
+            except Exception as e:
+                print(f"Write Queue Error: {e}")
+
+    async def _commit_batch(self, batch):
+        outcomes = []
+        async with self.pool.writer() as db:
             try:
-                await db.execute("ALTER TABLE market_items ADD COLUMN current_bid INTEGER DEFAULT 0")
-            except Exception: pass
+                await db.execute("BEGIN IMMEDIATE")
+                for fn, future in batch:
+                    if future.done():
+                        # Caller gave up (cancelled) before we got to it.
+                        outcomes.append(None)
+                        continue
+                    await db.execute("SAVEPOINT job")
+                    try:
+                        result = await fn(db)
+                    except Exception as e:
+                        await db.execute("ROLLBACK TO job")
+                        await db.execute("RELEASE job")
+                        outcomes.append((False, e))
+                    else:
+                        await db.execute("RELEASE job")
+                        outcomes.append((True, result))
+                await db.execute("COMMIT")
+            except Exception as e:
+                if db.in_transaction:
+                    await db.execute("ROLLBACK")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+
+            self.batches += 1
+            self.jobs += len(batch)
+            if self.on_commit is not None:
+                try:
+                    await self.on_commit(db)
+                except Exception as e:
+                    print(f"Write Queue on_commit Error: {e}")
+        for (_, future), outcome in zip(batch, outcomes):
+            if outcome is None or future.done(): continue
+            ok, value = outcome
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def stats(self):
+        return {'queued': self._queue.qsize(), 'batches': self.batches, 'jobs': self.jobs}
+
+# -----------------------------------------------------------
+# Bank システム (Bank System)
+# -----------------------------------------------------------
+class BankSystem:
+    def __init__(self, db_path, readers=4):
+        self.db_path = db_path
+        self.pool = ConnectionPool(db_path, readers=readers)
+        self.writes = WriteQueue(self.pool, on_commit=self._publish_balances)
+        # (user_id, guild_id) whose balance was touched since the last commit
+        self._dirty_balances = set()
+        # async fn({(user_id, guild_id): balance or None}) called with committed balances
+        # (from the writer task: in-memory updates only, no database access)
+        self.balance_listeners = []
+        self.migrator = BackgroundMigrator(self)
+
+    async def write(self, fn):
+        """Runs ``fn(db)`` as one transaction on the single writer and returns its result."""
+        return await self.writes.submit(fn)
+
+    def mark_dirty(self, user_id, guild_id):
+        """Flags a balance changed by raw SQL (the helpers below flag their own)."""
+        self._dirty_balances.add((user_id, guild_id))
+
+    async def _publish_balances(self, db):
+        """After a commit: re-reads the flagged balances and hands them to the listeners.
+
+        Values are read back rather than tracked, so jobs that were rolled back
+        only cause a harmless re-read. A deleted row is reported as None.
+        The read uses the writer connection (still held, right after COMMIT), so
+        the write queue never waits for a free reader.
+        """
+        if not self._dirty_balances or not self.balance_listeners:
+            self._dirty_balances.clear()
+            return
+        keys = list(self._dirty_balances)
+        self._dirty_balances.clear()
+        changes = dict.fromkeys(keys)
+        for i in range(0, len(keys), 400):
+            chunk = keys[i:i + 400]
+            where = " OR ".join(["(user_id = ? AND guild_id = ?)"] * len(chunk))
+            cursor = await db.execute(
+                f"SELECT user_id, guild_id, balance FROM bank WHERE {where}",
+                [v for key in chunk for v in key]
+            )
+            for user_id, guild_id, balance in await cursor.fetchall():
+                changes[(user_id, guild_id)] = balance
+        for listener in self.balance_listeners:
             try:
-                await db.execute("ALTER TABLE market_items ADD COLUMN top_bidder_id INTEGER")
-            except Exception: pass
-            
-            await db.commit()
+                await listener(changes)
+            except Exception as e:
+                print(f"Balance listener error: {e}")
+
+    async def close(self):
+        await self.migrator.stop()
+        await self.writes.stop()
+        await self.pool.close()
+
+    async def initialize(self):
+        await self.pool.open()
+        # Versioned schema steps (utils/migrations.py); an up-to-date database runs no DDL here.
+        async with self.pool.writer() as db:
+            await migrate(db)
+            # Smuggle reservations left 'pending' by a crash/restart before their gallery post:
+            # otherwise they block the URL and pHash forever as duplicates of an item that doesn't exist.
+            cursor = await db.execute("DELETE FROM market_items WHERE status = 'pending'")
+            if cursor.rowcount:
+                print(f"Dropped {cursor.rowcount} unfinished smuggle reservations.")
+        self.writes.start()
+        # Index builds / backfills run in batches through the write queue after startup
+        self.migrator.start()
 
     async def get_balance(self, user: discord.Member, db_conn=None) -> int:
         if db_conn:
@@ -161,8 +309,7 @@ class BankSystem:
             row = await cursor.fetchone()
             return row[0] if row else 0
         else:
-            async with aiosqlite.connect(self.db_path, timeout=60.0) as db:
-                await db.execute("PRAGMA journal_mode=WAL")
+            async with self.pool.reader() as db:
                 return await self.get_balance(user, db)
 
     async def set_balance(self, user: discord.Member, amount: int, db_conn=None):
@@ -177,11 +324,9 @@ class BankSystem:
 
         if db_conn:
             await db_conn.execute(sql, params)
+            self.mark_dirty(user.id, user.guild.id)
         else:
-            async with aiosqlite.connect(self.db_path, timeout=60.0) as db:
-                await db.execute("PRAGMA journal_mode=WAL")
-                await db.execute(sql, params)
-                await db.commit()
+            await self.write(lambda db: self.set_balance(user, amount, db))
 
     async def deposit_credits(self, user: discord.Member, amount: int, db_conn=None):
         if amount <= 0: raise ValueError("支給額は0より大きくなければなりません。")
@@ -195,11 +340,9 @@ class BankSystem:
 
         if db_conn:
             await db_conn.execute(sql, params)
+            self.mark_dirty(user.id, user.guild.id)
         else:
-            async with aiosqlite.connect(self.db_path, timeout=60.0) as db:
-                await db.execute("PRAGMA journal_mode=WAL")
-                await db.execute(sql, params)
-                await db.commit()
+            await self.write(lambda db: self.deposit_credits(user, amount, db))
 
     async def withdraw_credits(self, user: discord.Member, amount: int, db_conn=None):
         if amount <= 0: raise ValueError("引き落とし額は0より大きくなければなりません。")
@@ -214,12 +357,10 @@ class BankSystem:
                 "UPDATE bank SET balance = balance - ? WHERE user_id = ? AND guild_id = ?",
                 (amount, user.id, user.guild.id)
             )
+            self.mark_dirty(user.id, user.guild.id)
         else:
-            async with aiosqlite.connect(self.db_path, timeout=60.0) as db:
-                await db.execute("PRAGMA journal_mode=WAL")
-                # We pass 'db' to reuse this connection
-                await self.withdraw_credits(user, amount, db)
-                await db.commit()
+            # The closure reuses the writer connection for the balance check
+            await self.write(lambda db: self.withdraw_credits(user, amount, db))
 
     async def transfer_credits(self, sender: discord.Member, receiver: discord.Member, amount: int, db_conn=None):
         if amount <= 0: raise ValueError("送金額は0より大きくなければなりません。")
@@ -229,15 +370,8 @@ class BankSystem:
              await self.withdraw_credits(sender, amount, db_conn)
              await self.deposit_credits(receiver, amount, db_conn)
         else:
-            async with aiosqlite.connect(self.db_path, timeout=60.0) as db:
-                await db.execute("PRAGMA journal_mode=WAL")
-                await db.execute("BEGIN TRANSACTION")
-                try:
-                    await self.transfer_credits(sender, receiver, amount, db)
-                    await db.commit()
-                except Exception as e:
-                    await db.rollback()
-                    raise e
+            # Either both legs commit or the job's savepoint rolls both back
+            await self.write(lambda db: self.transfer_credits(sender, receiver, amount, db))
 
 # -----------------------------------------------------------
 # Bot クラス (Bot Class)
@@ -248,7 +382,7 @@ class EconomyBot(commands.Bot):
         intents.message_content = True
         intents.members = True
         super().__init__(command_prefix="!", intents=intents)
-        self.bank = BankSystem(DB_NAME)
+        self.bank = BankSystem(DB_NAME, readers=DB_READERS)
         self.hf_token = HF_TOKEN
 
     async def setup_hook(self):
@@ -259,6 +393,7 @@ class EconomyBot(commands.Bot):
             "cogs.market",
             "cogs.broker",
             "cogs.stocks",
+            "cogs.leaderboard",
             "cogs.setup",
         ]
         for extension in self.initial_extensions:
@@ -268,6 +403,10 @@ class EconomyBot(commands.Bot):
             except Exception as e:
                 print(f"ロード失敗 {extension}: {e}")
 
+    async def close(self):
+        await super().close()
+        await self.bank.close()
+
 if __name__ == "__main__":
     bot = EconomyBot()
     
@@ -47,6 +47,28 @@ class BankCog(commands.Cog):
         except ValueError as e:
             await ctx.send(f"❌ {str(e)}")
 
+    @commands.command(name="dbstats")
+    @commands.has_permissions(administrator=True)
+    async def dbstats(self, ctx):
+        """(管理者) DB接続プールの待ち時間を表示"""
+        stats = self.bot.bank.pool.stats()
+        embed = discord.Embed(title="🗄️ DB Pool", color=discord.Color.dark_grey())
+        for kind in ("reader", "writer"):
+            s = stats[kind]
+            embed.add_field(
+                name=kind,
+                value=f"取得: `{s['count']:,}`\n平均待ち: `{s['avg_wait'] * 1000:.2f} ms`\n最大待ち: `{s['max_wait'] * 1000:.2f} ms`",
+                inline=True
+            )
+        migrations = self.bot.bank.migrator.stats()
+        embed.add_field(
+            name="migrations",
+            value=f"未完了: `{', '.join(migrations['pending']) or 'なし'}`\nバッチ: `{migrations['batches']:,}`",
+            inline=False
+        )
+        embed.set_footer(text=f"待機中のReader: {stats['readers_idle']}")
+        await ctx.send(embed=embed)
+
 
     @commands.command(name="daily")
     async def daily(self, ctx):
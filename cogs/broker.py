@@ -2,19 +2,30 @@ import discord
 from discord.ext import commands, tasks
 from gradio_client import Client, handle_file
 import asyncio
-import aiosqlite
 import os
 import aiohttp
 import uuid
+import hashlib
+import sqlite3
+import heapq
 import traceback
 import imagehash
 from PIL import Image
 import random
 import csv
 import json
-import math
+from urllib.parse import urlsplit, urlunsplit
 from datetime import datetime, time, timedelta
-from utils.bloom_filter import BloomFilter
+from utils.bloom_filter import ScalableBloomFilter
+from utils.phash_index import PHashIndex
+from utils.hash_matrix import HashMatrix
+from utils.ai_pool import AIWorkerPool, AIPoolBusy, ModelPool
+from utils.appraisal_cache import AppraisalCache
+from utils.tag_metadata import TagMetadataService
+from utils.tag_rarity import TagRarityTable
+from utils.rate_limiter import TokenBucket
+from utils.market_trends import MarketTrends
+from utils.count_min_sketch import TagActivity
 
 class InventoryView(discord.ui.View):
     def __init__(self, ctx, items, per_page=5):
@@ -97,19 +108,14 @@ class ResellPriceModal(discord.ui.Modal, title="再販価格の設定"):
              await interaction.response.send_message("❌ 価格は100以上の整数で入力してください。", ephemeral=True)
              return
 
-        async with aiosqlite.connect(self.bot.bank.db_path, timeout=60.0) as db:
+        async def txn(db):
             # Re-verify ownership
             cursor = await db.execute("""
                 SELECT thread_id, message_id, tags, aesthetic_score FROM market_items 
                 WHERE item_id = ? AND buyer_id = ? AND status IN ('sold', 'owned')
             """, (self.item_id, interaction.user.id))
             row = await cursor.fetchone()
-            
-            if not row:
-                await interaction.response.send_message("❌ エラー: アイテムを所有していないか、既に販売中です。", ephemeral=True)
-                return
-            
-            thread_id, message_id, tags, score = row
+            if not row: return None
             
             # Update DB
             await db.execute("""
@@ -117,48 +123,58 @@ class ResellPriceModal(discord.ui.Modal, title="再販価格の設定"):
                 SET status = 'on_sale', price = ?, seller_id = ?, buyer_id = NULL 
                 WHERE item_id = ?
             """, (price, interaction.user.id, self.item_id))
-            await db.commit()
-            
-            # Update Gallery Message
-            try:
-                guild = interaction.guild
-                thread = guild.get_thread(thread_id)
-                if not thread:
-                     try: thread = await guild.fetch_channel(thread_id)
-                     except: pass
-                
-                if thread:
-                     try:
-                         msg = await thread.fetch_message(message_id)
-                         
-                         # Edit Embed
-                         embed = msg.embeds[0]
-                         embed.clear_fields()
-                         embed.title = "🔄 再販中 (Resale)"
-                         embed.color = discord.Color.orange()
-                         
-                         tags_str = tags if tags else "None"
-                         grade = "B"
-                         if score >= 9.0: grade = "S"
-                         elif score >= 7.0: grade = "A"
-                         
-                         embed.add_field(name="ID", value=f"**#{self.item_id}**", inline=True)
-                         embed.add_field(name="販売者", value=interaction.user.mention, inline=True)
-                         embed.add_field(name="価格", value=f"💰 {price:,}", inline=True)
-                         embed.add_field(name="グレード", value=f"**{grade}** ({score:.2f})", inline=True)
-                         embed.add_field(name="特徴 (Tags)", value=tags_str, inline=False)
-                         
-                         from cogs.market import BuyView
-                         await msg.edit(content=f"📢 **再販中!** (ID: {self.item_id})", embed=embed, view=BuyView(self.bot))
-                         
-                         await interaction.response.send_message(f"✅ **再販設定完了！** (ID: {self.item_id}, Price: {price:,})\n🔗 {msg.jump_url}")
-                         return
-                     except Exception as e:
-                         print(f"Failed to edit msg: {e}")
-            except Exception as e:
-                print(f"Resell Error: {e}")
+            return row
+
+        row = await self.bot.bank.write(txn)
+        if not row:
+            await interaction.response.send_message("❌ エラー: アイテムを所有していないか、既に販売中です。", ephemeral=True)
+            return
+        
+        thread_id, message_id, tags, score = row
+        market = self.bot.get_cog("MarketCog")
+        if market:
+            market.message_routes.put(message_id, self.item_id, 'on_sale')
+        
+        # Update Gallery Message
+        try:
+            guild = interaction.guild
+            thread = guild.get_thread(thread_id)
+            if not thread:
+                 try: thread = await guild.fetch_channel(thread_id)
+                 except: pass
             
-            await interaction.response.send_message(f"✅ **再販設定完了(DBのみ)**: 元のメッセージが見つかりませんでしたが、販売リストには追加されました。")
+            if thread:
+                 try:
+                     msg = await thread.fetch_message(message_id)
+                     
+                     # Edit Embed
+                     embed = msg.embeds[0]
+                     embed.clear_fields()
+                     embed.title = "🔄 再販中 (Resale)"
+                     embed.color = discord.Color.orange()
+                     
+                     tags_str = tags if tags else "None"
+                     grade = "B"
+                     if score >= 9.0: grade = "S"
+                     elif score >= 7.0: grade = "A"
+                     
+                     embed.add_field(name="ID", value=f"**#{self.item_id}**", inline=True)
+                     embed.add_field(name="販売者", value=interaction.user.mention, inline=True)
+                     embed.add_field(name="価格", value=f"💰 {price:,}", inline=True)
+                     embed.add_field(name="グレード", value=f"**{grade}** ({score:.2f})", inline=True)
+                     embed.add_field(name="特徴 (Tags)", value=tags_str, inline=False)
+                     
+                     from cogs.market import BuyView
+                     await msg.edit(content=f"📢 **再販中!** (ID: {self.item_id})", embed=embed, view=BuyView(self.bot))
+                     
+                     await interaction.response.send_message(f"✅ **再販設定完了！** (ID: {self.item_id}, Price: {price:,})\n🔗 {msg.jump_url}")
+                     return
+                 except Exception as e:
+                     print(f"Failed to edit msg: {e}")
+        except Exception as e:
+            print(f"Resell Error: {e}")
+        
+        await interaction.response.send_message(f"✅ **再販設定完了(DBのみ)**: 元のメッセージが見つかりませんでしたが、販売リストには追加されました。")
 
 class ResellSelect(discord.ui.Select):
     def __init__(self, bot, items):
@@ -184,6 +200,8 @@ class ResellSelectView(discord.ui.View):
 
 
 class BrokerCog(commands.Cog):
+    BUSY_MESSAGE = "🚧 **闇市は混雑しています。** 鑑定人の手が空いていません。しばらくしてから再度お試しください。"
+
     def __init__(self, bot):
         self.bot = bot
         self.ai_client_score = None
@@ -192,21 +210,63 @@ class BrokerCog(commands.Cog):
         self.tag_data = {} # category: [tags]
         self.load_tag_data()
         
-        # AI Queue System
-        self.ai_queue = asyncio.Queue()
-        self.ai_worker_task = self.bot.loop.create_task(self.ai_worker())
+        # AI Worker Pool (one bounded queue + thread pool per model, started in cog_load)
+        # Jobs older than ai_timeout are dropped by the workers instead of being run for nobody.
+        self.ai_timeout = 30.0
+        self.ai_pool = self.setup_ai_pool()
+        # Appraisals of already seen images (same bytes, or same pHash) skip the AI entirely.
+        self.appraisal_cache = AppraisalCache(self.bot.bank)
+        # Danbooru tag counts (DB cache + batched, de-duplicated fetches over one session)
+        self.tag_service = TagMetadataService(self.bot.bank)
+        # Offline tag -> post_count table from a bulk dump (import_tags.py); live fetches only for tags it lacks.
+        self.rarity_table = TagRarityTable()
+        self.bot.loop.create_task(self.load_rarity_table())
+        # Background refresh of taxonomy/popular tags: <= 2 requests in flight, ~1 request/s.
+        self.tag_prefetch_limiter = TokenBucket(rate=1.0, capacity=2)
+        self.tag_prefetch_concurrency = 2
         
-        # Initialize Bloom Filter (Capacity 10000, 0.1% error)
-        self.bloom = BloomFilter(capacity=10000, error_rate=0.001)
+        # Initialize Bloom Filter (first slice 10000, grows as needed, 0.1% error overall)
+        self.bloom = ScalableBloomFilter(initial_capacity=10000, error_rate=0.001)
         self.bot.loop.create_task(self.initialize_bloom_filter())
         
+        # Near-duplicate index over market_items.image_hash (filled in cog_load)
+        # plus the same hashes as a numpy array for vectorized/bulk comparisons.
+        self.phash_index = PHashIndex()
+        self.hash_matrix = HashMatrix()
+        
+        # Tag saturation, read from memory on every appraisal (loaded in cog_load)
+        self.market_trends = MarketTrends(self.bot.bank)
+        
+        # 直近7日間のタグ出品数(supply)/購入数(demand)。Count-Min Sketch なのでタグ数に依らず一定メモリ。
+        # Only for !trends: pricing keeps the exact, continuously decayed market_trends rows (see MarketTrends),
+        # and tag_stocks rows are instruments that holdings refer to, so neither table is bounded by the sketch.
+        self.tag_supply = TagActivity.load_from_file("tag_supply.bin") or TagActivity()
+        self.tag_demand = TagActivity.load_from_file("tag_demand.bin") or TagActivity()
+        
         self.daily_task_loop.start()
+        self.tag_prefetch_loop.start()
+
+    async def cog_load(self):
+        self.ai_pool.start()
+        await self.load_phash_index()
+        await self.appraisal_cache.load()
+        await self.market_trends.load()
 
     def cog_unload(self):
         self.daily_task_loop.cancel()
-        self.ai_worker_task.cancel()
+        self.tag_prefetch_loop.cancel()
+        self.bot.loop.create_task(self.ai_pool.stop())
+        self.bot.loop.create_task(self.tag_service.close())
         # Save Bloom Filter on unload
         self.bloom.save_to_file("bloom_filter.bin")
+        self.save_tag_activity()
+
+    def save_tag_activity(self):
+        try:
+            self.tag_supply.save_to_file("tag_supply.bin")
+            self.tag_demand.save_to_file("tag_demand.bin")
+        except Exception as e:
+            print(f"Failed to save tag activity: {e}")
 
     def setup_clients(self):
         try:
@@ -219,6 +279,27 @@ class BrokerCog(commands.Cog):
             self.ai_client_score = None
             self.ai_client_tag = None
 
+    def setup_ai_pool(self):
+        """
+        Builds a worker pool per model. Concurrency comes from AI_TAG_WORKERS / AI_SCORE_WORKERS,
+        the per-model queue limit from AI_QUEUE_LIMIT.
+        The clients created in setup_clients seed the first thread; other threads create their own.
+        """
+        token = getattr(self.bot, 'hf_token', None)
+        max_queue = int(os.getenv("AI_QUEUE_LIMIT", "16"))
+        pool = AIWorkerPool()
+        if self.ai_client_tag:
+            pool.register('tag', ModelPool(
+                'tag', lambda: Client("SmilingWolf/wd-tagger", token=token), self._run_predict_sync,
+                concurrency=int(os.getenv("AI_TAG_WORKERS", "2")), max_queue=max_queue, seed_client=self.ai_client_tag
+            ))
+        if self.ai_client_score:
+            pool.register('score', ModelPool(
+                'score', lambda: Client("Eugeoter/waifu-scorer-v3", token=token), self._run_predict_sync,
+                concurrency=int(os.getenv("AI_SCORE_WORKERS", "2")), max_queue=max_queue, seed_client=self.ai_client_score
+            ))
+        return pool
+
     def load_tag_data(self):
         try:
             with open('tags.json', 'r', encoding='utf-8') as f:
@@ -232,64 +313,107 @@ class BrokerCog(commands.Cog):
     async def daily_task_loop(self):
         """Runs daily to update trends (approximated)"""
         await self.update_daily_trends()
-        await self.decay_saturation()
+        self.save_tag_activity()
+
+    @tasks.loop(hours=6)
+    async def tag_prefetch_loop(self):
+        """
+        Refreshes Danbooru counts for every tags.json tag and the most uploaded tags
+        before their 30-day cache expires, so smuggles rarely have to wait on the API.
+        """
+        tags = [t for cat_tags in self.tag_data.values() for t in cat_tags]
+        now = datetime.now().timestamp()
+        tags += heapq.nlargest(500, self.market_trends.saturation, key=lambda t: self.market_trends.current(t, now))
+        tags = [t for t in dict.fromkeys(tags) if t not in self.rarity_table]
+
+        # Missing / soonest-to-expire first; anything expiring within 3 days is refreshed now.
+        stale = await self.tag_service.stale_tags(tags, margin=timedelta(days=3))
+        if not stale:
+            return
+
+        size = self.tag_service.batch_size
+        batches = [stale[i:i + size] for i in range(0, len(stale), size)]
+        sem = asyncio.Semaphore(self.tag_prefetch_concurrency)
+
+        async def run(batch):
+            async with sem:
+                await self.tag_prefetch_limiter.acquire()
+                return await self.tag_service.refresh(batch)
+
+        results = await asyncio.gather(*(run(b) for b in batches), return_exceptions=True)
+        refreshed = sum(len(r) for r in results if isinstance(r, dict))
+        print(f"Tag Prefetch: {refreshed}/{len(stale)} tags refreshed in {len(batches)} requests.")
+
+    @tag_prefetch_loop.before_loop
+    async def before_tag_prefetch(self):
+        await self.bot.wait_until_ready()
 
     async def initialize_bloom_filter(self):
-        """Loads valid image hashes. Tries file first, then DB."""
+        """Loads the saved filter, then replays only market_items rows added since it was saved."""
         await self.bot.wait_until_ready()
         print("Initializing Bloom Filter...")
         
-        # Try loading from file
-        loaded_bloom = BloomFilter.load_from_file("bloom_filter.bin")
+        loaded_bloom = ScalableBloomFilter.load_from_file("bloom_filter.bin")
         if loaded_bloom:
+            # Items added while we were loading are already committed, so the replay below covers them.
             self.bloom = loaded_bloom
-            print(f"Bloom Filter loaded from file. Size eq: {len(self.bloom)}")
-            # Optional: We could load *new* items from DB here if we tracked last_id.
-            # For now, we assume the file is reasonably fresh or we just accept the gap until next save.
-            return
+            print(f"Bloom Filter loaded from file. Items: {len(self.bloom)}, last_item_id: {self.bloom.last_item_id}")
 
         count = 0
-        async with aiosqlite.connect(self.bot.bank.db_path, timeout=60.0) as db:
-            # 1. Load URLs (to prevent re-downloading known links)
-            cursor = await db.execute("SELECT image_url, image_hash FROM market_items")
-            rows = await cursor.fetchall()
-            
-            for url, img_hash in rows:
-                if url: self.bloom.add(url)
+        async with self.bot.bank.pool.reader() as db:
+            # URLs (to prevent re-downloading known links) + hashes, newer than the saved state only
+            cursor = await db.execute(
+                "SELECT item_id, image_url, image_hash FROM market_items WHERE item_id > ? ORDER BY item_id",
+                (self.bloom.last_item_id,)
+            )
+            async for item_id, url, img_hash in cursor:
+                if url:
+                    self.bloom.add(url)
+                    self.bloom.add(self._canonical_url(url))
                 if img_hash: self.bloom.add(img_hash)
+                self.bloom.seen_item(item_id)
                 count += 1
                 
-        print(f"Bloom Filter Rebuilt with {count} items.")
-        self.bloom.save_to_file("bloom_filter.bin")
+        print(f"Bloom Filter caught up with {count} new items ({len(self.bloom.slices)} slices).")
+        if count or not loaded_bloom:
+            self.bloom.save_to_file("bloom_filter.bin")
 
-    async def ai_worker(self):
-        """Worker to process AI requests sequentially."""
-        print("AI Worker Started.")
-        while True:
-            try:
-                # task_type: 'tag' or 'score'
-                # future: asyncio.Future to set result
-                task_type, file_path, future = await self.ai_queue.get()
-                
+    def _build_rarity_table(self):
+        # A plain sqlite3 read-only connection streams rows straight into the table (no intermediate list).
+        conn = sqlite3.connect(f"file:{self.bot.bank.db_path}?mode=ro", uri=True)
+        try:
+            # ORDER BY uses the BINARY collation, i.e. the UTF-8 byte order TagRarityTable expects.
+            return TagRarityTable.from_sorted(conn.execute(
+                "SELECT tag_name, post_count FROM tag_metadata WHERE source = 'dump' ORDER BY tag_name"
+            ))
+        finally:
+            conn.close()
+
+    async def load_rarity_table(self):
+        """Loads the bulk-imported tag counts into memory."""
+        try:
+            table = await asyncio.to_thread(self._build_rarity_table)
+        except Exception as e:
+            print(f"Failed to load tag rarity table: {e}")
+            return
+        self.rarity_table = table
+        print(f"Tag Rarity Table Loaded: {len(table):,} tags ({table.nbytes() / 1024 / 1024:.1f} MB).")
+
+    async def load_phash_index(self):
+        """Loads every stored pHash into the near-duplicate index and the hash matrix."""
+        index = PHashIndex()
+        matrix = HashMatrix()
+        async with self.bot.bank.pool.reader() as db:
+            cursor = await db.execute("SELECT item_id, image_hash FROM market_items WHERE image_hash IS NOT NULL")
+            async for item_id, img_hash in cursor:
                 try:
-                    res = None
-                    if task_type == 'tag':
-                        res = await asyncio.to_thread(self._run_predict_sync, self.ai_client_tag, file_path)
-                    elif task_type == 'score':
-                        res = await asyncio.to_thread(self._run_predict_sync, self.ai_client_score, file_path)
-                    
-                    if not future.done():
-                        future.set_result(res)
-                except Exception as e:
-                    if not future.done():
-                        future.set_exception(e)
-                finally:
-                    self.ai_queue.task_done()
-                    
-            except asyncio.CancelledError:
-                break
-            except Exception as e:
-                print(f"AI Worker Error: {e}")
+                    index.add(img_hash)
+                    matrix.append(item_id, img_hash)
+                except ValueError:
+                    continue
+        self.phash_index = index
+        self.hash_matrix = matrix
+        print(f"pHash Index Loaded: {len(index)} hashes.")
 
     @daily_task_loop.before_loop
     async def before_daily_task(self):
@@ -314,14 +438,12 @@ class BrokerCog(commands.Cog):
         
         date_key = datetime.now().strftime("%Y-%m-%d")
         
-        async with aiosqlite.connect(self.bot.bank.db_path, timeout=60.0) as db:
-            # Clear old trends or just overwrite for the day
-            # We store by date_key just in case
-            await db.execute("""
-                INSERT OR REPLACE INTO daily_trends (date_key, pose, costume, body)
-                VALUES (?, ?, ?, ?)
-            """, (date_key, today_trends.get('pose'), today_trends.get('costume'), today_trends.get('body')))
-            await db.commit()
+        # Clear old trends or just overwrite for the day
+        # We store by date_key just in case
+        await self.bot.bank.write(lambda db: db.execute("""
+            INSERT OR REPLACE INTO daily_trends (date_key, pose, costume, body)
+            VALUES (?, ?, ?, ?)
+        """, (date_key, today_trends.get('pose'), today_trends.get('costume'), today_trends.get('body'))))
         
         print(f"Updated Daily Trends for {date_key}: {today_trends}")
         
@@ -343,15 +465,15 @@ class BrokerCog(commands.Cog):
 
     async def get_current_trends(self):
         date_key = datetime.now().strftime("%Y-%m-%d")
-        async with aiosqlite.connect(self.bot.bank.db_path, timeout=60.0) as db:
+        async with self.bot.bank.pool.reader() as db:
             cursor = await db.execute("SELECT pose, costume, body FROM daily_trends WHERE date_key = ?", (date_key,))
             row = await cursor.fetchone()
-            if row:
-                return {'pose': row[0], 'costume': row[1], 'body': row[2]}
-            else:
-                # Force update if missing
-                await self.update_daily_trends()
-                return await self.get_current_trends()
+        if row:
+            return {'pose': row[0], 'costume': row[1], 'body': row[2]}
+        else:
+            # Force update if missing (reader is released first so the pool can't starve)
+            await self.update_daily_trends()
+            return await self.get_current_trends()
 
     def _run_predict_sync(self, client, file_path):
         """Run prediction in a separate thread"""
@@ -373,21 +495,10 @@ class BrokerCog(commands.Cog):
         if not current_hash:
             return 10, "Unknown Error", 0
         
-        async with aiosqlite.connect(self.bot.bank.db_path, timeout=60.0) as db:
-            cursor = await db.execute("SELECT image_hash FROM market_items WHERE image_hash IS NOT NULL")
-            rows = await cursor.fetchall()
-
-        current_hash_obj = imagehash.hex_to_hash(current_hash)
-        min_dist = 100
-        
-        for (db_hash_str,) in rows:
-            try:
-                db_hash_obj = imagehash.hex_to_hash(db_hash_str)
-                dist = current_hash_obj - db_hash_obj
-                if dist < min_dist:
-                    min_dist = dist
-            except:
-                continue
+        # Only distances within the threshold matter, so ask the index for those.
+        min_dist = self.phash_index.nearest(current_hash, max_distance=5)
+        if min_dist is None:
+            min_dist = 100
 
         if min_dist <= 5:
             return 100, f"⛔ **重複警告** (類似度: {min_dist})", min_dist
@@ -395,33 +506,16 @@ class BrokerCog(commands.Cog):
             return 0, f"✅ **確認完了** (新規アイテム)", min_dist
 
     async def update_market_trends(self, tags, db_conn=None):
-        """Update saturation for tags on new upload."""
+        """
+        Update saturation for tags on new upload.
+        Saturation decays lazily (half-life ~6.58 days, see MarketTrends), so there is no daily sweep.
+        """
         if db_conn:
-            for tag in tags:
-                await db_conn.execute("INSERT OR IGNORE INTO market_trends (tag_name) VALUES (?)", (tag,))
-                await db_conn.execute("""
-                    UPDATE market_trends 
-                    SET saturation = saturation + 1
-                    WHERE tag_name = ?
-                """, (tag,))
-        else:
-            async with aiosqlite.connect(self.bot.bank.db_path, timeout=60.0) as db:
-                await self.update_market_trends(tags, db)
-                await db.commit()
-
-    async def decay_saturation(self):
-        """Called daily to reduce saturation."""
-        async with aiosqlite.connect(self.bot.bank.db_path, timeout=60.0) as db:
-            # Decay by 10% or at least 1
-            await db.execute("""
-                UPDATE market_trends 
-                SET saturation = CAST(saturation * 0.9 AS INTEGER) 
-                WHERE saturation > 0
-            """)
-            await db.commit()
-        print("Daily Saturation Decay Applied.")
-
-
+            # Caller mirrors the returned values in memory (market_trends.apply) after its transaction commits.
+            return await MarketTrends.record_uploads(db_conn, tags)
+        values = await self.bot.bank.write(lambda db: MarketTrends.record_uploads(db, tags))
+        self.market_trends.apply(values)
+        return values
 
     async def get_tag_value_modifier(self, tags):
         # Logarithmic Saturation Decay
@@ -429,33 +523,8 @@ class BrokerCog(commands.Cog):
         # Base saturation starts at 0.
         # If saturation is 100 -> log10(102) ~ 2.0 -> Mult ~ 0.5
         # If saturation is 500 -> log10(502) ~ 2.7 -> Mult ~ 0.37
-        
-        multiplier = 1.0
-        async with aiosqlite.connect(self.bot.bank.db_path, timeout=60.0) as db:
-            for tag in tags:
-                cursor = await db.execute("SELECT current_price, saturation FROM market_trends WHERE tag_name = ?", (tag,))
-                row = await cursor.fetchone()
-                
-                if row:
-                    price, sat = row
-                    # Apply saturation penalty
-                    # Use a weighted average or minimum multiplier?
-                    # Let's use the WORST modifier (the most saturated tag pulls down the whole value)
-                    # Or average? Average feels fairer.
-                    
-                    sat_mult = 1.0 / math.log10(max(sat, 0) + 2)
-                    
-                    # Accumulate? Let's average the multipliers of known tags
-                    # But we need to handle "no record" tags as 1.0
-                    # This logic is complex. Simplified:
-                    # Modify the aggregate multiplier by the impact of this tag.
-                    # Let's take the Minimum modifier found.
-                    if sat_mult < multiplier:
-                         multiplier = sat_mult
-        
-        return max(multiplier, 0.1)
-
-
+        # The most saturated tag pulls down the whole value (minimum), from the in-memory copy.
+        return self.market_trends.modifier(tags)
 
     @commands.command(name="trends")
     async def trends(self, ctx):
@@ -469,36 +538,80 @@ class BrokerCog(commands.Cog):
         embed.add_field(name="💃 姿勢 (Pose)", value=f"`{trends.get('pose', 'None')}`", inline=True)
         embed.add_field(name="👗 衣装 (Costume)", value=f"`{trends.get('costume', 'None')}`", inline=True)
         embed.add_field(name="👀 特徴 (Body)", value=f"`{trends.get('body', 'None')}`", inline=True)
+        supply = self.tag_supply.hottest(5)
+        demand = self.tag_demand.hottest(5)
+        if supply:
+            embed.add_field(name="📦 今週の出品が多いタグ", value="\n".join(f"`{t}` ×{c}" for t, c in supply), inline=True)
+        if demand:
+            embed.add_field(name="🛒 今週よく売れたタグ", value="\n".join(f"`{t}` ×{c}" for t, c in demand), inline=True)
         embed.set_footer(text="毎日 朝6:00 更新")
         await ctx.send(embed=embed)
 
+    @staticmethod
+    def _canonical_url(url):
+        """Strips the query string (Discord CDN signatures: ex/is/hm) so the same attachment always maps to one key."""
+        parts = urlsplit(url)
+        return urlunsplit((parts.scheme, parts.netloc, parts.path, "", ""))
+
+    async def _find_item_by_url(self, url):
+        """
+        Exact lookup of an already listed attachment URL (uses idx_market_url).
+        Stored URLs keep their query string, so match the canonical URL itself
+        or any "<canonical>?..." in one index range scan.
+        """
+        canonical = self._canonical_url(url)
+        async with self.bot.bank.pool.reader() as db:
+            cursor = await db.execute(
+                "SELECT item_id FROM market_items WHERE image_url = ? OR (image_url >= ? AND image_url < ?) LIMIT 1",
+                (canonical, canonical + "?", canonical + "@")
+            )
+            row = await cursor.fetchone()
+        return row[0] if row else None
+
     async def _download_and_hash(self, url):
-        """Downloads image from URL and calculates pHash."""
+        """Downloads image from URL and calculates pHash. Returns (temp_path, img_hash, sha256 digest)."""
         temp_path = f"temp_{uuid.uuid4()}.png"
         try:
             async with aiohttp.ClientSession() as session:
                 async with session.get(url) as resp:
-                    if resp.status != 200: return None, None
+                    if resp.status != 200: return None, None, None
                     data = await resp.read()
             with open(temp_path, "wb") as f: f.write(data)
             
+            digest = hashlib.sha256(data).hexdigest()
             img_hash = await asyncio.to_thread(self.calculate_phash, temp_path)
-            return temp_path, img_hash
+            return temp_path, img_hash, digest
         except Exception as e:
             print(f"Download Error: {e}")
             if os.path.exists(temp_path): os.remove(temp_path)
-            return None, None
+            return None, None, None
+
+    def _select_tags(self, confidences, character_confidences):
+        """Thresholds tagger confidences. Returns (tag_list, tags_str, character_list)."""
+        sorted_tags = sorted(confidences.items(), key=lambda x: x[1], reverse=True)
+        tag_list = [t[0] for t in sorted_tags if t[1] > 0.35][:20]
+
+        sorted_chars = sorted(character_confidences.items(), key=lambda x: x[1], reverse=True)
+        character_list = [c[0] for c in sorted_chars if c[1] > 0.5] # Higher threshold for chars
+
+        return tag_list, ", ".join(tag_list), character_list
+
+    async def _run_tagger(self, file_path, digest=None, img_hash=None, cached=None):
+        """
+        Runs the tagger AI via the worker pool. Returns (tag_list, tags_str, character_list).
+        `cached` is the caller's appraisal cache entry; if it has tags the inference is skipped.
+        """
+        if cached and cached['tags'] is not None:
+            return self._select_tags(cached['tags'], cached['characters'] or {})
 
-    async def _run_tagger(self, file_path):
-        """Runs the tagger AI via Queue. Returns (tag_list, tags_str, character_list)."""
         if not self.ai_client_tag: return [], "", []
         
-        future = self.bot.loop.create_future()
-        await self.ai_queue.put(('tag', file_path, future))
+        # Raises AIPoolBusy when the queue is full; smuggle turns that into a "busy" reply.
+        future = self.ai_pool.submit('tag', file_path, timeout=self.ai_timeout)
         
         try:
-            # Enforce 20s timeout
-            res = await asyncio.wait_for(future, timeout=30.0) # Slightly longer to account for queue wait
+            # Queue wait included; on timeout the job's deadline has passed too, so the worker skips it.
+            res = await asyncio.wait_for(future, timeout=self.ai_timeout)
 
             # Debug output for verification
             # print(f"DEBUG: Tagger Raw Output Type: {type(res)}")
@@ -535,35 +648,29 @@ class BrokerCog(commands.Cog):
                  # This path is legacy/fallback, unlikely to happen with this model
                  pass
 
-            tag_list = []
-            character_list = []
-
-            # Process General Tags
-            if confidences:
-                # Ensure values are floats
-                clean_confidences = {}
-                for k, v in confidences.items():
-                    try:
-                        clean_confidences[k] = float(v)
-                    except:
-                        continue
-                        
-                sorted_tags = sorted(clean_confidences.items(), key=lambda x: x[1], reverse=True)
-                tag_list = [t[0] for t in sorted_tags if t[1] > 0.35][:20]
-
-            # Process Character Tags
-            if character_confidences:
-                clean_chars = {}
-                for k, v in character_confidences.items():
-                     try:
-                        clean_chars[k] = float(v)
-                     except:
-                        continue
-
-                sorted_chars = sorted(clean_chars.items(), key=lambda x: x[1], reverse=True)
-                character_list = [c[0] for c in sorted_chars if c[1] > 0.5] # Higher threshold for chars
-
-            return tag_list, ", ".join(tag_list), character_list
+            # Ensure values are floats
+            clean_confidences = {}
+            for k, v in confidences.items():
+                try:
+                    clean_confidences[k] = float(v)
+                except:
+                    continue
+
+            clean_chars = {}
+            for k, v in character_confidences.items():
+                 try:
+                    clean_chars[k] = float(v)
+                 except:
+                    continue
+
+            # Remember the raw confidences (not the thresholded lists) so thresholds can change later.
+            if digest and (clean_confidences or clean_chars):
+                try:
+                    await self.appraisal_cache.put_tags(digest, img_hash, clean_confidences, clean_chars)
+                except Exception as e:
+                    print(f"Appraisal Cache Error: {e}")
+
+            return self._select_tags(clean_confidences, clean_chars)
                 
         except asyncio.TimeoutError:
             print("Tagging Timeout (Queue/Process limit reached)")
@@ -573,98 +680,54 @@ class BrokerCog(commands.Cog):
             
         return [], "timeout_fallback", []
 
-    async def _fetch_tag_count(self, tag_name):
-        """Fetches post count for a tag from Danbooru (with 30-day DB Cache)."""
-        # 1. Check DB Cache
-        async with aiosqlite.connect(self.bot.bank.db_path, timeout=60.0) as db:
-            cursor = await db.execute("SELECT post_count, last_updated FROM tag_metadata WHERE tag_name = ?", (tag_name,))
-            row = await cursor.fetchone()
-            
-            if row:
-                count, last_updated_str = row
-                last_updated = datetime.strptime(last_updated_str, "%Y-%m-%d %H:%M:%S")
-                if datetime.now() - last_updated < timedelta(days=30):
-                    return count
-
-        # 2. Fetch from API
-        try:
-            print(f"Fetching count for tag: {tag_name}")
-            async with aiohttp.ClientSession() as session:
-                # Danbooru API: tags.json?search[name]=tag_name
-                url = f"https://danbooru.donmai.us/tags.json"
-                params = {"search[name]": tag_name}
-                async with session.get(url, params=params) as resp:
-                    if resp.status == 200:
-                        data = await resp.json()
-                        if data and isinstance(data, list):
-                            post_count = data[0].get('post_count', 0)
-                            
-                            # Update Cache
-                            now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                            async with aiosqlite.connect(self.bot.bank.db_path, timeout=60.0) as db:
-                                await db.execute(
-                                    "INSERT OR REPLACE INTO tag_metadata (tag_name, post_count, last_updated) VALUES (?, ?, ?)",
-                                    (tag_name, post_count, now_str)
-                                )
-                                await db.commit()
-                            
-                            return post_count
-        except Exception as e:
-            print(f"Danbooru API Error ({tag_name}): {e}")
-            
-        return 9999999 # Return high count (low rarity) on failure
+    async def _run_scorer(self, file_path, digest=None, img_hash=None, cached=None):
+        """Runs the aesthetic scorer AI via the worker pool (or returns the score from `cached`)."""
+        if cached and cached['score'] is not None:
+            return cached['score']
 
-    async def _run_scorer(self, file_path):
-        """Runs the aesthetic scorer AI via Queue."""
         if not self.ai_client_score: return random.uniform(2.0, 5.0)
         
-        future = self.bot.loop.create_future()
-        await self.ai_queue.put(('score', file_path, future))
+        future = self.ai_pool.submit('score', file_path, timeout=self.ai_timeout)
         
         try:
-            # Enforce 20s timeout
-            res = await asyncio.wait_for(future, timeout=30.0)
-            return float(res)
+            res = await asyncio.wait_for(future, timeout=self.ai_timeout)
+            score = float(res)
         except:
+            # Random fallback scores are never cached.
             return random.uniform(2.0, 5.0)
 
-    async def _calculate_price(self, score, tag_list, character_list):
-        """Calculates final price, trend bonus, and rarity multiplier."""
-        tag_multiplier = await self.get_tag_value_modifier(tag_list)
-        base_price = 1000
-        
-        trends = await self.get_current_trends()
-        trend_bonus = 0
-        matched_trends = []
-        
-        if trends:
-            for cat, val in trends.items():
-                if val and val in tag_list:
-                    trend_bonus += 5000 
-                    matched_trends.append(val)
-        
-        # Character Bonus
-        char_bonus = 0
-        if character_list:
-            char_bonus = 2000 * len(character_list)
+        if digest:
+            try:
+                await self.appraisal_cache.put_score(digest, img_hash, score)
+            except Exception as e:
+                print(f"Appraisal Cache Error: {e}")
+        return score
 
-        # --- Rarity Bonus (Danbooru) ---
+    async def _rarity_bonus(self, tag_list, character_list):
+        """Danbooru rarity multiplier. Returns (rarity_multiplier, rare_tags)."""
         rarity_multiplier = 1.0
         
         # Filter commonly used tags to avoid dilution
         ignored_tags = {'1girl', 'solo', 'long_hair', 'breasts', 'looking_at_viewer', 'smile', 'blush', 'short_hair', 'open_mouth'}
         candidate_tags = [t for t in tag_list if t not in ignored_tags and t not in character_list] # Chars have their own bonus
         
-        # We need to fetch counts. This can be slow if not cached, so limit to top 5 candidates?
-        # Let's take first 5 from "tag_list" which is sorted by confidence usually? 
-        # Actually tag_list is sorted by confidence.
-        # Let's check top 5 confident tags.
+        # tag_list is sorted by confidence, so check the top 5 confident tags.
         check_limit = 5
         checked_tags = []
         rarity_scores = []
         
-        for tag in candidate_tags[:check_limit]:
-             count = await self._fetch_tag_count(tag)
+        tags = candidate_tags[:check_limit]
+        # Offline table first (no I/O); only tags missing from the dump go to the DB cache / Danbooru.
+        counts = {}
+        for tag in tags:
+            count = self.rarity_table.get(tag)
+            if count is not None:
+                counts[tag] = count
+        missing = [t for t in tags if t not in counts]
+        if missing:
+            counts.update(await self.tag_service.get_counts(missing))
+        for tag in tags:
+             count = counts[tag]
              # Formula: Multiplier boost based on rarity.
              # < 1000: x3.0
              # < 5000: x2.0
@@ -687,6 +750,38 @@ class BrokerCog(commands.Cog):
             # Max is better for "Jackpot" feeling.
             rarity_multiplier = max(rarity_scores)
 
+        return rarity_multiplier, checked_tags
+
+    async def _calculate_price(self, score, tag_list, character_list, rarity=None):
+        """
+        Calculates final price, trend bonus, and rarity multiplier.
+        `rarity` is a precomputed _rarity_bonus result (looked up while the scorer was running).
+        """
+        tag_multiplier, trends = await asyncio.gather(
+            self.get_tag_value_modifier(tag_list),
+            self.get_current_trends()
+        )
+        base_price = 1000
+        
+        trend_bonus = 0
+        matched_trends = []
+        
+        if trends:
+            for cat, val in trends.items():
+                if val and val in tag_list:
+                    trend_bonus += 5000 
+                    matched_trends.append(val)
+        
+        # Character Bonus
+        char_bonus = 0
+        if character_list:
+            char_bonus = 2000 * len(character_list)
+
+        # --- Rarity Bonus (Danbooru) ---
+        if rarity is None:
+            rarity = await self._rarity_bonus(tag_list, character_list)
+        rarity_multiplier, checked_tags = rarity
+
         # Ensure score is within bounds
         score = max(0.0, min(10.0, score))
         
@@ -699,7 +794,7 @@ class BrokerCog(commands.Cog):
         final_price = value_part + trend_bonus + char_bonus
 
         # --- Stock Market Influence ---
-        # Trigger async stock update
+        # Buffered by StocksCog and written in batches (no I/O here)
         stocks_cog = self.bot.get_cog("StocksCog")
         if stocks_cog:
             for tag in tag_list:
@@ -717,7 +812,7 @@ class BrokerCog(commands.Cog):
                 
                 multiplier = 1.0 + change_rate
                 
-                self.bot.loop.create_task(stocks_cog.update_stock_price(tag, multiplier))
+                await stocks_cog.update_stock_price(tag, multiplier)
 
         return final_price, trend_bonus, matched_trends, char_bonus, rarity_multiplier, checked_tags
 
@@ -734,10 +829,25 @@ class BrokerCog(commands.Cog):
             return
 
         image_url = attachment.url
+
+        # 0. URL Gate (before any download)
+        # Bloom "No" -> definitely new, skip the DB entirely.
+        # Bloom "Maybe" -> confirm with the exact URL index before rejecting.
+        if self.bloom.check(self._canonical_url(image_url)):
+            dup_id = await self._find_item_by_url(image_url)
+            if dup_id is not None:
+                await ctx.send(f"❌ **密輸失敗:** この画像は既に闇市に出回っています。(ID: #{dup_id})")
+                return
+
+        # Backpressure: fail fast instead of queueing work that would only time out.
+        if self.ai_pool.is_busy():
+            await ctx.send(self.BUSY_MESSAGE)
+            return
+
         await ctx.send("🕵️ **密輸作戦を開始します...**")
 
         # 1. Download & Hash
-        temp_path, img_hash = await self._download_and_hash(image_url)
+        temp_path, img_hash, digest = await self._download_and_hash(image_url)
         if not temp_path:
             await ctx.send("❌ ダウンロードに失敗しました。")
             return
@@ -762,67 +872,79 @@ class BrokerCog(commands.Cog):
             await ctx.send(f"✅ **密輸成功!**\n闇市の鑑定人に連絡しています...")
             
             # 4. AI Valuation
-            tag_list, tags_str, character_list = await self._run_tagger(temp_path)
-            score = await self._run_scorer(temp_path)
+            # One cache lookup for both models (same bytes or pHash already appraised -> no inference).
+            cached = await self.appraisal_cache.get(digest, img_hash)
+            # Tagger (+ the Danbooru rarity lookups that need its tags) and scorer are independent: run both at once.
+            async def tag_and_rarity():
+                tag_list, tags_str, character_list = await self._run_tagger(temp_path, digest, img_hash, cached)
+                rarity = await self._rarity_bonus(tag_list, character_list)
+                return tag_list, tags_str, character_list, rarity
+
+            try:
+                # return_exceptions: if one side is rejected, still let the other finish before temp_path is removed.
+                appraisal, score = await asyncio.gather(
+                    tag_and_rarity(), self._run_scorer(temp_path, digest, img_hash, cached), return_exceptions=True
+                )
+                for res in (appraisal, score):
+                    if isinstance(res, BaseException):
+                        raise res
+            except AIPoolBusy:
+                await ctx.send(self.BUSY_MESSAGE)
+                return
+            tag_list, tags_str, character_list, rarity = appraisal
             
             # Removed score rejection check (< 4.0) to accept all items.
 
             # 5. Pricing
-            final_price, trend_bonus, matched_trends, char_bonus, rarity_mult, rare_tags = await self._calculate_price(score, tag_list, character_list)
+            final_price, trend_bonus, matched_trends, char_bonus, rarity_mult, rare_tags = await self._calculate_price(score, tag_list, character_list, rarity=rarity)
             
             # 6. Grading
             grade = "B"
             if score >= 9.0: grade = "S"
             elif score >= 7.0: grade = "A"
             
-            # 7. Post to Gallery & DB Insert
-            # 7. Post to Gallery & DB Insert (Atomic)
-            item_id = None
-            async with aiosqlite.connect(self.bot.bank.db_path, timeout=60.0) as db:
+            # 7. Reserve the item row. It stays 'pending' (unlisted) until the
+            # gallery post exists, so no write lock is held across Discord I/O.
+            async def reserve(db):
                 cursor = await db.execute(
                     """
                     INSERT INTO market_items (seller_id, image_url, aesthetic_score, price, status, image_hash, tags, grade, thread_id, message_id)
-                    VALUES (?, ?, ?, ?, 'on_sale', ?, ?, ?, 0, 0)
+                    VALUES (?, ?, ?, ?, 'pending', ?, ?, ?, 0, 0)
                     """,
                     (self.bot.user.id, image_url, score, int(final_price * 1.5), img_hash, str(tag_list), grade)
                 )
-                item_id = cursor.lastrowid
-                # Do NOT commit yet
-                
-                # Create Embed
-                embed = discord.Embed(title=f"📦 新規入荷 (ID: #{item_id})", color=discord.Color.purple())
-                embed.set_image(url=image_url)
-                embed.add_field(name="販売者", value=self.bot.user.mention, inline=True)
-                embed.add_field(name="価格", value=f"💰 {int(final_price * 1.5):,}", inline=True)
-                embed.add_field(name="グレード", value=f"**{grade}** ({score:.2f})", inline=True)
-                
-                if rarity_mult > 1.0:
-                     embed.add_field(name="✨ レアリティボーナス", value=f"x{rarity_mult:.1f} ({', '.join(rare_tags[:3])})", inline=True)
-                     
-                if character_list:
-                    chars_str = ", ".join(character_list)
-                    embed.add_field(name="👤 キャラクター", value=f"{chars_str} (+{char_bonus:,})", inline=True)
-                if matched_trends:
-                    embed.add_field(name="🔥 トレンドボーナス!", value=f"+{trend_bonus:,} ({', '.join(matched_trends)})", inline=False)
-                embed.add_field(name="特徴 (Tags)", value=tags_str[:1000], inline=False)
-                
-                # Post Logic & Completion
-                try:
-                    # Pass 'db' to share transaction
-                    await self._post_to_gallery(ctx, embed, temp_path, tags_str, item_id, grade, final_price, tag_list, image_url, img_hash, db_conn=db)
-                    
-                    await db.commit() # Commit all changes (Item, Money, Trends)
-                    
-                except Exception as e:
-                    await ctx.send(f"❌ 投稿処理中にエラーが発生: {e}")
-                    traceback.print_exc()
-                    # Implicit Rollback on exit context manager without commit?
-                    # Actually aiosqlite context manager does commit on exit? 
-                    # No, it *closes*. If we didn't commit, changes are lost? 
-                    # SQLite default is to rollback uncommitted transactions on close. Yes.
-                    # But verifying: aiosqlite context manager for CONNECTION just closes it.
-                    # So uncommitted changes are rolled back. Correct.
-                    return
+                return cursor.lastrowid
+
+            item_id = await self.bot.bank.write(reserve)
+            
+            # Create Embed
+            embed = discord.Embed(title=f"📦 新規入荷 (ID: #{item_id})", color=discord.Color.purple())
+            embed.set_image(url=image_url)
+            embed.add_field(name="販売者", value=self.bot.user.mention, inline=True)
+            embed.add_field(name="価格", value=f"💰 {int(final_price * 1.5):,}", inline=True)
+            embed.add_field(name="グレード", value=f"**{grade}** ({score:.2f})", inline=True)
+            
+            if rarity_mult > 1.0:
+                 embed.add_field(name="✨ レアリティボーナス", value=f"x{rarity_mult:.1f} ({', '.join(rare_tags[:3])})", inline=True)
+                 
+            if character_list:
+                chars_str = ", ".join(character_list)
+                embed.add_field(name="👤 キャラクター", value=f"{chars_str} (+{char_bonus:,})", inline=True)
+            if matched_trends:
+                embed.add_field(name="🔥 トレンドボーナス!", value=f"+{trend_bonus:,} ({', '.join(matched_trends)})", inline=False)
+            embed.add_field(name="特徴 (Tags)", value=tags_str[:1000], inline=False)
+            
+            # Post Logic & Completion
+            try:
+                await self._post_to_gallery(ctx, embed, temp_path, tags_str, item_id, grade, final_price, tag_list, image_url, img_hash)
+            except Exception as e:
+                await ctx.send(f"❌ 投稿処理中にエラーが発生: {e}")
+                traceback.print_exc()
+                # Drop the reservation so a half-listed item never appears.
+                await self.bot.bank.write(lambda db: db.execute(
+                    "DELETE FROM market_items WHERE item_id = ? AND status = 'pending'", (item_id,)
+                ))
+                return
 
         except Exception as e:
             await ctx.send(f"❌ エラーが発生しました: {e}")
@@ -830,13 +952,14 @@ class BrokerCog(commands.Cog):
         finally:
              if os.path.exists(temp_path): os.remove(temp_path)
 
-    async def _post_to_gallery(self, ctx, embed, temp_path, tags_str, item_id, grade, final_price, tag_list, image_url, img_hash, db_conn):
-        """Handles posting to the appropriate thread or forum."""
+    async def _post_to_gallery(self, ctx, embed, temp_path, tags_str, item_id, grade, final_price, tag_list, image_url, img_hash):
+        """Handles posting to the appropriate thread or forum, then lists the reserved item."""
         bot_thread = None
         
-        # 1. Fetch User Gallery (Using shared conn)
-        cursor = await db_conn.execute("SELECT thread_id FROM user_galleries WHERE user_id = ?", (self.bot.user.id,))
-        row = await cursor.fetchone()
+        # 1. Fetch User Gallery
+        async with self.bot.bank.pool.reader() as db:
+            cursor = await db.execute("SELECT thread_id FROM user_galleries WHERE user_id = ?", (self.bot.user.id,))
+            row = await cursor.fetchone()
         if row:
             bot_thread = ctx.guild.get_thread(row[0])
             if not bot_thread:
@@ -883,18 +1006,32 @@ class BrokerCog(commands.Cog):
                     raise Exception("Gallery Forum Not Found")
 
         # DB Updates & Payment (Atomic)
-        await self.bot.bank.deposit_credits(ctx.author, final_price, db_conn=db_conn)
-        await self.update_market_trends(tag_list, db_conn=db_conn)
+        message_id = message.id if message else 0
+
+        async def txn(db):
+            await self.bot.bank.deposit_credits(ctx.author, final_price, db_conn=db)
+            trend_values = await self.update_market_trends(tag_list, db_conn=db)
+            # Final Link Update (and list the reserved item)
+            await db.execute(
+                "UPDATE market_items SET status = 'on_sale', thread_id = ?, message_id = ? WHERE item_id = ?",
+                (thread_ref.id, message_id, item_id)
+            )
+            return trend_values
+
+        trend_values = await self.bot.bank.write(txn)
+        self.market_trends.apply(trend_values)
+        self.tag_supply.record(tag_list)
+        market = self.bot.get_cog("MarketCog")
+        if market:
+            market.message_routes.put(message_id, item_id, 'on_sale')
         
-        # Update Bloom Filter
+        # Update Bloom Filter & pHash Index
         self.bloom.add(image_url)
+        self.bloom.add(self._canonical_url(image_url))
         self.bloom.add(img_hash)
-        
-        # Final Link Update
-        await db_conn.execute(
-            "UPDATE market_items SET thread_id = ?, message_id = ? WHERE item_id = ?",
-            (thread_ref.id, message.id if message else 0, item_id)
-        )
+        self.bloom.seen_item(item_id)
+        self.phash_index.add(img_hash)
+        self.hash_matrix.append(item_id, img_hash)
         
         await ctx.send(f"💰 **報酬受取:** `{final_price:,} Credits` を受け取りました。")
 
@@ -902,49 +1039,50 @@ class BrokerCog(commands.Cog):
     async def join(self, ctx):
         """闇のブローカーとして登録し、個人用ギャラリーを開設します。"""
         
-        async with aiosqlite.connect(self.bot.bank.db_path, timeout=60.0) as db:
-            # 1. Check if already joined
+        # 1. Check if already joined
+        async with self.bot.bank.pool.reader() as db:
             cursor = await db.execute("SELECT thread_id FROM user_galleries WHERE user_id = ?", (ctx.author.id,))
             row = await cursor.fetchone()
-            
-            if row:
-                await ctx.send(f"⚠️ 既に登録済みです。ギャラリー: <#{row[0]}>")
-                return
-
-            # 2. Assign Role & Find Forum
-            role = discord.utils.get(ctx.guild.roles, name="密輸業者")
-            forum = discord.utils.get(ctx.guild.forums, name="闇市ギャラリー")
-            
-            if not forum:
-                await ctx.send("❌ フォーラム `闇市ギャラリー` が見つかりません。管理者に連絡してください。")
-                return
+        
+        if row:
+            await ctx.send(f"⚠️ 既に登録済みです。ギャラリー: <#{row[0]}>")
+            return
 
-            if role:
-                try:
-                    await ctx.author.add_roles(role)
-                except discord.Forbidden:
-                    await ctx.send("⚠️ ロールの付与に失敗しました(権限不足)。")
+        # 2. Assign Role & Find Forum
+        role = discord.utils.get(ctx.guild.roles, name="密輸業者")
+        forum = discord.utils.get(ctx.guild.forums, name="闇市ギャラリー")
+        
+        if not forum:
+            await ctx.send("❌ フォーラム `闇市ギャラリー` が見つかりません。管理者に連絡してください。")
+            return
 
-            # 3. Create Gallery Thread
+        if role:
             try:
-                thread_with_message = await forum.create_thread(
-                    name=f"[Gallery] {ctx.author.display_name}",
-                    content=f"{ctx.author.mention} の個人ギャラリーへようこそ。\nここで獲得した戦利品が展示されます。"
-                )
-                thread = thread_with_message.thread if hasattr(thread_with_message, 'thread') else thread_with_message
-                
-                # 4. Save to DB & Give Starting Funds (Atomic)
+                await ctx.author.add_roles(role)
+            except discord.Forbidden:
+                await ctx.send("⚠️ ロールの付与に失敗しました(権限不足)。")
+
+        # 3. Create Gallery Thread
+        try:
+            thread_with_message = await forum.create_thread(
+                name=f"[Gallery] {ctx.author.display_name}",
+                content=f"{ctx.author.mention} の個人ギャラリーへようこそ。\nここで獲得した戦利品が展示されます。"
+            )
+            thread = thread_with_message.thread if hasattr(thread_with_message, 'thread') else thread_with_message
+            
+            # 4. Save to DB & Give Starting Funds (Atomic)
+            async def txn(db):
                 await db.execute("INSERT INTO user_galleries (user_id, thread_id) VALUES (?, ?)", (ctx.author.id, thread.id))
                 await self.bot.bank.deposit_credits(ctx.author, 3000, db_conn=db)
-                
-                await db.commit()
-                
-                await ctx.send(f"🎉 **登録完了！** あなたのギャラリーが開設されました: {thread.mention}\n💰 **開業資金 3,000クレジット** が支給されました！")
 
-            except Exception as e:
-                await ctx.send(f"❌ ギャラリー作成に失敗しました: {e}")
-                traceback.print_exc()
-                # Rollback handled by context manager (no commit)
+            await self.bot.bank.write(txn)
+            
+            await ctx.send(f"🎉 **登録完了！** あなたのギャラリーが開設されました: {thread.mention}\n💰 **開業資金 3,000クレジット** が支給されました！")
+
+        except Exception as e:
+            await ctx.send(f"❌ ギャラリー作成に失敗しました: {e}")
+            traceback.print_exc()
+            # Rollback handled by the write queue (the job's savepoint is undone)
 
     @commands.command(name="reset_game")
     @commands.has_permissions(administrator=True)
@@ -961,14 +1099,26 @@ class BrokerCog(commands.Cog):
             await ctx.send("❌ タイムアウトしました。リセットはキャンセルされました。")
             return
 
-        async with aiosqlite.connect(self.bot.bank.db_path, timeout=60.0) as db:
+        async def txn(db):
             tables = ["bank", "market_items", "market_trends", "user_galleries"]
             for table in tables:
                 try:
                     await db.execute(f"DELETE FROM {table}")
                 except Exception as e:
                     print(f"Failed to clear {table}: {e}")
-            await db.commit()
+
+        await self.bot.bank.write(txn)
+        self.phash_index.clear()
+        self.hash_matrix.clear()
+        self.market_trends.clear()
+        market = self.bot.get_cog("MarketCog")
+        if market:
+            market.message_routes.clear()
+        self.tag_supply = TagActivity()
+        self.tag_demand = TagActivity()
+        leaderboard = self.bot.get_cog("LeaderboardCog")
+        if leaderboard:
+            await leaderboard.reload()
         
         await ctx.send("🔥 **リセット完了/WIPE COMPLETE**\n全てのデータが削除されました。`!init_server` からやり直してください。")
 
@@ -977,7 +1127,7 @@ class BrokerCog(commands.Cog):
     @commands.command(name="inventory", aliases=["bag", "inv"])
     async def inventory(self, ctx):
         """自分が所有している(購入済み)アイテムを表示します。"""
-        async with aiosqlite.connect(self.bot.bank.db_path, timeout=60.0) as db:
+        async with self.bot.bank.pool.reader() as db:
             cursor = await db.execute("""
                 SELECT item_id, tags, thread_id, aesthetic_score 
                 FROM market_items 
@@ -997,7 +1147,7 @@ class BrokerCog(commands.Cog):
     @commands.command(name="resell")
     async def resell(self, ctx):
         """所有しているアイテムを選択して再販します。"""
-        async with aiosqlite.connect(self.bot.bank.db_path, timeout=60.0) as db:
+        async with self.bot.bank.pool.reader() as db:
             cursor = await db.execute("""
                 SELECT item_id, tags, aesthetic_score 
                 FROM market_items 
@@ -1016,10 +1166,45 @@ class BrokerCog(commands.Cog):
     @commands.command(name="reset_risk")
     async def reset_risk(self, ctx):
         """(Debug) Clears all image hashes from the database to reset pHash risk."""
-        async with aiosqlite.connect(self.bot.bank.db_path, timeout=60.0) as db:
-            await db.execute("UPDATE market_items SET image_hash = NULL")
-            await db.commit()
+        await self.bot.bank.write(lambda db: db.execute("UPDATE market_items SET image_hash = NULL"))
+        self.phash_index.clear()
+        self.hash_matrix.clear()
         await ctx.send("🔄 **記憶消去完了。** 当局は押収品に関するデータを失いました。\nこれで再び低リスクで密輸できます！")
 
+    @commands.command(name="audit_hashes")
+    @commands.has_permissions(administrator=True)
+    async def audit_hashes(self, ctx, max_distance: int = 5):
+        """(管理者) 市場全体の類似画像ペアを一括検出します。"""
+        pairs = await asyncio.to_thread(self.hash_matrix.find_duplicates, max_distance)
+        if not pairs:
+            await ctx.send(f"✅ 類似ペアは見つかりませんでした。(対象: {len(self.hash_matrix):,}件, 距離<={max_distance})")
+            return
+
+        lines = [f"#{a} ↔ #{b} (距離: {d})" for a, b, d in pairs[:20]]
+        more = f"\n...他 {len(pairs) - 20}件" if len(pairs) > 20 else ""
+        await ctx.send(f"⚠️ **類似ペア {len(pairs)}件** (距離<={max_distance})\n" + "\n".join(lines) + more)
+
+    @commands.command(name="aistats")
+    @commands.has_permissions(administrator=True)
+    async def aistats(self, ctx):
+        """(管理者) AIワーカープールの待ち行列と処理中件数を表示"""
+        stats = self.ai_pool.stats()
+        embed = discord.Embed(title="🤖 AI Worker Pool", color=discord.Color.dark_grey())
+        if not stats:
+            embed.description = "ℹ️ AIクライアントが読み込まれていません。"
+        for kind, s in stats.items():
+            embed.add_field(
+                name=kind,
+                value=f"待ち: `{s['queued']}`\n処理中: `{s['in_flight']}/{s['concurrency']}`\n完了: `{s['completed']:,}` / 失敗: `{s['failed']:,}`\n期限切れ破棄: `{s['dropped']:,}` / 受付拒否: `{s['rejected']:,}`",
+                inline=True
+            )
+        c = self.appraisal_cache.stats()
+        embed.add_field(
+            name="鑑定キャッシュ",
+            value=f"ヒット: `{c['hits']:,}` (pHash: `{c['phash_hits']:,}`)\nミス: `{c['misses']:,}`\nメモリ: `{c['entries']:,}`件 / `{c['bytes'] / 1024:.0f} KB`",
+            inline=False
+        )
+        await ctx.send(embed=embed)
+
 async def setup(bot):
     await bot.add_cog(BrokerCog(bot))
@@ -0,0 +1,164 @@
+import discord
+from discord.ext import commands, tasks
+from utils.ranking import RankedSet
+
+class LeaderboardCog(commands.Cog):
+    """
+    番付 (Leaderboard)
+
+    Per-guild balance rankings kept in RankedSets. Loaded once from `bank`, then
+    updated incrementally from BankSystem's committed balance changes, so
+    !rank / !top never sort the table. The pinned message in #番付 is refreshed
+    by a loop for guilds that changed, not once per change.
+    """
+
+    CHANNEL_NAME = "番付"
+    PINNED_SIZE = 20
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.boards = {}  # guild_id: RankedSet(user_id -> balance)
+        self.dirty_guilds = set()
+        self.pinned = {}  # guild_id: message_id
+        # Balance changes that arrive while reload() reads the table (None when not reloading)
+        self._reload_changes = None
+        self.bot.bank.balance_listeners.append(self.on_balances)
+        self.refresh_loop.start()
+
+    async def cog_load(self):
+        await self.reload()
+
+    def cog_unload(self):
+        self.refresh_loop.cancel()
+        if self.on_balances in self.bot.bank.balance_listeners:
+            self.bot.bank.balance_listeners.remove(self.on_balances)
+
+    async def reload(self):
+        """Rebuilds every board from the bank table (startup / after a reset)."""
+        self._reload_changes = {}
+        try:
+            async with self.bot.bank.pool.reader() as db:
+                cursor = await db.execute("SELECT user_id, guild_id, balance FROM bank WHERE guild_id != 0")
+                rows = await cursor.fetchall()
+            boards = {}
+            for user_id, guild_id, balance in rows:
+                board = boards.get(guild_id)
+                if board is None:
+                    board = boards[guild_id] = RankedSet()
+                board.set(user_id, balance)
+            # Guilds that lost their rows (reset) need their pinned ranking refreshed too
+            self.dirty_guilds.update(self.boards)
+            self.dirty_guilds.update(boards)
+            self.boards = boards
+        finally:
+            changes, self._reload_changes = self._reload_changes, None
+        # Commits that landed after our read may not be in it; re-applying them is harmless.
+        if changes:
+            await self.on_balances(changes)
+        print(f"Leaderboard Loaded: {len(rows)} balances in {len(boards)} guilds.")
+
+    async def on_balances(self, changes):
+        """BankSystem listener: {(user_id, guild_id): balance or None} after a commit."""
+        if self._reload_changes is not None:
+            self._reload_changes.update(changes)
+        for (user_id, guild_id), balance in changes.items():
+            if not guild_id:
+                continue
+            board = self.boards.get(guild_id)
+            if board is None:
+                board = self.boards[guild_id] = RankedSet()
+            if balance is None:
+                board.discard(user_id)
+            else:
+                board.set(user_id, balance)
+            self.dirty_guilds.add(guild_id)
+
+    def _line(self, guild, position, user_id, balance):
+        medal = {1: "🥇", 2: "🥈", 3: "🥉"}.get(position, f"`{position:>2}.`")
+        member = guild.get_member(user_id) if guild else None
+        name = member.display_name if member else f"<@{user_id}>"
+        return f"{medal} **{name}** — {balance:,} 円"
+
+    def build_embed(self, guild, count, offset=0):
+        board = self.boards.get(guild.id)
+        embed = discord.Embed(title="🏯 番付 (Leaderboard)", color=discord.Color.gold())
+        if not board:
+            embed.description = "まだ誰もいません。"
+            return embed
+        lines = [
+            self._line(guild, offset + i + 1, user_id, balance)
+            for i, (user_id, balance) in enumerate(board.top(count, offset))
+        ]
+        embed.description = "\n".join(lines) or "該当者なし"
+        embed.set_footer(text=f"参加者: {len(board):,}人")
+        return embed
+
+    @tasks.loop(minutes=1.0)
+    async def refresh_loop(self):
+        """Refreshes the pinned ranking of guilds whose balances changed (coalesced)."""
+        dirty, self.dirty_guilds = self.dirty_guilds, set()
+        for guild_id in dirty:
+            guild = self.bot.get_guild(guild_id)
+            if guild is None:
+                continue
+            try:
+                await self.update_pinned(guild)
+            except Exception as e:
+                print(f"Leaderboard refresh failed ({guild_id}): {e}")
+
+    @refresh_loop.before_loop
+    async def before_refresh_loop(self):
+        await self.bot.wait_until_ready()
+
+    async def update_pinned(self, guild):
+        channel = discord.utils.get(guild.text_channels, name=self.CHANNEL_NAME)
+        if channel is None:
+            return
+        embed = self.build_embed(guild, self.PINNED_SIZE)
+
+        message = None
+        message_id = self.pinned.get(guild.id)
+        if message_id:
+            try:
+                message = await channel.fetch_message(message_id)
+            except discord.NotFound:
+                message = None
+        if message is None:
+            # First refresh since startup: reuse our pinned message if there is one
+            for pin in await channel.pins():
+                if pin.author == self.bot.user and pin.embeds and pin.embeds[0].title == embed.title:
+                    message = pin
+                    break
+
+        if message is not None:
+            await message.edit(embed=embed)
+        else:
+            message = await channel.send(embed=embed)
+            try:
+                await message.pin()
+            except discord.Forbidden:
+                pass
+        self.pinned[guild.id] = message.id
+
+    @commands.command(name="rank")
+    async def rank(self, ctx, member: discord.Member = None):
+        """自分または他のユーザーの順位を表示します。"""
+        member = member or ctx.author
+        board = self.boards.get(ctx.guild.id)
+        position = board.rank(member.id) if board else None
+        if position is None:
+            await ctx.send(f"📜 **{member.display_name}** はまだ番付に載っていません。")
+            return
+        await ctx.send(
+            f"📜 **{member.display_name}** の順位: **{position + 1:,}位** / {len(board):,}人 "
+            f"(`{board.score(member.id):,} 円`)"
+        )
+
+    @commands.command(name="top", aliases=["leaderboard", "banzuke"])
+    async def top(self, ctx, page: int = 1):
+        """番付 (所持金ランキング) を表示します。"""
+        page = max(page, 1)
+        await ctx.send(embed=self.build_embed(ctx.guild, 10, offset=(page - 1) * 10))
+
+async def setup(bot):
+    await bot.add_cog(LeaderboardCog(bot))
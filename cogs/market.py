@@ -1,15 +1,72 @@
 import discord
-from discord.ext import commands, tasks
+from discord.ext import commands
 from gradio_client import Client, handle_file
 import asyncio
-import aiosqlite
+import ast
 import os
 import aiohttp
 import uuid
+import time
 import traceback
 import imagehash
 from PIL import Image
 from datetime import datetime, timedelta
+from utils.hash_matrix import HashMatrix
+from utils.deadline_scheduler import DeadlineScheduler
+from utils.message_routes import MessageRoutes
+
+AUCTION_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Auction settlement retries: SETTLE_RETRY_DELAY * 2^n seconds, then give up
+SETTLE_RETRY_DELAY = 5
+SETTLE_MAX_ATTEMPTS = 6
+
+def parse_item_tags(tags_str):
+    """market_items.tags は str(list) ("['a', 'b']") で保存されている。古い行はカンマ区切り。"""
+    if not tags_str:
+        return []
+    try:
+        tags = ast.literal_eval(tags_str)
+        if isinstance(tags, (list, tuple)):
+            return [str(t).strip() for t in tags if str(t).strip()]
+    except (ValueError, SyntaxError):
+        pass
+    return [t.strip() for t in tags_str.split(",") if t.strip()]
+
+def message_routes(bot):
+    """MarketCog の message_id -> (item_id, status) キャッシュ (未ロードなら None)。"""
+    market = bot.get_cog("MarketCog")
+    return market.message_routes if market else None
+
+async def find_item_by_message(db, columns, message_id, thread_id, condition="1"):
+    """ボタンが押されたメッセージのアイテムを探します (idx_market_message)。
+
+    message_id の無い古い行は、スレッドにアイテムが1つしか無い場合に限り thread_id で探します
+    (ギャラリースレッドには複数のアイテムがあるため)。
+    """
+    if message_id:
+        cursor = await db.execute(
+            f"SELECT {columns} FROM market_items WHERE message_id = ? AND {condition}", (message_id,)
+        )
+        row = await cursor.fetchone()
+        if row:
+            return row
+    cursor = await db.execute(
+        f"SELECT {columns} FROM market_items WHERE thread_id = ? AND {condition} LIMIT 2", (thread_id,)
+    )
+    rows = await cursor.fetchall()
+    return rows[0] if len(rows) == 1 else None
+
+def invalidate_net_worth(bot, *user_ids):
+    """取引後に StocksCog の総資産キャッシュを捨てます。"""
+    stocks = bot.get_cog("StocksCog")
+    if stocks:
+        stocks.net_worth.invalidate(*user_ids)
+
+def record_demand(bot, tags_str):
+    """購入されたタグを BrokerCog の需要スケッチに記録します。"""
+    broker = bot.get_cog("BrokerCog")
+    if broker:
+        broker.tag_demand.record(parse_item_tags(tags_str))
 
 class BuyView(discord.ui.View):
     def __init__(self, bot):
@@ -18,133 +75,162 @@ class BuyView(discord.ui.View):
 
     @discord.ui.button(label="💸 今すぐ購入", style=discord.ButtonStyle.green, custom_id="shadow_broker:buy_btn")
     async def buy_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        # 1. Identify Item by Thread ID
+        # 1. Identify Item by the message the button is on
         thread_id = interaction.channel_id
+        message_id = interaction.message.id if interaction.message else 0
         buyer = interaction.user
+        routes = message_routes(self.bot)
+        route = routes.get(message_id) if routes else None
+        if route and route[1] != 'on_sale':
+            # Known to be sold: answer without touching the DB
+            await interaction.response.send_message("❌ 売り切れです。", ephemeral=True)
+            return
         
-        async with aiosqlite.connect(self.bot.bank.db_path, timeout=60.0) as db:
-            cursor = await db.execute("SELECT item_id, price, seller_id, status, image_url, tags FROM market_items WHERE thread_id = ?", (thread_id,))
-            row = await cursor.fetchone()
-            
-            if not row:
-                await interaction.response.send_message("❌ データが見つかりません。", ephemeral=True)
-                return
-            
+        async def txn(db):
+            columns = "item_id, price, seller_id, status, image_url, tags"
+            if route:
+                cursor = await db.execute(f"SELECT {columns} FROM market_items WHERE item_id = ?", (route[0],))
+                row = await cursor.fetchone()
+            else:
+                row = await find_item_by_message(db, columns, message_id, thread_id)
+            if not row: return 'missing', None
+
             item_id, price, seller_id, status, img_url, tags_str = row
-            img_url = img_url or ""
-            tags_str = tags_str or ""
-            
-            if status != 'on_sale':
-                await interaction.response.send_message("❌ 売り切れです。", ephemeral=True)
-                return
-            
-            if buyer.id == seller_id:
-                await interaction.response.send_message("❌ 自分の商品は購入できません。", ephemeral=True)
-                return
+            if status != 'on_sale': return 'sold', row
+            if buyer.id == seller_id: return 'own', row
 
             # 2. Check Balance & Process Transaction (ATOMIC)
+            # Pass 'db' to withdraw_credits so it uses the SAME transaction
             try:
-                # Pass 'db' to withdraw_credits so it uses the SAME transaction
                 await self.bot.bank.withdraw_credits(buyer, price, db_conn=db)
-                
-                # Update DB to SOLD
-                await db.execute("UPDATE market_items SET status = 'owned', buyer_id = ?, seller_id = ?, price = 0 WHERE item_id = ?", (buyer.id, buyer.id, item_id))
-                
-                # Pay Seller (With Tax Logic)
-                seller = interaction.guild.get_member(seller_id)
-                payout_msg = ""
-                
-                if seller_id == self.bot.user.id:
-                    # Bot Sale
-                    pass
-                elif seller:
-                    # User Resale: 20% Tax
-                    tax_rate = 0.2
-                    tax_amount = int(price * tax_rate)
-                    payout = int(price - tax_amount)
-                    # Pass 'db' to deposit
-                    await self.bot.bank.deposit_credits(seller, payout, db_conn=db)
-                    payout_msg = f" (販売者へ `{payout:,}` 円送金)"
-                
-                await db.commit() # Commit EVERYTHING together
-                
-                await interaction.response.send_message(f"✅ **取引成立！**\n`{price:,}` 円支払いました。{payout_msg}", ephemeral=True)
-
             except ValueError:
-                await interaction.response.send_message(f"❌ 残高不足です！ ({price:,} クレジット必要)", ephemeral=True)
-                return
-            except Exception as e:
-                await interaction.response.send_message(f"❌ エラーが発生しました: {e}", ephemeral=True)
-                return
+                return 'funds', row
+            
+            # Update DB to SOLD
+            await db.execute("UPDATE market_items SET status = 'owned', buyer_id = ?, seller_id = ?, price = 0 WHERE item_id = ?", (buyer.id, buyer.id, item_id))
             
-            # --- Visual Transfer & Logging ---
+            # Pay Seller (With Tax Logic)
+            seller = interaction.guild.get_member(seller_id)
+            payout = 0
+            
+            if seller_id == self.bot.user.id:
+                # Bot Sale
+                pass
+            elif seller:
+                # User Resale: 20% Tax
+                tax_rate = 0.2
+                tax_amount = int(price * tax_rate)
+                payout = int(price - tax_amount)
+                # Pass 'db' to deposit
+                await self.bot.bank.deposit_credits(seller, payout, db_conn=db)
+            return 'ok', row + (payout,)
+
+        try:
+            result, row = await self.bot.bank.write(txn) # Commit EVERYTHING together
+        except Exception as e:
+            await interaction.response.send_message(f"❌ エラーが発生しました: {e}", ephemeral=True)
+            return
+
+        if routes is not None and row:
+            routes.put(message_id, row[0], 'owned' if result == 'ok' else row[3])
+
+        if result == 'missing':
+            await interaction.response.send_message("❌ データが見つかりません。", ephemeral=True)
+            return
+        if result == 'sold':
+            await interaction.response.send_message("❌ 売り切れです。", ephemeral=True)
+            return
+        if result == 'own':
+            await interaction.response.send_message("❌ 自分の商品は購入できません。", ephemeral=True)
+            return
+        if result == 'funds':
+            await interaction.response.send_message(f"❌ 残高不足です！ ({row[1]:,} クレジット必要)", ephemeral=True)
+            return
+
+        item_id, price, seller_id, status, img_url, tags_str, payout = row
+        img_url = img_url or ""
+        tags_str = tags_str or ""
+        record_demand(self.bot, tags_str)
+        invalidate_net_worth(self.bot, buyer.id, seller_id)
+        payout_msg = f" (販売者へ `{payout:,}` 円送金)" if payout else ""
+        await interaction.response.send_message(f"✅ **取引成立！**\n`{price:,}` 円支払いました。{payout_msg}", ephemeral=True)
+            
+        # --- Visual Transfer & Logging ---
+        try:
+            # 1. Log to shadow-logs
+            log_channel = discord.utils.get(interaction.guild.text_channels, name="shadow-logs")
+            if log_channel:
+
+                log_embed = discord.Embed(title="💸 Transaction Log", color=discord.Color.green())
+                log_embed.add_field(name="Item ID", value=f"#{item_id}", inline=True)
+                log_embed.add_field(name="Buyer", value=buyer.mention, inline=True)
+                log_embed.add_field(name="Seller", value=f"<@{seller_id}>" if seller_id else "Unknown", inline=True)
+                log_embed.add_field(name="Price", value=f"{price:,}", inline=True)
+                if img_url: log_embed.set_thumbnail(url=img_url)
+                await log_channel.send(embed=log_embed)
+
+            # 2. Cleanup Seller Message
+            # We know thread_id is interaction.channel_id
+            # But message_id? Interaction.message.id!
             try:
-                # 1. Log to shadow-logs
-                log_channel = discord.utils.get(interaction.guild.text_channels, name="shadow-logs")
-                if log_channel:
-
-                    log_embed = discord.Embed(title="💸 Transaction Log", color=discord.Color.green())
-                    log_embed.add_field(name="Item ID", value=f"#{item_id}", inline=True)
-                    log_embed.add_field(name="Buyer", value=buyer.mention, inline=True)
-                    log_embed.add_field(name="Seller", value=f"<@{seller_id}>" if seller_id else "Unknown", inline=True)
-                    log_embed.add_field(name="Price", value=f"{price:,}", inline=True)
-                    if img_url: log_embed.set_thumbnail(url=img_url)
-                    await log_channel.send(embed=log_embed)
-
-                # 2. Cleanup Seller Message
-                # We know thread_id is interaction.channel_id
-                # But message_id? Interaction.message.id!
-                try:
-                    await interaction.message.delete()
-                except:
-                    # Could not delete, maybe edit
-                    await interaction.message.edit(content=f"❌ **完売 (Sold)**", view=None, embed=None)
-
-                # 3. Post to Buyer's Gallery
-                async with aiosqlite.connect(self.bot.bank.db_path, timeout=60.0) as db_gal:
-                    cursor = await db_gal.execute("SELECT thread_id FROM user_galleries WHERE user_id = ?", (buyer.id,))
-                    row = await cursor.fetchone()
-                
-                new_thread_id = 0
-                new_msg_id = 0
+                await interaction.message.delete()
+            except:
+                # Could not delete, maybe edit
+                await interaction.message.edit(content=f"❌ **完売 (Sold)**", view=None, embed=None)
+
+            # 3. Post to Buyer's Gallery
+            async with self.bot.bank.pool.reader() as db_gal:
+                cursor = await db_gal.execute("SELECT thread_id FROM user_galleries WHERE user_id = ?", (buyer.id,))
+                row = await cursor.fetchone()
+            
+            new_thread_id = 0
+            new_msg_id = 0
+            
+            if row:
+                buyer_thread = interaction.guild.get_thread(row[0])
+                if not buyer_thread:
+                     try: buyer_thread = await interaction.guild.fetch_channel(row[0])
+                     except: pass
                 
-                if row:
-                    buyer_thread = interaction.guild.get_thread(row[0])
-                    if not buyer_thread:
-                         try: buyer_thread = await interaction.guild.fetch_channel(row[0])
-                         except: pass
-                    
-                    if buyer_thread:
-                         # Reconstruct Embed for Gallery
-                         # Need to fetch details again or use what we have? 
-                         # We have img_url from logging step
-                         gallery_embed = discord.Embed(title=f"🖼️ 所持品 (ID: #{item_id})", color=discord.Color.gold())
-                         if img_url: gallery_embed.set_image(url=img_url)
-                         gallery_embed.add_field(name="Tags", value=tags_str, inline=False)
-                         
-                         new_msg = await buyer_thread.send(content=f"**獲得:** {buyer.mention}", embed=gallery_embed)
-                         new_thread_id = buyer_thread.id
-                         new_msg_id = new_msg.id
-                    else:
-                         await interaction.followup.send("⚠️ あなたのギャラリーが見つかりませんでした。`!join` で作成してください。", ephemeral=True)
+                if buyer_thread:
+                     # Reconstruct Embed for Gallery
+                     # Need to fetch details again or use what we have? 
+                     # We have img_url from logging step
+                     gallery_embed = discord.Embed(title=f"🖼️ 所持品 (ID: #{item_id})", color=discord.Color.gold())
+                     if img_url: gallery_embed.set_image(url=img_url)
+                     gallery_embed.add_field(name="Tags", value=tags_str, inline=False)
+                     
+                     new_msg = await buyer_thread.send(content=f"**獲得:** {buyer.mention}", embed=gallery_embed)
+                     new_thread_id = buyer_thread.id
+                     new_msg_id = new_msg.id
                 else:
-                     await interaction.followup.send("⚠️ ギャラリー未登録のため、アイテムは倉庫(DB)に保管されました。`!join` してください。", ephemeral=True)
-                
-                # Update DB with new location
-                if new_thread_id:
-                     async with aiosqlite.connect(self.bot.bank.db_path, timeout=60.0) as db_upd:
-                        await db_upd.execute("UPDATE market_items SET thread_id = ?, message_id = ? WHERE item_id = ?", (new_thread_id, new_msg_id, item_id))
-                        await db_upd.commit()
+                     await interaction.followup.send("⚠️ あなたのギャラリーが見つかりませんでした。`!join` で作成してください。", ephemeral=True)
+            else:
+                 await interaction.followup.send("⚠️ ギャラリー未登録のため、アイテムは倉庫(DB)に保管されました。`!join` してください。", ephemeral=True)
+            
+            # Update DB with new location
+            if new_thread_id:
+                 await self.bot.bank.write(lambda db: db.execute(
+                     "UPDATE market_items SET thread_id = ?, message_id = ? WHERE item_id = ?", (new_thread_id, new_msg_id, item_id)
+                 ))
+                 if routes is not None:
+                     routes.put(new_msg_id, item_id, 'owned')
 
-            except Exception as e:
-                print(f"Failed transfer logic: {e}")
-                import traceback
-                traceback.print_exc()
+        except Exception as e:
+            print(f"Failed transfer logic: {e}")
+            import traceback
+            traceback.print_exc()
 
 class MarketCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.ai_client = None
+        # 常設ボタン用: メッセージ -> (item_id, status)。書き込み後に更新する
+        self.message_routes = MessageRoutes(max_entries=4096)
+        # オークション終了時刻の min-heap。次の締切まで眠り、締切ちょうどに精算する
+        self.auction_scheduler = DeadlineScheduler(self.settle_auctions)
+        self.settle_failures = {}  # item_id: failed settlement attempts
+        self.notify_tasks = set()  # 精算結果の送信タスク (参照を保持して GC を防ぐ)
 
     async def cog_load(self):
         # Register Persistent View
@@ -156,7 +242,28 @@ class MarketCog(commands.Cog):
         # The Implementation above used a generic "auction_bid_btn" which looks up by Thread ID.
         # So we can register a generic instance.
         self.bot.add_view(AuctionView(self.bot, 0))
-        self.auction_check_loop.start()
+        await self.load_auctions()
+        self.auction_scheduler.start()
+
+    async def load_auctions(self):
+        """Fills the scheduler with running auctions (idx_market_auction)."""
+        async with self.bot.bank.pool.reader() as db:
+            cursor = await db.execute(
+                "SELECT item_id, auction_end_time FROM market_items WHERE status = 'on_auction' AND auction_end_time IS NOT NULL"
+            )
+            rows = await cursor.fetchall()
+        for item_id, end_time_str in rows:
+            self.schedule_auction(item_id, end_time_str)
+        print(f"Auctions Loaded: {len(rows)} running.")
+
+    def schedule_auction(self, item_id, end_time_str):
+        """Registers (or moves) an auction's end time."""
+        try:
+            end_time = datetime.strptime(end_time_str, AUCTION_TIME_FORMAT)
+        except (TypeError, ValueError):
+            # Unreadable end time: settle it right away
+            end_time = datetime.now()
+        self.auction_scheduler.schedule(item_id, end_time.timestamp())
 
     def setup_client(self):
         try:
@@ -178,31 +285,29 @@ class MarketCog(commands.Cog):
             return str(imagehash.phash(img))
 
     async def check_duplicate(self, current_hash):
-        """DBから全ハッシュを取得し、ハミング距離を比較します。"""
+        """ハミング距離5以内の類似画像が存在するか判定します。"""
         if not current_hash:
             return False
 
-        async with aiosqlite.connect(self.bot.bank.db_path) as db:
-            cursor = await db.execute("SELECT image_hash FROM market_items WHERE image_hash IS NOT NULL")
+        # BrokerCog keeps an in-memory pHash index; fall back to a scan without it.
+        broker = self.bot.get_cog("BrokerCog")
+        if broker:
+            return broker.phash_index.nearest(current_hash, max_distance=5) is not None
+
+        async with self.bot.bank.pool.reader() as db:
+            cursor = await db.execute("SELECT item_id, image_hash FROM market_items WHERE image_hash IS NOT NULL")
             rows = await cursor.fetchall()
         
-        current_hash_obj = imagehash.hex_to_hash(current_hash)
-        
-        for (db_hash_str,) in rows:
-            try:
-                db_hash_obj = imagehash.hex_to_hash(db_hash_str)
-                distance = current_hash_obj - db_hash_obj
-                if distance <= 5: # 閾値 5
-                    return True
-            except:
-                continue
-        return False
+        # One vectorized XOR + popcount pass over all stored hashes
+        matrix = HashMatrix(len(rows))
+        matrix.extend(rows)
+        return matrix.nearest(current_hash, max_distance=5) is not None # 閾値 5
 
 
     @commands.command(name="market", aliases=["gallery", "shop"])
     async def market(self, ctx):
         """現在販売中の美術品リストを見ます。"""
-        async with aiosqlite.connect(self.bot.bank.db_path) as db:
+        async with self.bot.bank.pool.reader() as db:
             cursor = await db.execute(
                 "SELECT item_id, price, aesthetic_score, image_url FROM market_items WHERE status = 'on_sale' ORDER BY item_id DESC LIMIT 10"
             )
@@ -225,141 +330,191 @@ class MarketCog(commands.Cog):
     @commands.command(name="buy")
     async def buy(self, ctx, item_id: int):
         """ギャラリーにある絵を購入します。"""
-        async with aiosqlite.connect(self.bot.bank.db_path) as db:
+        async def txn(db):
             cursor = await db.execute(
-                "SELECT price, image_url, status FROM market_items WHERE item_id = ?",
+                "SELECT price, image_url, status, tags FROM market_items WHERE item_id = ?",
                 (item_id,)
             )
             row = await cursor.fetchone()
+            if not row: return 'missing', None
             
-            if not row:
-                await ctx.send("❌ その番号の作品は見つかりませんでした。")
-                return
-            
-            price, image_url, status = row
-            
-            if status != 'on_sale':
-                await ctx.send("❌ すでに販売された作品です。")
-                return
+            price, image_url, status, tags_str = row
+            if status != 'on_sale': return 'sold', row
             
             # Check balance
-            buyer_balance = await self.bot.bank.get_balance(ctx.author)
-            if buyer_balance < price:
-                await ctx.send(f"❌ 残高が不足しています。(必要: {price:,} 円, 保有: {buyer_balance:,} 円)")
-                return
+            buyer_balance = await self.bot.bank.get_balance(ctx.author, db_conn=db)
+            if buyer_balance < price: return 'funds', (price, buyer_balance)
             
             # Process Transaction
-            try:
-                await self.bot.bank.withdraw_credits(ctx.author, price)
-                
-                await db.execute(
-                    "UPDATE market_items SET status = 'owned', buyer_id = ? WHERE item_id = ?",
-                    (ctx.author.id, item_id,)
-                )
-                await db.commit()
-
-                # --- Stock Market Influence (Demand) ---
-                # Buying increases stock price by +1.0%
-                if tags_str:
-                    stocks_cog = self.bot.get_cog("StocksCog")
-                    if stocks_cog:
-                         tag_list = tags_str.split(",")
-                         for tag in tag_list:
-                             t_clean = tag.strip()
-                             if t_clean:
-                                 self.bot.loop.create_task(stocks_cog.update_stock_price(t_clean, 1.01))
-                
-                embed = discord.Embed(title="🎉 購入成功！", description=f"素晴らしい作品を所持することになりました。\n`{price:,} 円`を支払いました。", color=discord.Color.green())
-                embed.set_image(url=image_url)
-                await ctx.send(embed=embed)
-                
-            except ValueError as e:
-                 await ctx.send(f"❌ 取引失敗: {e}")
+            await self.bot.bank.withdraw_credits(ctx.author, price, db_conn=db)
+            await db.execute(
+                "UPDATE market_items SET status = 'owned', buyer_id = ? WHERE item_id = ?",
+                (ctx.author.id, item_id,)
+            )
+            return 'ok', row
 
-    async def cog_unload(self):
-        self.auction_check_loop.cancel()
+        try:
+            result, data = await self.bot.bank.write(txn)
+        except ValueError as e:
+            await ctx.send(f"❌ 取引失敗: {e}")
+            return
+
+        if result == 'missing':
+            await ctx.send("❌ その番号の作品は見つかりませんでした。")
+            return
+        if result == 'sold':
+            await ctx.send("❌ すでに販売された作品です。")
+            return
+        if result == 'funds':
+            await ctx.send(f"❌ 残高が不足しています。(必要: {data[0]:,} 円, 保有: {data[1]:,} 円)")
+            return
 
-    @tasks.loop(minutes=1.0)
-    async def auction_check_loop(self):
-        """Checks for expired auctions every minute."""
-        now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        price, image_url, status, tags_str = data
+        self.message_routes.set_status(item_id, 'owned')
+        record_demand(self.bot, tags_str)
+        invalidate_net_worth(self.bot, ctx.author.id)
+
+        # --- Stock Market Influence (Demand) ---
+        # Buying increases stock price by +1.0%
+        if tags_str:
+            stocks_cog = self.bot.get_cog("StocksCog")
+            if stocks_cog:
+                 for t_clean in parse_item_tags(tags_str):
+                     await stocks_cog.update_stock_price(t_clean, 1.01)
         
-        async with aiosqlite.connect(self.bot.bank.db_path, timeout=60.0) as db:
-            # Select expired auctions that are still 'on_auction'
-            cursor = await db.execute("""
-                SELECT item_id, image_url, current_bid, top_bidder_id, seller_id, thread_id, message_id
-                FROM market_items 
-                WHERE status = 'on_auction' AND auction_end_time <= ?
-            """, (now_str,))
-            expired_items = await cursor.fetchall()
-            
-            notifications = []
+        embed = discord.Embed(title="🎉 購入成功！", description=f"素晴らしい作品を所持することになりました。\n`{price:,} 円`を支払いました。", color=discord.Color.green())
+        embed.set_image(url=image_url)
+        await ctx.send(embed=embed)
+
+    async def cog_unload(self):
+        self.auction_scheduler.stop()
+
+    async def _settle_auction(self, db, item_id, now_str):
+        """Settles one auction inside a write transaction. Returns its notification, or None if it is not due."""
+        # Re-check in the transaction: a bid may have extended the auction meanwhile
+        cursor = await db.execute("""
+            SELECT image_url, current_bid, top_bidder_id, seller_id, thread_id, message_id, tags
+            FROM market_items 
+            WHERE item_id = ? AND status = 'on_auction' AND auction_end_time <= ?
+        """, (item_id, now_str))
+        item = await cursor.fetchone()
+        if item is None:
+            return None
+        img_url, bid, bidder_id, seller_id, thread_id, msg_id, tags_str = item
+        sold = bool(bidder_id) and bid != 0
+
+        # If no bids, return to owner
+        if not sold:
+            await db.execute("UPDATE market_items SET status = 'owned', auction_end_time = NULL WHERE item_id = ?", (item_id,))
+            status_msg = "🚫 **流札 (Unsold)**: 入札者がいませんでした。所有権は出品者に戻ります。"
+            final_owner_id = seller_id
+        else:
+            # Winner!
+            # 1. Pay Seller (Auction Tax 10%)
+            tax = int(bid * 0.1) 
+            payout = int(bid - tax)
+            # Balances are per guild: pay the seller as a member of the guild the auction thread is in
+            channel = self.bot.get_channel(thread_id) if thread_id else None
+            seller = channel.guild.get_member(seller_id) if channel and getattr(channel, 'guild', None) else None
             
-            for item in expired_items:
-                item_id, img_url, bid, bidder_id, seller_id, thread_id, msg_id = item
-                status_msg = ""
-                final_owner_id = None
-                
-                # If no bids, return to owner
-                if not bidder_id or bid == 0:
-                    await db.execute("UPDATE market_items SET status = 'owned', auction_end_time = NULL WHERE item_id = ?", (item_id,))
-                    status_msg = "🚫 **流札 (Unsold)**: 入札者がいませんでした。所有権は出品者に戻ります。"
-                    final_owner_id = seller_id
-                else:
-                    # Winner!
-                    # 1. Pay Seller (Auction Tax 10%)
-                    tax = int(bid * 0.1) 
-                    payout = int(bid - tax)
-                    seller = self.bot.get_user(seller_id) 
-                    
-                    if seller:
-                        await self.bot.bank.deposit_credits(seller, payout, db_conn=db)
-                    else:
-                        # Fallback deposit via DB (Atomic Upsert)
-                         await db.execute("""
-                            INSERT INTO bank (user_id, guild_id, balance) VALUES (?, ?, ?)
-                            ON CONFLICT(user_id, guild_id) DO UPDATE SET balance = balance + ?
-                         """, (seller_id, 0, payout, payout))
-
-                    # 2. Transfer Item
-                    await db.execute("""
-                        UPDATE market_items 
-                        SET status = 'owned', buyer_id = ?, seller_id = ?, price = 0, auction_end_time = NULL
-                        WHERE item_id = ?
-                    """, (bidder_id, bidder_id, item_id))
-                    
-                    status_msg = f"🔨 **落札 (SOLD)!**\n落札者: <@{bidder_id}>\n落札額: `{bid:,}` Credits"
-                    final_owner_id = bidder_id
-                
-                # Store Notification Data
-                notifications.append({
-                    'thread_id': thread_id,
-                    'msg_id': msg_id,
-                    'item_id': item_id,
-                    'status_msg': status_msg,
-                    'img_url': img_url,
-                    'final_owner_id': final_owner_id
-                })
+            if seller:
+                await self.bot.bank.deposit_credits(seller, payout, db_conn=db)
+            else:
+                # Fallback deposit via DB (Atomic Upsert)
+                await db.execute("""
+                    INSERT INTO bank (user_id, guild_id, balance) VALUES (?, ?, ?)
+                    ON CONFLICT(user_id, guild_id) DO UPDATE SET balance = balance + ?
+                """, (seller_id, 0, payout, payout))
+                self.bot.bank.mark_dirty(seller_id, 0)
+
+            # 2. Transfer Item
+            await db.execute("""
+                UPDATE market_items 
+                SET status = 'owned', buyer_id = ?, seller_id = ?, price = 0, auction_end_time = NULL
+                WHERE item_id = ?
+            """, (bidder_id, bidder_id, item_id))
             
-            await db.commit()
+            status_msg = f"🔨 **落札 (SOLD)!**\n落札者: <@{bidder_id}>\n落札額: `{bid:,}` Credits"
+            final_owner_id = bidder_id
+
+        return {
+            'thread_id': thread_id,
+            'msg_id': msg_id,
+            'item_id': item_id,
+            'status_msg': status_msg,
+            'img_url': img_url,
+            'final_owner_id': final_owner_id,
+            'seller_id': seller_id,
+            'sold': sold,
+            'tags': tags_str
+        }
+
+    async def settle_auctions(self, item_ids):
+        """Settles auctions whose end time has come (called by the scheduler).
+
+        Each item is its own write job (its own SAVEPOINT in the group commit), so
+        one failing item never holds back the others due at the same time. A failed
+        item is retried with backoff and given up after SETTLE_MAX_ATTEMPTS.
+        """
+        now_str = datetime.now().strftime(AUCTION_TIME_FORMAT)
+        results = await asyncio.gather(
+            *(self.bot.bank.write(lambda db, item_id=item_id: self._settle_auction(db, item_id, now_str)) for item_id in item_ids),
+            return_exceptions=True
+        )
+
+        notifications = []
+        for item_id, res in zip(item_ids, results):
+            if isinstance(res, Exception):
+                attempts = self.settle_failures.get(item_id, 0) + 1
+                if attempts >= SETTLE_MAX_ATTEMPTS:
+                    self.settle_failures.pop(item_id, None)
+                    print(f"Auction #{item_id} settlement failed {attempts} times, giving up: {res}")
+                    continue
+                self.settle_failures[item_id] = attempts
+                delay = SETTLE_RETRY_DELAY * 2 ** (attempts - 1)
+                print(f"Auction #{item_id} settlement failed (retry in {delay}s): {res}")
+                self.auction_scheduler.schedule(item_id, time.time() + delay)
+                continue
+            self.settle_failures.pop(item_id, None)
+            if res is not None:
+                notifications.append(res)
+
+        for n in notifications:
+            self.message_routes.set_status(n['item_id'], 'owned')
+            invalidate_net_worth(self.bot, n['final_owner_id'], n['seller_id'])
+            if n['sold']:
+                # A winning bid is a purchase too
+                record_demand(self.bot, n['tags'])
             
-        # Send Notifications (Outside DB Transaction to prevent locking)
+        # Send notifications from a separate task: the scheduler is free again as soon
+        # as the writes are done, not after every Discord round trip
+        if notifications:
+            task = self.bot.loop.create_task(self.send_auction_results(notifications))
+            self.notify_tasks.add(task)
+            task.add_done_callback(self.notify_tasks.discard)
+
+    async def send_auction_results(self, notifications):
+        """Closes the auction messages and posts the results in their threads."""
         for n in notifications:
-            if n['thread_id']:
-                 channel = self.bot.get_channel(n['thread_id'])
-                 if channel:
-                     try:
-                         # Update Original Message
-                         if n['msg_id']:
-                             try:
-                                msg = await channel.fetch_message(n['msg_id'])
-                                await msg.edit(content=f"🏁 **オークション終了**: (ID: #{n['item_id']})", view=None)
-                             except: pass
-                         
-                         embed = discord.Embed(title="🏁 オークション結果", description=n['status_msg'], color=discord.Color.gold())
-                         if n['img_url']: embed.set_image(url=n['img_url'])
-                         await channel.send(content=f"<@{n['final_owner_id']}>", embed=embed)
-                     except: pass
+            if not n['thread_id']:
+                continue
+            channel = self.bot.get_channel(n['thread_id'])
+            if not channel:
+                continue
+            # Update Original Message
+            if n['msg_id']:
+                try:
+                    msg = await channel.fetch_message(n['msg_id'])
+                    await msg.edit(content=f"🏁 **オークション終了**: (ID: #{n['item_id']})", view=None)
+                except discord.HTTPException as e:
+                    print(f"Auction #{n['item_id']}: could not close the auction message: {e}")
+
+            embed = discord.Embed(title="🏁 オークション結果", description=n['status_msg'], color=discord.Color.gold())
+            if n['img_url']: embed.set_image(url=n['img_url'])
+            try:
+                await channel.send(content=f"<@{n['final_owner_id']}>", embed=embed)
+            except discord.HTTPException as e:
+                print(f"Auction #{n['item_id']}: could not post the result: {e}")
 
     @commands.command(name="auction")
     async def auction(self, ctx, item_id: int, start_price: int, duration_minutes: int):
@@ -371,7 +526,7 @@ class MarketCog(commands.Cog):
              await ctx.send("❌ 開始価格は 100 Credits 以上で設定してください。")
              return
 
-        async with aiosqlite.connect(self.bot.bank.db_path) as db:
+        async with self.bot.bank.pool.reader() as db:
             # Check ownership
             cursor = await db.execute("""
                 SELECT tags, aesthetic_score, image_url, image_hash 
@@ -379,45 +534,46 @@ class MarketCog(commands.Cog):
                 WHERE item_id = ? AND buyer_id = ? AND status IN ('owned', 'on_sale')
             """, (item_id, ctx.author.id))
             row = await cursor.fetchone()
-            
-            if not row:
-                await ctx.send("❌ そのアイテムを所有していないか、すでに出品中です。")
-                return
-            
-            # Start Auction
-            end_time = datetime.now() + timedelta(minutes=duration_minutes)
-            end_time_str = end_time.strftime("%Y-%m-%d %H:%M:%S")
-            
-            tags, score, img_url, img_hash = row
-            
-            # Create Thread/Post
-            forum = discord.utils.get(ctx.guild.forums, name="闇市ギャラリー")
-            if not forum:
-                await ctx.send("❌ 闇市ギャラリーが見つかりません。")
-                return
-
-            embed = discord.Embed(title=f"🔨 オークション開催 (ID: #{item_id})", color=discord.Color.red())
-            embed.set_image(url=img_url)
-            embed.add_field(name="出品者", value=ctx.author.mention, inline=True)
-            embed.add_field(name="開始価格", value=f"💰 {start_price:,}", inline=True)
-            embed.add_field(name="終了時刻", value=f"<t:{int(end_time.timestamp())}:R>", inline=True)
-            embed.add_field(name="スコア", value=f"{score:.2f}", inline=True)
-            embed.add_field(name="Tags", value=tags[:100], inline=False)
-            
-            view = AuctionView(self.bot, item_id)
-            
-            thread_with_message = await forum.create_thread(
-                name=f"[Auction] ID:{item_id} | Price: {start_price}",
-                content=f"🔨 **オークション開始!** (ID: #{item_id})",
-                embed=embed,
-                view=view
-            )
-            thread = thread_with_message.thread if hasattr(thread_with_message, 'thread') else thread_with_message
-            msg = thread_with_message.message 
-            if not msg and hasattr(thread, 'starter_message'): msg = thread.starter_message
+        
+        if not row:
+            await ctx.send("❌ そのアイテムを所有していないか、すでに出品中です。")
+            return
+        
+        # Start Auction
+        end_time = datetime.now() + timedelta(minutes=duration_minutes)
+        end_time_str = end_time.strftime(AUCTION_TIME_FORMAT)
+        
+        tags, score, img_url, img_hash = row
+        
+        # Create Thread/Post
+        forum = discord.utils.get(ctx.guild.forums, name="闇市ギャラリー")
+        if not forum:
+            await ctx.send("❌ 闇市ギャラリーが見つかりません。")
+            return
 
-            # Update DB
-            await db.execute("""
+        embed = discord.Embed(title=f"🔨 オークション開催 (ID: #{item_id})", color=discord.Color.red())
+        embed.set_image(url=img_url)
+        embed.add_field(name="出品者", value=ctx.author.mention, inline=True)
+        embed.add_field(name="開始価格", value=f"💰 {start_price:,}", inline=True)
+        embed.add_field(name="終了時刻", value=f"<t:{int(end_time.timestamp())}:R>", inline=True)
+        embed.add_field(name="スコア", value=f"{score:.2f}", inline=True)
+        embed.add_field(name="Tags", value=tags[:100], inline=False)
+        
+        view = AuctionView(self.bot, item_id)
+        
+        thread_with_message = await forum.create_thread(
+            name=f"[Auction] ID:{item_id} | Price: {start_price}",
+            content=f"🔨 **オークション開始!** (ID: #{item_id})",
+            embed=embed,
+            view=view
+        )
+        thread = thread_with_message.thread if hasattr(thread_with_message, 'thread') else thread_with_message
+        msg = thread_with_message.message 
+        if not msg and hasattr(thread, 'starter_message'): msg = thread.starter_message
+
+        # Update DB (ownership is re-checked in the same statement)
+        async def start_auction(db):
+            cursor = await db.execute("""
                 UPDATE market_items 
                 SET status = 'on_auction', 
                     price = ?, 
@@ -426,11 +582,23 @@ class MarketCog(commands.Cog):
                     thread_id = ?, 
                     message_id = ?,
                     top_bidder_id = NULL
-                WHERE item_id = ?
-            """, (start_price, start_price, end_time_str, thread.id, msg.id if msg else 0, item_id))
-            await db.commit()
-            
-            await ctx.send(f"✅ **オークションを開始しました！**\n会場: {thread.mention}")
+                WHERE item_id = ? AND buyer_id = ? AND status IN ('owned', 'on_sale')
+            """, (start_price, start_price, end_time_str, thread.id, msg.id if msg else 0, item_id, ctx.author.id))
+            return cursor.rowcount
+
+        if await self.bot.bank.write(start_auction) != 1:
+            # Sold or put up elsewhere while the thread was being created
+            try:
+                await thread.delete()
+            except discord.HTTPException as e:
+                print(f"Auction #{item_id}: could not delete the thread: {e}")
+            await ctx.send("❌ そのアイテムを所有していないか、すでに出品中です。")
+            return
+        self.schedule_auction(item_id, end_time_str)
+        self.message_routes.put(msg.id if msg else 0, item_id, 'on_auction')
+        invalidate_net_worth(self.bot, ctx.author.id)
+        
+        await ctx.send(f"✅ **オークションを開始しました！**\n会場: {thread.mention}")
 
 class AuctionView(discord.ui.View):
     def __init__(self, bot, item_id):
@@ -446,26 +614,37 @@ class AuctionView(discord.ui.View):
         # Let's Look up by Channel (Thread) ID as per `BuyView` logic, safer for persistence.
         
         thread_id = interaction.channel_id
-        async with aiosqlite.connect(self.bot.bank.db_path) as db:
-            cursor = await db.execute("SELECT item_id, current_bid, top_bidder_id, auction_end_time, seller_id FROM market_items WHERE thread_id = ? AND status = 'on_auction'", (thread_id,))
-            row = await cursor.fetchone()
+        message_id = interaction.message.id if interaction.message else 0
+        routes = message_routes(self.bot)
+        route = routes.get(message_id) if routes else None
+        row = None
+        if not route or route[1] == 'on_auction':
+            columns = "item_id, current_bid, top_bidder_id, auction_end_time, seller_id"
+            async with self.bot.bank.pool.reader() as db:
+                if route:
+                    cursor = await db.execute(f"SELECT {columns} FROM market_items WHERE item_id = ? AND status = 'on_auction'", (route[0],))
+                    row = await cursor.fetchone()
+                else:
+                    row = await find_item_by_message(db, columns, message_id, thread_id, "status = 'on_auction'")
             
-            if not row:
-                 await interaction.response.send_message("❌ オークションが見つかりません(終了している可能性があります)。", ephemeral=True)
-                 return
+        if not row:
+             await interaction.response.send_message("❌ オークションが見つかりません(終了している可能性があります)。", ephemeral=True)
+             return
 
-            item_id_db, current_bid, top_bidder, end_time_str, seller_id = row
-            
-            if interaction.user.id == seller_id:
-                 await interaction.response.send_message("❌ 自分の商品には入札できません。", ephemeral=True)
-                 return
+        item_id_db, current_bid, top_bidder, end_time_str, seller_id = row
+        if routes is not None and not route:
+            routes.put(message_id, item_id_db, 'on_auction')
+        
+        if interaction.user.id == seller_id:
+             await interaction.response.send_message("❌ 自分の商品には入札できません。", ephemeral=True)
+             return
 
-            if interaction.user.id == top_bidder:
-                 await interaction.response.send_message("⚠️ あなたは現在の最高入札者です。", ephemeral=True)
-                 return
+        if interaction.user.id == top_bidder:
+             await interaction.response.send_message("⚠️ あなたは現在の最高入札者です。", ephemeral=True)
+             return
 
-            # Ask for Bid Amount via Modal
-            await interaction.response.send_modal(BidModal(self.bot, item_id_db, current_bid))
+        # Ask for Bid Amount via Modal
+        await interaction.response.send_modal(BidModal(self.bot, item_id_db, current_bid))
 
 class BidModal(discord.ui.Modal, title="入札金額を入力"):
     def __init__(self, bot, item_id, current_bid):
@@ -499,38 +678,33 @@ class BidModal(discord.ui.Modal, title="入札金額を入力"):
         # Check Balance
         buyer = interaction.user
         
-        extended = False
-        async with aiosqlite.connect(self.bot.bank.db_path, timeout=60.0) as db:
+        async def txn(db):
+            extended = False
+            refunded = None
+            owner_id = None
             # 1. Check Previous Bidder (Read first to prepare refund)
-            cursor = await db.execute("SELECT top_bidder_id, current_bid, auction_end_time FROM market_items WHERE item_id = ?", (self.item_id,))
+            cursor = await db.execute("SELECT top_bidder_id, current_bid, auction_end_time, buyer_id FROM market_items WHERE item_id = ?", (self.item_id,))
             row = await cursor.fetchone()
             
             # 2. Withdraw from New Bidder (Atomic)
-            try:
-                await self.bot.bank.withdraw_credits(buyer, bid_amount, db_conn=db)
-            except ValueError:
-                await interaction.response.send_message(f"❌ 残高不足です！ ({bid_amount:,} 必要)", ephemeral=True)
-                return
-            except Exception as e:
-                await interaction.response.send_message(f"❌ エラー: {e}", ephemeral=True)
-                return
+            await self.bot.bank.withdraw_credits(buyer, bid_amount, db_conn=db)
 
             # 3. Refund Previous Bidder (Atomic)
             if row:
-                prev_bidder_id, prev_bid_val, end_time_str = row
+                prev_bidder_id, prev_bid_val, end_time_str, owner_id = row
                 if prev_bidder_id and prev_bid_val > 0:
                      prev_bidder = interaction.guild.get_member(prev_bidder_id)
                      if prev_bidder:
                          await self.bot.bank.deposit_credits(prev_bidder, prev_bid_val, db_conn=db)
-                         try: await prev_bidder.send(f"↩️ **返金通知:** あなたの入札が更新されました (+{prev_bid_val:,} Credits)")
-                         except: pass
+                         refunded = (prev_bidder, prev_bid_val)
                      else:
                          # Manual Deposit if user left (Using same DB conn)
                          await db.execute("INSERT OR IGNORE INTO bank (user_id, guild_id, balance) VALUES (?, ?, 0)", (prev_bidder_id, interaction.guild.id))
                          await db.execute("UPDATE bank SET balance = balance + ? WHERE user_id = ? AND guild_id = ?", (prev_bid_val, prev_bidder_id, interaction.guild.id))
+                         self.bot.bank.mark_dirty(prev_bidder_id, interaction.guild.id)
 
                 # Update Auction State
-                end_time = datetime.strptime(end_time_str, "%Y-%m-%d %H:%M:%S")
+                end_time = datetime.strptime(end_time_str, AUCTION_TIME_FORMAT)
                 now = datetime.now()
                 new_end_time = end_time
                 
@@ -538,16 +712,39 @@ class BidModal(discord.ui.Modal, title="入札金額を入力"):
                      new_end_time = now + timedelta(minutes=2)
                      extended = True
                 
-                new_end_str = new_end_time.strftime("%Y-%m-%d %H:%M:%S")
+                new_end_str = new_end_time.strftime(AUCTION_TIME_FORMAT)
                 
                 await db.execute("""
                     UPDATE market_items 
                     SET current_bid = ?, top_bidder_id = ?, auction_end_time = ?
                     WHERE item_id = ?
                 """, (bid_amount, buyer.id, new_end_str, self.item_id))
-            
-            # 4. Commit All
-            await db.commit()
+                if extended:
+                    extended = new_end_str
+            return extended, refunded, owner_id
+
+        # 4. Commit All
+        try:
+            extended, refunded, owner_id = await self.bot.bank.write(txn)
+        except ValueError:
+            await interaction.response.send_message(f"❌ 残高不足です！ ({bid_amount:,} 必要)", ephemeral=True)
+            return
+        except Exception as e:
+            await interaction.response.send_message(f"❌ エラー: {e}", ephemeral=True)
+            return
+
+        # The owner's item is valued at the current bid while on auction
+        invalidate_net_worth(self.bot, buyer.id, owner_id)
+        if extended:
+            # Anti-sniping extension: move the deadline in the scheduler too
+            market = self.bot.get_cog("MarketCog")
+            if market:
+                market.schedule_auction(self.item_id, extended)
+        if refunded:
+            prev_bidder, prev_bid_val = refunded
+            invalidate_net_worth(self.bot, prev_bidder.id)
+            try: await prev_bidder.send(f"↩️ **返金通知:** あなたの入札が更新されました (+{prev_bid_val:,} Credits)")
+            except: pass
                 
         msg = f"✅ **入札成功！**\n現在の最高額: `{bid_amount:,}` Credits"
         if extended: msg += "\n⏳ 終了時間が2分延長されました！"
@@ -1,7 +1,6 @@
 import discord
 from discord.ext import commands
 import asyncio
-import aiosqlite
 
 class SetupCog(commands.Cog):
     def __init__(self, bot):
@@ -166,15 +165,16 @@ class SetupCog(commands.Cog):
             
             # Bot Gallery Setup (Same as before)
             if forum:
-                async with aiosqlite.connect(self.bot.bank.db_path, timeout=60.0) as db:
+                async with self.bot.bank.pool.reader() as db:
                      cursor = await db.execute("SELECT thread_id FROM user_galleries WHERE user_id = ?", (self.bot.user.id,))
                      row = await cursor.fetchone()
-                     if not row:
-                         thread = await forum.create_thread(name="[Official] 闇のブローカー", content="公式取引所")
-                         t = thread.thread if hasattr(thread, 'thread') else thread
-                         await db.execute("INSERT OR REPLACE INTO user_galleries (user_id, thread_id) VALUES (?, ?)", (self.bot.user.id, t.id))
-                         await db.commit()
-                         await ctx.send("✅ 公式ギャラリー設立完了")
+                if not row:
+                     thread = await forum.create_thread(name="[Official] 闇のブローカー", content="公式取引所")
+                     t = thread.thread if hasattr(thread, 'thread') else thread
+                     await self.bot.bank.write(lambda db: db.execute(
+                         "INSERT OR REPLACE INTO user_galleries (user_id, thread_id) VALUES (?, ?)", (self.bot.user.id, t.id)
+                     ))
+                     await ctx.send("✅ 公式ギャラリー設立完了")
 
             await ctx.send("🎉 **サーバー構成の再構築が完了しました！**")
 
@@ -1,8 +1,30 @@
 import discord
 from discord.ext import commands, tasks
-import aiosqlite
 import math
-import random
+import os
+import time
+import numpy as np
+from utils.stock_impacts import StockImpactBuffer
+from utils.stock_volatility import uniform_step, gbm_step
+from utils.stock_history import StockHistory
+from utils.net_worth import NetWorthService
+
+# !stock の表示期間: (ローソク足の解像度, 期間の秒数)
+CHART_PERIODS = {
+    "1h": (StockHistory.MINUTE, 3600),
+    "24h": (StockHistory.HOUR, 86400),
+    "7d": (StockHistory.HOUR, 7 * 86400),
+    "30d": (StockHistory.DAY, 30 * 86400),
+}
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+
+def sparkline(values):
+    if not values:
+        return ""
+    lo, hi = min(values), max(values)
+    if hi - lo < 1e-9:
+        return SPARK_CHARS[3] * len(values)
+    return "".join(SPARK_CHARS[int((v - lo) / (hi - lo) * (len(SPARK_CHARS) - 1))] for v in values)
 
 class StockView(discord.ui.View):
     def __init__(self, bot, tag_name):
@@ -54,66 +76,98 @@ class StockOrderModal(discord.ui.Modal, title="注文入力"):
 class StocksCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        # 鑑定・購入による値動きはメモリに溜めて、0.5秒ごと(または200件ごと)にまとめて書き込む
+        self.impacts = StockImpactBuffer(self.bot.bank, flush_interval=0.5, max_updates=200)
+        # 毎時の値動き: uniform (±5%) または gbm (タグごとのボラティリティ)
+        self.volatility_mode = os.getenv("STOCK_VOLATILITY_MODE", "uniform").lower()
+        self.default_volatility = float(os.getenv("STOCK_VOLATILITY", "0.03"))
+        self.rng = np.random.default_rng()
+        # 株価の履歴 (ティック + 1分/1時間/1日足)
+        self.history = StockHistory(self.bot.bank)
+        # 総資産 (現金 + 株 + 所持品)。30秒キャッシュ、取引で無効化
+        self.net_worth = NetWorthService(self.bot.bank, price_multiplier=self.impacts.multiplier, ttl=30.0)
         self.volatility_loop.start()
 
-    def cog_unload(self):
+    async def cog_unload(self):
         self.volatility_loop.cancel()
+        await self.impacts.close()
 
     @tasks.loop(hours=1.0)
     async def volatility_loop(self):
-        """Applies random market volatility every hour (-5% to +5%)."""
-        async with aiosqlite.connect(self.bot.bank.db_path, timeout=60.0) as db:
-            cursor = await db.execute("SELECT tag_name, current_price FROM tag_stocks")
+        """Applies random market volatility every hour (-5% to +5%, or a GBM step)."""
+        async def txn(db):
+            cursor = await db.execute("SELECT rowid, tag_name, current_price, volatility FROM tag_stocks")
             rows = await cursor.fetchall()
-            
-            for tag, price in rows:
-                # Random fluctuations: -5% to +5%
-                change_rate = random.uniform(-0.05, 0.05)
-                multiplier = 1.0 + change_rate
-                
-                # Apply update
-                new_price = max(1.0, price * multiplier)
-                
-                await db.execute("UPDATE tag_stocks SET current_price = ? WHERE tag_name = ?", (new_price, tag))
-                
-            await db.commit()
+            if not rows:
+                return []
+
+            # All multipliers in one vectorized pass, then one prepared UPDATE for the rows that moved
+            prices = np.array([r[2] for r in rows], dtype=np.float64)
+            if self.volatility_mode == "gbm":
+                sigma = np.array([r[3] if r[3] is not None else self.default_volatility for r in rows], dtype=np.float64)
+                new_prices = gbm_step(prices, sigma, rng=self.rng)
+            else:
+                new_prices = uniform_step(prices, 0.05, rng=self.rng)
+
+            changed = np.flatnonzero(new_prices != prices).tolist()
+            new_list = new_prices.tolist()
+            await db.executemany(
+                "UPDATE tag_stocks SET current_price = ? WHERE rowid = ?",
+                [(new_list[i], rows[i][0]) for i in changed]
+            )
+            return [(rows[i][1], new_list[i]) for i in changed]
+
+        ticks = await self.bot.bank.write(txn)
+        # History in write transactions of its own, so the price step holds the writer only for the UPDATE
+        try:
+            await self.history.record_batched(ticks)
+        except Exception as e:
+            print(f"Stock history recording failed: {e}")
+        # Old raw ticks / minute candles (in small transactions of their own)
+        try:
+            await self.history.compact()
+        except Exception as e:
+            print(f"Stock history compaction failed: {e}")
         # print("📉 Market Volatility Applied.")
 
     async def get_stock_price(self, tag_name, db_conn=None):
+        # Stored price plus impacts still waiting in the write-behind buffer
         if db_conn:
              cursor = await db_conn.execute("SELECT current_price FROM tag_stocks WHERE tag_name = ?", (tag_name,))
              row = await cursor.fetchone()
-             if row: return row[0]
+             if row: return max(1.0, row[0] * self.impacts.multiplier(tag_name))
              
              # If not exists, init it
              await db_conn.execute("INSERT OR IGNORE INTO tag_stocks (tag_name) VALUES (?)", (tag_name,))
-             return 100.0
+             return max(1.0, 100.0 * self.impacts.multiplier(tag_name))
         else:
-            async with aiosqlite.connect(self.bot.bank.db_path, timeout=60.0) as db:
-                 return await self.get_stock_price(tag_name, db)
+            # Read-only lookup: unknown tags are created by the next write, not here
+            async with self.bot.bank.pool.reader() as db:
+                cursor = await db.execute("SELECT current_price FROM tag_stocks WHERE tag_name = ?", (tag_name,))
+                row = await cursor.fetchone()
+            return max(1.0, (row[0] if row else 100.0) * self.impacts.multiplier(tag_name))
 
     async def update_stock_price(self, tag_name, multiplier, db_conn=None):
-        """Called by other Cogs to influence price."""
+        """Called by other Cogs to influence price.
+
+        Inside a transaction (db_conn) the price is updated right away; otherwise the
+        impact is buffered and written with the next batch.
+        """
         if db_conn:
-            await db_conn.execute("""
-                INSERT INTO tag_stocks (tag_name, current_price) VALUES (?, 100)
-                ON CONFLICT(tag_name) DO UPDATE SET current_price = max(1.0, current_price * ?)
-            """, (tag_name, multiplier))
+            await db_conn.execute(StockImpactBuffer.UPSERT, (tag_name, multiplier))
+            await StockHistory.record_current(db_conn, [tag_name])
         else:
-            async with aiosqlite.connect(self.bot.bank.db_path, timeout=60.0) as db:
-                await self.update_stock_price(tag_name, multiplier, db)
-                await db.commit()
+            self.impacts.add(tag_name, multiplier)
 
     async def process_buy(self, interaction, tag, amount):
-        async with aiosqlite.connect(self.bot.bank.db_path, timeout=60.0) as db:
+        async def txn(db):
             current_price = await self.get_stock_price(tag, db_conn=db)
             cost = int(current_price * amount)
             
             try:
                 await self.bot.bank.withdraw_credits(interaction.user, cost, db_conn=db)
             except ValueError:
-                 await interaction.response.send_message(f"❌ 資金不足: {cost:,} Cr 必要", ephemeral=True)
-                 return
+                return None, cost
 
             # Update Portfolio
             # Select first to calc average
@@ -132,19 +186,21 @@ class StocksCog(commands.Cog):
             # Limit impact to avoid exploits
             impact = 1.0 + (min(amount, 100) * 0.0001) 
             await self.update_stock_price(tag, impact, db_conn=db)
+            return current_price, cost
+
+        current_price, cost = await self.bot.bank.write(txn)
+        self.net_worth.invalidate(interaction.user.id)
+        if current_price is None:
+             await interaction.response.send_message(f"❌ 資金不足: {cost:,} Cr 必要", ephemeral=True)
+             return
             
-            await db.commit()
-            
-            await interaction.response.send_message(f"📈 **購入完了:** `{tag}` x{amount}株 (取得単価: {current_price:.1f})")
+        await interaction.response.send_message(f"📈 **購入完了:** `{tag}` x{amount}株 (取得単価: {current_price:.1f})")
 
     async def process_sell(self, interaction, tag, amount):
-        async with aiosqlite.connect(self.bot.bank.db_path, timeout=60.0) as db:
+        async def txn(db):
             cursor = await db.execute("SELECT amount, average_cost FROM user_stocks WHERE user_id = ? AND tag_name = ?", (interaction.user.id, tag))
             row = await cursor.fetchone()
-            
-            if not row or row[0] < amount:
-                 await interaction.response.send_message(f"❌ 保有株式が不足しています。", ephemeral=True)
-                 return
+            if not row or row[0] < amount: return None
             
             current_price = await self.get_stock_price(tag, db_conn=db)
             payout = int(current_price * amount)
@@ -161,22 +217,45 @@ class StocksCog(commands.Cog):
             # Selling lowers price
             impact = 1.0 - (min(amount, 100) * 0.0001)
             await self.update_stock_price(tag, impact, db_conn=db)
+            return payout, profit
 
-            await db.commit()
+        result = await self.bot.bank.write(txn)
+        self.net_worth.invalidate(interaction.user.id)
+        if result is None:
+             await interaction.response.send_message(f"❌ 保有株式が不足しています。", ephemeral=True)
+             return
             
-            profit_str = f"利益: +{int(profit):,}" if profit >= 0 else f"損失: {int(profit):,}"
-            await interaction.response.send_message(f"📉 **売却完了:** `{tag}` x{amount}株 ({profit_str}) -> `{payout:,} Cr` 受取")
+        payout, profit = result
+        profit_str = f"利益: +{int(profit):,}" if profit >= 0 else f"損失: {int(profit):,}"
+        await interaction.response.send_message(f"📉 **売却完了:** `{tag}` x{amount}株 ({profit_str}) -> `{payout:,} Cr` 受取")
 
     @commands.command(name="stock", aliases=["kabuka"])
-    async def stock(self, ctx, tag_name: str):
-        """特定のタグの株価情報を確認します。"""
+    async def stock(self, ctx, tag_name: str, period: str = "24h"):
+        """特定のタグの株価情報を確認します。期間: 1h / 24h / 7d / 30d"""
+        if period not in CHART_PERIODS:
+            await ctx.send(f"❌ 期間は {' / '.join(CHART_PERIODS)} から選んでください。")
+            return
         price = await self.get_stock_price(tag_name)
-        async with aiosqlite.connect(self.bot.bank.db_path, timeout=60.0) as db:
+        resolution, span = CHART_PERIODS[period]
+        candles = await self.history.candles(tag_name, resolution, time.time() - span)
+        async with self.bot.bank.pool.reader() as db:
             cursor = await db.execute("SELECT amount, average_cost FROM user_stocks WHERE user_id = ? AND tag_name = ?", (ctx.author.id, tag_name))
             row = await cursor.fetchone()
             
         embed = discord.Embed(title=f"📊 株価情報: {tag_name}", color=discord.Color.blue())
         embed.add_field(name="現在値", value=f"**{price:.2f} Cr**", inline=False)
+        if candles:
+            first_open = candles[0][1]
+            change = (price - first_open) / first_open * 100 if first_open else 0.0
+            sign = "+" if change >= 0 else ""
+            high = max(c[2] for c in candles)
+            low = min(c[3] for c in candles)
+            chart = sparkline([c[4] for c in StockHistory.downsample(candles, 24)])
+            embed.add_field(
+                name=f"推移 ({period})",
+                value=f"`{chart}`\n変動: `{sign}{change:.2f}%` / 高値: `{high:.2f}` / 安値: `{low:.2f}`",
+                inline=False
+            )
         
         if row:
             amount, avg_cost = row
@@ -193,9 +272,8 @@ class StocksCog(commands.Cog):
     @commands.command(name="portfolio")
     async def portfolio(self, ctx):
         """保有株式一覧を表示します。"""
-        async with aiosqlite.connect(self.bot.bank.db_path, timeout=60.0) as db:
-            cursor = await db.execute("SELECT tag_name, amount, average_cost FROM user_stocks WHERE user_id = ? ORDER BY amount DESC", (ctx.author.id,))
-            rows = await cursor.fetchall()
+        # Holdings and prices in one join
+        rows = await self.net_worth.holdings(ctx.author.id)
             
         if not rows:
             await ctx.send("💼 **ポートフォリオ:** 株式を保有していません。")
@@ -206,10 +284,7 @@ class StocksCog(commands.Cog):
         total_val = 0
         total_pl = 0
         
-        for tag, amt, cost in rows:
-            # Note: Fetching current price for EACH tag in loop is N+1 query.
-            # But simple enough for now. optimized would be "SELECT ... FROM tag_stocks WHERE tag_name IN (...)"
-            curr = await self.get_stock_price(tag) 
+        for tag, amt, cost, curr in rows:
             val = curr * amt
             pl = val - (cost * amt)
             
@@ -224,5 +299,17 @@ class StocksCog(commands.Cog):
         embed.set_footer(text=f"総評価額: {int(total_val):,} Cr (損益: {sign_total}{int(total_pl):,})")
         await ctx.send(embed=embed)
 
+    @commands.command(name="networth", aliases=["shisan"])
+    async def networth(self, ctx, member: discord.Member = None):
+        """総資産 (現金 + 株式 + 所持品) を表示します。"""
+        member = member or ctx.author
+        worth = await self.net_worth.get(member.id, ctx.guild.id)
+        embed = discord.Embed(title=f"🏦 {member.display_name}の総資産", color=discord.Color.gold())
+        embed.add_field(name="💴 現金", value=f"{worth['cash']:,} Cr", inline=True)
+        embed.add_field(name="📈 株式", value=f"{worth['stocks']:,} Cr", inline=True)
+        embed.add_field(name="🖼️ 所持品", value=f"{worth['items']:,} Cr", inline=True)
+        embed.add_field(name="合計", value=f"**{worth['total']:,} Cr**", inline=False)
+        await ctx.send(embed=embed)
+
 async def setup(bot):
     await bot.add_cog(StocksCog(bot))
@@ -0,0 +1,143 @@
+"""
+Danbooru タグダンプの一括インポート (Bulk tag dump importer)
+
+Loads a Danbooru tag export into `tag_metadata` (source = 'dump') so rarity
+can be computed offline. The file is parsed as a stream and inserted in
+batches, so memory stays flat even for millions of tags.
+
+Supported formats:
+  - CSV with a header containing `name` and `post_count` (or `count`)
+  - Headerless CSV `name,category,post_count[,aliases]` (tag autocomplete format)
+  - NDJSON / JSON Lines (one tag object per line)
+  - A JSON array of tag objects (e.g. a saved `tags.json` API response)
+
+Usage:
+  python import_tags.py danbooru_tags.csv [--db economy.db] [--batch 5000]
+
+The schema is brought up to date first with the bot's migrations (utils/migrations.py).
+The bot loads the table at startup, so restart it after importing.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+import aiosqlite
+
+from utils.migrations import migrate
+
+JSON_CHUNK = 1 << 16
+
+def iter_csv(f):
+    reader = csv.reader(f)
+    first = next(reader, None)
+    if first is None:
+        return
+    header = [c.strip().lower() for c in first]
+    if 'name' in header:
+        name_i = header.index('name')
+        count_i = header.index('post_count') if 'post_count' in header else header.index('count')
+    else:
+        # Headerless: name, category, post_count, aliases
+        name_i, count_i = 0, 2
+        yield first[name_i], first[count_i]
+    for row in reader:
+        if len(row) > max(name_i, count_i):
+            yield row[name_i], row[count_i]
+
+def iter_json_array(f):
+    """Yields the objects of a top-level JSON array without loading the whole file."""
+    decoder = json.JSONDecoder()
+    buf = f.read(JSON_CHUNK).lstrip()
+    if not buf.startswith('['):
+        raise ValueError("Expected a JSON array")
+    buf = buf[1:]
+    eof = False
+    while True:
+        buf = buf.lstrip().lstrip(',').lstrip()
+        if buf.startswith(']'):
+            return
+        try:
+            obj, end = decoder.raw_decode(buf)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            chunk = f.read(JSON_CHUNK)
+            eof = not chunk
+            buf += chunk
+            continue
+        yield obj
+        buf = buf[end:]
+
+def iter_json(f):
+    head = f.read(JSON_CHUNK).lstrip()
+    f.seek(0)
+    if head.startswith('['):
+        objects = iter_json_array(f)
+    else:
+        objects = (json.loads(line) for line in f if line.strip())
+    yield from _objects_to_rows(objects)
+
+def _objects_to_rows(objects):
+    for obj in objects:
+        if isinstance(obj, dict) and 'name' in obj:
+            yield obj['name'], obj.get('post_count', obj.get('count', 0))
+
+def iter_rows(path):
+    f = open(path, 'r', encoding='utf-8-sig', newline='')
+    try:
+        if path.lower().endswith('.csv'):
+            yield from iter_csv(f)
+        else:
+            yield from iter_json(f)
+    finally:
+        f.close()
+
+async def migrate_db(path):
+    async with aiosqlite.connect(path, timeout=60, isolation_level=None) as db:
+        await migrate(db)
+
+def main():
+    parser = argparse.ArgumentParser(description="Import a Danbooru tag dump into tag_metadata.")
+    parser.add_argument("path", help="CSV / JSON / NDJSON tag dump")
+    parser.add_argument("--db", default="economy.db", help="SQLite database (default: economy.db)")
+    parser.add_argument("--batch", type=int, default=5000, help="rows per executemany (default: 5000)")
+    args = parser.parse_args()
+
+    # Same versioned schema steps as the bot (tag_metadata.source is v4)
+    asyncio.run(migrate_db(args.db))
+
+    conn = sqlite3.connect(args.db, timeout=60)
+    conn.execute("PRAGMA journal_mode=WAL")
+
+    now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    sql = "INSERT OR REPLACE INTO tag_metadata (tag_name, post_count, last_updated, source) VALUES (?, ?, ?, 'dump')"
+    start = time.perf_counter()
+    total = skipped = 0
+    batch = []
+    for name, count in iter_rows(args.path):
+        try:
+            batch.append((name.strip(), int(count), now_str))
+        except (TypeError, ValueError, AttributeError):
+            skipped += 1
+            continue
+        if len(batch) >= args.batch:
+            with conn:
+                conn.executemany(sql, batch)
+            total += len(batch)
+            batch.clear()
+            print(f"\r{total:,} tags...", end="", file=sys.stderr)
+    if batch:
+        with conn:
+            conn.executemany(sql, batch)
+        total += len(batch)
+    conn.close()
+
+    print(f"\nImported {total:,} tags ({skipped:,} skipped) in {time.perf_counter() - start:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+ScalableBloomFilter: growth into slices, save/load round trip and the legacy single-filter file.
+"""
+import pytest
+
+from utils.bloom_filter import BloomFilter, ScalableBloomFilter
+
+def urls(start, stop):
+    return [f"https://cdn.example.invalid/attachments/{i}.png" for i in range(start, stop)]
+
+def test_grows_into_slices_without_false_negatives():
+    sbf = ScalableBloomFilter(initial_capacity=100, error_rate=0.01)
+    added = urls(0, 1000)
+    for url in added:
+        sbf.add(url)
+
+    # 100 + 200 + 400 < 1000 <= 100 + 200 + 400 + 800
+    assert len(sbf.slices) == 4
+    assert all(sbf.check(url) for url in added)
+    # Re-adding known items neither counts them again nor grows the filter
+    count = len(sbf)
+    for url in added[:100]:
+        sbf.add(url)
+    assert len(sbf) == count
+    assert len(sbf.slices) == 4
+
+def test_false_positive_rate_stays_bounded():
+    sbf = ScalableBloomFilter(initial_capacity=100, error_rate=0.01)
+    for url in urls(0, 2000):
+        sbf.add(url)
+    false_positives = sum(sbf.check(url) for url in urls(10000, 30000))
+    # Overall bound is error_rate; allow slack for sampling noise
+    assert false_positives / 20000 < 0.02
+
+@pytest.mark.parametrize("use_mmap", [True, False])
+def test_save_load_round_trip(tmp_path, use_mmap):
+    path = str(tmp_path / "bloom_filter.bin")
+    sbf = ScalableBloomFilter(initial_capacity=50, error_rate=0.01, growth=3, tightening=0.8)
+    added = urls(0, 300)
+    for url in added:
+        sbf.add(url)
+    sbf.seen_item(1234)
+    sbf.seen_item(17)  # never moves backwards
+    sbf.save_to_file(path)
+
+    loaded = ScalableBloomFilter.load_from_file(path, use_mmap=use_mmap)
+
+    assert loaded is not None
+    assert (loaded.initial_capacity, loaded.error_rate, loaded.growth, loaded.tightening) == (50, 0.01, 3, 0.8)
+    assert loaded.last_item_id == 1234
+    assert loaded.counts == sbf.counts
+    assert [bytes(bf.bits) for bf in loaded.slices] == [bytes(bf.bits) for bf in sbf.slices]
+    assert all(loaded.check(url) for url in added)
+
+    # The loaded filter keeps growing, and saving over the mapped file works
+    for url in urls(300, 600):
+        loaded.add(url)
+    loaded.save_to_file(path)
+    again = ScalableBloomFilter.load_from_file(path, use_mmap=use_mmap)
+    assert len(again) == len(loaded)
+    assert all(again.check(url) for url in urls(0, 600))
+
+def test_legacy_single_filter_file_is_rebuilt(tmp_path):
+    path = str(tmp_path / "bloom_filter.bin")
+    bf = BloomFilter(1000, 0.001)
+    bf.add("https://cdn.example.invalid/old.png")
+    bf.save_to_file(path)
+
+    assert ScalableBloomFilter.load_from_file(path) is None
+
+def test_missing_or_corrupt_file(tmp_path):
+    assert ScalableBloomFilter.load_from_file(str(tmp_path / "missing.bin")) is None
+    path = tmp_path / "corrupt.bin"
+    path.write_bytes(b"SBLF" + b"\x00" * 8)
+    assert ScalableBloomFilter.load_from_file(str(path)) is None
@@ -0,0 +1,120 @@
+"""
+DeadlineScheduler: due keys, rescheduling, cancellation, early wake and retries.
+
+The scheduler's clock is injected as the event loop's own clock (starting at 0),
+so deadlines are a few tens of milliseconds apart and the tests stay fast.
+"""
+import asyncio
+
+from utils.deadline_scheduler import DeadlineScheduler
+
+class Recorder:
+    """Scheduler callback that records (time, keys) per call."""
+
+    def __init__(self, clock, fail_first=0):
+        self.clock = clock
+        self.calls = []
+        self.fail_first = fail_first
+        self.event = asyncio.Event()
+
+    async def __call__(self, keys):
+        self.calls.append((self.clock(), sorted(keys)))
+        self.event.set()
+        if self.fail_first:
+            self.fail_first -= 1
+            raise RuntimeError("settlement failed")
+
+    async def wait_calls(self, n, timeout=2.0):
+        async def until():
+            while len(self.calls) < n:
+                self.event.clear()
+                await self.event.wait()
+        await asyncio.wait_for(until(), timeout)
+
+def loop_clock():
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    return lambda: loop.time() - start
+
+def test_due_keys_are_batched_and_run_in_order():
+    async def scenario():
+        clock = loop_clock()
+        recorder = Recorder(clock)
+        scheduler = DeadlineScheduler(recorder, clock=clock)
+        scheduler.schedule("a", -1.0)
+        scheduler.schedule("b", 0.0)
+        scheduler.schedule("c", 0.05)
+        scheduler.start()
+        try:
+            await recorder.wait_calls(2)
+        finally:
+            scheduler.stop()
+        return recorder.calls, len(scheduler)
+
+    calls, remaining = asyncio.run(scenario())
+    assert [keys for _, keys in calls] == [["a", "b"], ["c"]]
+    assert calls[1][0] >= 0.05
+    assert remaining == 0
+
+def test_reschedule_and_cancel():
+    async def scenario():
+        clock = loop_clock()
+        recorder = Recorder(clock)
+        scheduler = DeadlineScheduler(recorder, clock=clock)
+        scheduler.schedule("moved", 0.05)
+        scheduler.schedule("stays", 0.1)
+        scheduler.schedule("cancelled", 0.08)
+        scheduler.start()
+        # A bid extends "moved" past "stays"; "cancelled" is withdrawn
+        scheduler.schedule("moved", 0.15)
+        scheduler.cancel("cancelled")
+        try:
+            await recorder.wait_calls(2)
+            # The stale heap entries (0.05 / 0.08) must not fire anything later
+            await asyncio.sleep(0.1)
+        finally:
+            scheduler.stop()
+        return recorder.calls, scheduler.next_deadline()
+
+    calls, next_deadline = asyncio.run(scenario())
+    assert [keys for _, keys in calls] == [["stays"], ["moved"]]
+    assert calls[0][0] >= 0.1
+    assert calls[1][0] >= 0.15
+    assert next_deadline is None
+
+def test_earlier_deadline_wakes_the_sleeper():
+    async def scenario():
+        clock = loop_clock()
+        recorder = Recorder(clock)
+        scheduler = DeadlineScheduler(recorder, clock=clock)
+        scheduler.schedule("far", 3600.0)
+        scheduler.start()
+        await asyncio.sleep(0.02)  # sleeper is now waiting for "far"
+        scheduler.schedule("soon", clock() + 0.05)
+        try:
+            await recorder.wait_calls(1)
+        finally:
+            scheduler.stop()
+        return recorder.calls, scheduler.next_deadline()
+
+    calls, next_deadline = asyncio.run(scenario())
+    assert [keys for _, keys in calls] == [["soon"]]
+    assert calls[0][0] < 1.0
+    assert next_deadline == 3600.0
+
+def test_failed_callback_is_retried():
+    async def scenario():
+        clock = loop_clock()
+        recorder = Recorder(clock, fail_first=1)
+        scheduler = DeadlineScheduler(recorder, clock=clock, retry_delay=0.05)
+        scheduler.schedule("a", 0.0)
+        scheduler.start()
+        try:
+            await recorder.wait_calls(2)
+        finally:
+            scheduler.stop()
+        return recorder.calls
+
+    calls = asyncio.run(scenario())
+    assert [keys for _, keys in calls] == [["a"], ["a"]]
+    assert calls[1][0] - calls[0][0] >= 0.05
@@ -0,0 +1,126 @@
+"""
+MarketTrends must give the same saturation multipliers as the per-tag SQL path it replaced.
+
+The old path (cogs/broker.py before MarketTrends) is reproduced below against
+one database, MarketTrends runs against a copy of it, and both see the same
+upload sequence. `now` is pinned so lazy decay does not come into play.
+"""
+import asyncio
+import math
+import random
+import shutil
+import sqlite3
+import time
+
+import aiosqlite
+
+from bot import BankSystem
+from utils.market_trends import MarketTrends
+
+TAGS = [f"tag_{i}" for i in range(40)]
+
+# -----------------------------------------------------------
+# Old per-tag path
+# -----------------------------------------------------------
+async def old_update_market_trends(db, tags):
+    for tag in tags:
+        await db.execute("INSERT OR IGNORE INTO market_trends (tag_name) VALUES (?)", (tag,))
+        await db.execute("""
+            UPDATE market_trends
+            SET saturation = saturation + 1
+            WHERE tag_name = ?
+        """, (tag,))
+
+async def old_get_tag_value_modifier(db, tags):
+    multiplier = 1.0
+    for tag in tags:
+        cursor = await db.execute("SELECT current_price, saturation FROM market_trends WHERE tag_name = ?", (tag,))
+        row = await cursor.fetchone()
+        if row:
+            price, sat = row
+            sat_mult = 1.0 / math.log10(max(sat, 0) + 2)
+            if sat_mult < multiplier:
+                multiplier = sat_mult
+    return max(multiplier, 0.1)
+
+def seed_baseline_db(path, rng):
+    """market_trends as the baseline schema created it, with some existing saturation."""
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE market_trends (
+            tag_name TEXT PRIMARY KEY,
+            current_price INTEGER DEFAULT 100,
+            saturation INTEGER DEFAULT 0,
+            trend_bonus INTEGER DEFAULT 0
+        )
+    """)
+    conn.executemany(
+        "INSERT INTO market_trends (tag_name, saturation) VALUES (?, ?)",
+        [(tag, rng.randint(0, 500)) for tag in TAGS[:15]]
+    )
+    conn.commit()
+    conn.close()
+
+async def run_both(old_path, new_path, uploads, queries):
+    bank = BankSystem(new_path, readers=2)
+    now = time.time()
+    await bank.initialize()
+    try:
+        trends = MarketTrends(bank)
+        await trends.load()
+        async with aiosqlite.connect(old_path) as old_db:
+            old_results, new_results = [], []
+            for tags, query in zip(uploads, queries):
+                await old_update_market_trends(old_db, tags)
+                await old_db.commit()
+                values = await bank.write(lambda db, tags=tags: MarketTrends.record_uploads(db, tags, now=now))
+                trends.apply(values)
+
+                old_results.append(await old_get_tag_value_modifier(old_db, query))
+                new_results.append(trends.modifier(query, now=now))
+
+            cursor = await old_db.execute("SELECT tag_name, saturation FROM market_trends")
+            old_table = dict(await cursor.fetchall())
+        async with bank.pool.reader() as db:
+            cursor = await db.execute("SELECT tag_name, saturation FROM market_trends")
+            new_table = dict(await cursor.fetchall())
+        memory = {tag: trends.current(tag, now) for tag in trends.saturation}
+    finally:
+        await bank.close()
+    return old_results, new_results, old_table, new_table, memory
+
+def test_multipliers_match_old_path(tmp_path):
+    rng = random.Random(1234)
+    old_path = str(tmp_path / "old.db")
+    new_path = str(tmp_path / "new.db")
+    seed_baseline_db(old_path, rng)
+    shutil.copyfile(old_path, new_path)
+
+    uploads = [rng.sample(TAGS, rng.randint(1, 8)) for _ in range(300)]
+    # Queries mix seeded, uploaded and never-seen tags.
+    queries = [rng.sample(TAGS, rng.randint(1, 6)) + ["unknown_tag"] for _ in range(300)]
+
+    old_results, new_results, old_table, new_table, memory = asyncio.run(
+        run_both(old_path, new_path, uploads, queries)
+    )
+
+    assert new_results == old_results
+    assert new_table == old_table
+    assert memory == old_table
+
+def test_repeated_tags_in_one_upload(tmp_path):
+    # The old path adds one saturation per occurrence; so must record_uploads.
+    rng = random.Random(5)
+    old_path = str(tmp_path / "old.db")
+    new_path = str(tmp_path / "new.db")
+    seed_baseline_db(old_path, rng)
+    shutil.copyfile(old_path, new_path)
+
+    uploads = [["tag_1", "tag_1", "tag_30"], ["tag_30", "tag_30", "tag_30"]]
+    queries = [["tag_1"], ["tag_30", "tag_1"]]
+    old_results, new_results, old_table, new_table, _ = asyncio.run(
+        run_both(old_path, new_path, uploads, queries)
+    )
+
+    assert new_results == old_results
+    assert new_table == old_table
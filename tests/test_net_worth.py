@@ -0,0 +1,35 @@
+"""
+NetWorthService item valuation: owned items at their appraisal, auctioned items at MAX(price, current_bid).
+"""
+import asyncio
+
+from bot import BankSystem
+from utils.net_worth import NetWorthService
+
+USER = 1
+GUILD = 10
+
+async def net_worth_items(tmp_path, rows):
+    bank = BankSystem(str(tmp_path / "worth.db"), readers=2)
+    await bank.initialize()
+    try:
+        await bank.write(lambda db: db.executemany(
+            """
+            INSERT INTO market_items (seller_id, image_url, aesthetic_score, price, status, buyer_id, current_bid)
+            VALUES (?, 'http://example.invalid/a.png', ?, ?, ?, ?, ?)
+            """,
+            rows
+        ))
+        return (await NetWorthService(bank).get(USER, GUILD))['items']
+    finally:
+        await bank.close()
+
+def test_owned_and_auctioned_items(tmp_path):
+    items = asyncio.run(net_worth_items(tmp_path, [
+        (2, 2.0, 500, 'owned', USER, 0),               # 1000 * 2^2
+        (USER, 3.0, 7000, 'on_auction', USER, 7000),   # no bids yet: start price
+        (USER, 3.0, 7000, 'on_auction', USER, 12000),  # outbid: current bid
+        (USER, 5.0, 900, 'on_sale', USER, 0),          # listed for sale: not counted
+        (USER, 5.0, 900, 'on_auction', 3, 900),        # someone else's auction
+    ]))
+    assert items == 4000 + 7000 + 12000
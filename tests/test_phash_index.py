@@ -0,0 +1,61 @@
+"""
+PHashIndex band lookup must find the same nearest distance as a brute-force scan.
+"""
+import random
+
+from utils.phash_index import PHashIndex
+
+def flip(h, n, rng):
+    for bit in rng.sample(range(64), n):
+        h ^= 1 << bit
+    return h
+
+def brute_force(hashes, q, max_distance):
+    best = min(((q ^ h).bit_count() for h in hashes), default=None)
+    return best if best is not None and best <= max_distance else None
+
+def test_band_lookup_matches_brute_force():
+    rng = random.Random(42)
+    hashes = [rng.getrandbits(64) for _ in range(2000)]
+    index = PHashIndex()
+    for h in hashes:
+        index.add(f"{h:016x}")
+    assert len(index) == len(set(hashes))
+
+    # Near copies of indexed hashes (0..8 flipped bits) plus unrelated queries
+    queries = [flip(rng.choice(hashes), rng.randint(0, 8), rng) for _ in range(500)]
+    queries += [rng.getrandbits(64) for _ in range(200)]
+    for q in queries:
+        for max_distance in (3, 5, 7):
+            expected = brute_force(hashes, q, max_distance)
+            assert index.nearest(q, max_distance) == expected
+            found = index.search(q, max_distance)
+            if expected is None:
+                assert found is None
+            else:
+                h, dist = found
+                assert dist == expected == (q ^ h).bit_count()
+                assert h in index
+
+def test_hex_strings_and_ints_are_interchangeable():
+    index = PHashIndex()
+    index.add("f0e1d2c3b4a59687")
+    assert 0xf0e1d2c3b4a59687 in index
+    assert index.search(0xf0e1d2c3b4a59687 ^ 0b101) == (0xf0e1d2c3b4a59687, 2)
+
+def test_remove_keeps_shared_hashes_until_last_copy():
+    index = PHashIndex()
+    index.add("00000000000000ff")
+    index.add("00000000000000ff")  # two items with an identical image
+    index.remove("00000000000000ff")
+    assert index.nearest("00000000000000fe") == 1
+    index.remove("00000000000000ff")
+    assert index.nearest("00000000000000fe") is None
+    assert len(index) == 0
+    index.remove("00000000000000ff")  # unknown: ignored
+
+def test_clear():
+    index = PHashIndex()
+    index.add(1)
+    index.clear()
+    assert len(index) == 0 and 1 not in index
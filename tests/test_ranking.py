@@ -0,0 +1,61 @@
+"""
+RankedSet rank / top against a plain sorted list after random inserts, moves and removals.
+"""
+import random
+
+import pytest
+
+from utils.ranking import RankedSet
+
+def expected_order(scores):
+    # Highest score first; ties by member (as user ids are)
+    return sorted(scores, key=lambda m: (-scores[m], m))
+
+def check(ranked, scores):
+    order = expected_order(scores)
+    assert len(ranked) == len(order)
+    for i, member in enumerate(order):
+        assert ranked.rank(member) == i
+        assert ranked.score(member) == scores[member]
+    assert ranked.top(len(order) + 5) == [(m, scores[m]) for m in order]
+    for offset in range(0, len(order), 7):
+        assert ranked.top(10, offset) == [(m, scores[m]) for m in order[offset:offset + 10]]
+    assert ranked.top(10, len(order)) == []
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_sorted_list(seed):
+    rng = random.Random(seed)
+    ranked = RankedSet()
+    ranked._rng = random.Random(seed)  # reproducible skip-list levels
+    scores = {}
+    for step in range(3000):
+        member = rng.randrange(300)
+        op = rng.random()
+        if op < 0.6:
+            # Small score range: plenty of ties and moves to an equal score
+            score = rng.randrange(50)
+            ranked.set(member, score)
+            scores[member] = score
+        else:
+            ranked.discard(member)
+            scores.pop(member, None)
+        if step % 250 == 0:
+            check(ranked, scores)
+    check(ranked, scores)
+
+    for member in list(scores):
+        ranked.discard(member)
+    assert len(ranked) == 0
+    assert ranked.top(10) == []
+
+def test_missing_members_and_clear():
+    ranked = RankedSet()
+    assert ranked.rank(1) is None
+    assert ranked.score(1) is None
+    ranked.discard(1)
+    ranked.set(1, 10)
+    ranked.set(2, 20)
+    assert 1 in ranked and 3 not in ranked
+    assert ranked.top(1, offset=1) == [(1, 10)]
+    ranked.clear()
+    assert len(ranked) == 0 and ranked.rank(2) is None
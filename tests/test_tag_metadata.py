@@ -0,0 +1,151 @@
+"""
+TagMetadataService against a local aiohttp stub of Danbooru's /tags.json.
+"""
+import asyncio
+import math
+
+from aiohttp import web
+
+from bot import BankSystem
+from utils.tag_metadata import TagMetadataService
+
+class DanbooruStub:
+    """Answers `search[name_comma]` from a fixed tag -> post_count dict."""
+
+    def __init__(self, counts, delay=0.0):
+        self.counts = counts
+        self.delay = delay
+        self.requests = []  # list of name lists, one per request
+        self.failures = []  # statuses to return (in order) before answering normally
+        self.retry_after = None
+
+    async def handle(self, request):
+        names = request.query.get("search[name_comma]", "").split(",")
+        self.requests.append(names)
+        if self.failures:
+            headers = {"Retry-After": self.retry_after} if self.retry_after is not None else {}
+            return web.Response(status=self.failures.pop(0), headers=headers)
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return web.json_response([
+            {"name": name, "post_count": self.counts[name]} for name in names if name in self.counts
+        ])
+
+async def run_with_service(tmp_path, stub, fn, **kwargs):
+    app = web.Application()
+    app.router.add_get("/tags.json", stub.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+
+    bank = BankSystem(str(tmp_path / "tags.db"), readers=2)
+    await bank.initialize()
+    service = TagMetadataService(bank, base_url=f"http://127.0.0.1:{port}", **kwargs)
+    try:
+        return await fn(service, bank)
+    finally:
+        await service.close()
+        await bank.close()
+        await runner.cleanup()
+
+async def stored_counts(bank):
+    async with bank.pool.reader() as db:
+        cursor = await db.execute("SELECT tag_name, post_count FROM tag_metadata")
+        return dict(await cursor.fetchall())
+
+def test_misses_are_batched(tmp_path):
+    names = [f"tag_{i}" for i in range(250)]
+    stub = DanbooruStub({name: i for i, name in enumerate(names)})
+
+    async def scenario(service, bank):
+        counts = await service.get_counts(names)
+        # Second lookup is served from tag_metadata
+        again = await service.get_counts(names)
+        return counts, again, await stored_counts(bank)
+
+    counts, again, stored = asyncio.run(run_with_service(tmp_path, stub, scenario))
+
+    assert len(stub.requests) == math.ceil(len(names) / 100)
+    assert all(len(req) <= 100 for req in stub.requests)
+    assert counts == {name: i for i, name in enumerate(names)}
+    assert again == counts
+    assert stored == counts
+
+def test_concurrent_callers_share_one_request(tmp_path):
+    stub = DanbooruStub({"rare_tag": 42}, delay=0.2)
+
+    async def scenario(service, bank):
+        return await asyncio.gather(*(service.get_count("rare_tag") for _ in range(5)))
+
+    results = asyncio.run(run_with_service(tmp_path, stub, scenario))
+
+    assert results == [42] * 5
+    assert len(stub.requests) == 1
+
+def test_retries_429_and_5xx_with_backoff(tmp_path):
+    stub = DanbooruStub({"a": 1, "b": 2})
+    stub.failures = [429, 503, 500]
+
+    async def scenario(service, bank):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        counts = await service.get_counts(["a", "b"])
+        return counts, loop.time() - started
+
+    counts, elapsed = asyncio.run(run_with_service(tmp_path, stub, scenario, backoff=0.05, max_retries=3))
+
+    assert counts == {"a": 1, "b": 2}
+    assert len(stub.requests) == 4
+    # 0.05 + 0.1 + 0.2 seconds of backoff
+    assert elapsed >= 0.35
+
+def test_retry_after_header_and_giving_up(tmp_path):
+    stub = DanbooruStub({"a": 1})
+    stub.failures = [429, 429, 429]
+    stub.retry_after = "0"
+
+    async def scenario(service, bank):
+        counts = await service.get_counts(["a"])
+        return counts, await stored_counts(bank)
+
+    counts, stored = asyncio.run(run_with_service(tmp_path, stub, scenario, backoff=10, max_retries=2))
+
+    # Retry-After: 0 overrides the 10s backoff; after max_retries the tag is unresolved, not cached
+    assert len(stub.requests) == 3
+    assert counts == {"a": 9999999}
+    assert stored == {}
+
+def test_names_missing_from_response_are_cached_as_zero(tmp_path):
+    stub = DanbooruStub({"known": 1234})
+
+    async def scenario(service, bank):
+        counts = await service.get_counts(["known", "no_such_tag"])
+        again = await service.get_counts(["no_such_tag"])
+        return counts, again, await stored_counts(bank)
+
+    counts, again, stored = asyncio.run(run_with_service(tmp_path, stub, scenario))
+
+    assert counts == {"known": 1234, "no_such_tag": 0}
+    assert again == {"no_such_tag": 0}
+    assert stored == {"known": 1234, "no_such_tag": 0}
+    assert len(stub.requests) == 1
+
+def test_refetch_keeps_dump_source(tmp_path):
+    stub = DanbooruStub({"imported": 500, "fresh": 7})
+
+    async def scenario(service, bank):
+        # A bulk-imported row that has gone stale
+        await bank.write(lambda db: db.execute(
+            "INSERT INTO tag_metadata (tag_name, post_count, last_updated, source) VALUES ('imported', 100, '2000-01-01 00:00:00', 'dump')"
+        ))
+        counts = await service.get_counts(["imported", "fresh"])
+        async with bank.pool.reader() as db:
+            cursor = await db.execute("SELECT tag_name, post_count, source FROM tag_metadata ORDER BY tag_name")
+            return counts, await cursor.fetchall()
+
+    counts, rows = asyncio.run(run_with_service(tmp_path, stub, scenario))
+
+    assert counts == {"imported": 500, "fresh": 7}
+    assert rows == [("fresh", 7, "api"), ("imported", 500, "dump")]
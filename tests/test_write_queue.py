@@ -0,0 +1,72 @@
+"""
+WriteQueue group commit: jobs queued together share one transaction, each in its own SAVEPOINT.
+"""
+import asyncio
+
+import pytest
+
+from bot import BankSystem
+
+async def run_batch(tmp_path, jobs):
+    bank = BankSystem(str(tmp_path / "queue.db"), readers=2)
+    await bank.initialize()
+    # Keep background index builds out of the batch being measured
+    await bank.migrator.stop()
+    try:
+        await bank.write(lambda db: db.execute("CREATE TABLE t (name TEXT PRIMARY KEY)"))
+        batches = bank.writes.batches
+        # Submitted in the same loop iteration, so the writer picks them up as one batch
+        results = await asyncio.gather(*(bank.write(job) for job in jobs), return_exceptions=True)
+        batches = bank.writes.batches - batches
+        async with bank.pool.reader() as db:
+            cursor = await db.execute("SELECT name FROM t ORDER BY name")
+            names = [row[0] for row in await cursor.fetchall()]
+    finally:
+        await bank.close()
+    return results, batches, names
+
+def insert(name, result=None, error=None):
+    async def job(db):
+        await db.execute("INSERT INTO t (name) VALUES (?)", (name,))
+        if error is not None:
+            raise error
+        return result
+    return job
+
+def test_failing_job_only_undoes_its_own_changes(tmp_path):
+    jobs = [
+        insert("a", result="first"),
+        insert("b", error=ValueError("b failed")),
+        insert("c", result=42),
+        insert("a"),  # PRIMARY KEY clash with the first job: sqlite error from inside the job
+        insert("d", error=KeyError("d")),
+        insert("e"),
+    ]
+    results, batches, names = asyncio.run(run_batch(tmp_path, jobs))
+
+    assert batches == 1
+    assert names == ["a", "c", "e"]
+    assert results[0] == "first"
+    assert results[2] == 42
+    assert results[5] is None
+
+def test_each_future_gets_its_own_exception(tmp_path):
+    b_error = ValueError("b failed")
+    d_error = KeyError("d")
+    jobs = [insert("a"), insert("b", error=b_error), insert("c"), insert("d", error=d_error)]
+    results, batches, names = asyncio.run(run_batch(tmp_path, jobs))
+
+    assert batches == 1
+    assert results[0] is None and results[2] is None
+    assert results[1] is b_error
+    assert results[3] is d_error
+    assert names == ["a", "c"]
+
+def test_submit_after_close_is_rejected(tmp_path):
+    async def scenario():
+        bank = BankSystem(str(tmp_path / "queue.db"), readers=2)
+        await bank.initialize()
+        await bank.close()
+        with pytest.raises(RuntimeError):
+            await bank.write(lambda db: db.execute("SELECT 1"))
+    asyncio.run(scenario())
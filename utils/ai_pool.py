@@ -0,0 +1,187 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+class AIPoolBusy(Exception):
+    """Raised by submit() when a model's queue is full (backpressure)."""
+    pass
+
+class ModelPool:
+    """
+    Runs blocking inference calls for one model on its own set of worker threads.
+
+    Every worker thread owns a separate client (created once per thread by
+    `client_factory`), so calls never share a client across threads. At most
+    `concurrency` calls are in flight; further jobs wait in the pool's queue,
+    which holds at most `max_queue` jobs.
+
+    Each job carries a deadline. Jobs whose caller already gave up (future done
+    or cancelled) or whose deadline has passed are dropped without running.
+    """
+
+    def __init__(self, name: str, client_factory: Callable[[], Any], call: Callable[[Any, Any], Any],
+                 concurrency: int = 1, max_queue: int = 16, seed_client: Any = None):
+        """
+        Initialize the pool (workers start with `start()`).
+
+        Args:
+            name (str): Label used in logs and stats.
+            client_factory (Callable[[], Any]): Creates a new client. Runs on the worker thread.
+            call (Callable[[Any, Any], Any]): Blocking call `call(client, payload) -> result`.
+            concurrency (int): Number of worker threads / calls in flight.
+            max_queue (int): Maximum number of waiting jobs before submit() raises AIPoolBusy.
+            seed_client (Any): An already created client handed to the first worker thread.
+        """
+        self.name = name
+        self.client_factory = client_factory
+        self.call = call
+        self.concurrency = max(1, concurrency)
+        self._seeds = [seed_client] if seed_client is not None else []
+        self._local = threading.local()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, max_queue))
+        self._workers = []
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.rejected = 0
+
+    def _client(self):
+        """Returns this thread's client, creating it on first use."""
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            # list.pop is atomic, so only one thread ever gets the seed.
+            try:
+                client = self._seeds.pop()
+            except IndexError:
+                client = self.client_factory()
+            self._local.client = client
+        return client
+
+    def _run(self, payload):
+        return self.call(self._client(), payload)
+
+    def start(self) -> None:
+        if self._workers:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix=f"ai-{self.name}")
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self) -> None:
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        # Fail whatever is still queued so no caller waits forever.
+        while not self._queue.empty():
+            _, _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError(f"AI pool '{self.name}' stopped"))
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def is_full(self) -> bool:
+        return self._queue.full()
+
+    def submit(self, payload, timeout: float = 30.0) -> asyncio.Future:
+        """
+        Queues one call and returns a future for its result.
+
+        Args:
+            payload: Passed to `call(client, payload)`.
+            timeout (float): Seconds from now after which the job is no longer worth running.
+
+        Raises:
+            AIPoolBusy: If the queue is full.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        try:
+            self._queue.put_nowait((loop.time() + timeout, payload, future))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise AIPoolBusy(f"AI pool '{self.name}' is full ({self._queue.maxsize} queued)")
+        return future
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            deadline, payload, future = await self._queue.get()
+            try:
+                # Nobody is waiting for this result any more: don't spend an inference on it.
+                if future.done() or loop.time() >= deadline:
+                    self.dropped += 1
+                    if not future.done():
+                        future.set_exception(asyncio.TimeoutError())
+                    continue
+                self.in_flight += 1
+                try:
+                    res = await loop.run_in_executor(self._executor, self._run, payload)
+                finally:
+                    self.in_flight -= 1
+                self.completed += 1
+                if not future.done():
+                    future.set_result(res)
+            except asyncio.CancelledError:
+                if not future.done():
+                    future.cancel()
+                raise
+            except Exception as e:
+                self.failed += 1
+                print(f"AI Worker Error ({self.name}): {e}")
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self._queue.task_done()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'queued': self._queue.qsize(),
+            'in_flight': self.in_flight,
+            'concurrency': self.concurrency,
+            'completed': self.completed,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'rejected': self.rejected,
+        }
+
+
+class AIWorkerPool:
+    """A set of ModelPools keyed by job type ('tag', 'score', ...)."""
+
+    def __init__(self):
+        self.models: Dict[str, ModelPool] = {}
+
+    def register(self, kind: str, pool: ModelPool) -> None:
+        self.models[kind] = pool
+
+    def __contains__(self, kind: str) -> bool:
+        return kind in self.models
+
+    def start(self) -> None:
+        for pool in self.models.values():
+            pool.start()
+
+    async def stop(self) -> None:
+        for pool in self.models.values():
+            await pool.stop()
+
+    def is_busy(self) -> bool:
+        """True if any model's queue is full (new work would be rejected)."""
+        return any(pool.is_full() for pool in self.models.values())
+
+    def submit(self, kind: str, payload, timeout: float = 30.0) -> asyncio.Future:
+        """
+        Queues a job for the given model.
+
+        Raises:
+            KeyError: If no model is registered for `kind`.
+            AIPoolBusy: If that model's queue is full.
+        """
+        return self.models[kind].submit(payload, timeout=timeout)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {kind: pool.stats() for kind, pool in self.models.items()}
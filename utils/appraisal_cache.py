@@ -0,0 +1,188 @@
+import json
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional
+
+from utils.phash_index import PHashIndex
+
+class AppraisalCache:
+    """
+    Content-addressed cache of AI appraisals (aesthetic score + raw tag confidences).
+
+    Entries are keyed by the SHA-256 digest of the downloaded image bytes and
+    persisted in the `ai_appraisals` table. Recently used entries are kept in an
+    in-memory LRU that evicts by approximate size in bytes. When the digest is
+    unknown (e.g. the same picture re-encoded or re-uploaded), a pHash within
+    `phash_distance` bits can be used as a fallback.
+
+    Writes go through BankSystem.write, reads through the reader pool.
+    """
+
+    def __init__(self, bank, max_bytes: int = 8 * 1024 * 1024, phash_distance: int = 0):
+        """
+        Initialize the cache.
+
+        Args:
+            bank: The bot's BankSystem (for pool.reader() and write()).
+            max_bytes (int): Approximate memory budget for the LRU.
+            phash_distance (int): Near-match radius for the pHash fallback. 0 = exact pHash only, -1 = disabled.
+        """
+        self.bank = bank
+        self.max_bytes = max_bytes
+        self.phash_distance = phash_distance
+        self._lru: "OrderedDict[str, Dict]" = OrderedDict()
+        self._bytes = 0
+        self._phashes = PHashIndex()
+        self.hits = 0
+        self.phash_hits = 0
+        self.misses = 0
+
+    async def load(self) -> None:
+        """Loads the pHashes of every stored appraisal for the near-match fallback."""
+        index = PHashIndex()
+        async with self.bank.pool.reader() as db:
+            cursor = await db.execute("SELECT DISTINCT image_hash FROM ai_appraisals WHERE image_hash IS NOT NULL")
+            async for (img_hash,) in cursor:
+                try:
+                    index.add(img_hash)
+                except ValueError:
+                    continue
+        self._phashes = index
+        print(f"Appraisal Cache Loaded: {len(index)} pHashes.")
+
+    @staticmethod
+    def _entry_size(entry: Dict) -> int:
+        # Rough size: the JSON payloads dominate, plus fixed per-entry overhead.
+        return 128 + len(entry.get('_tags_json') or '') + len(entry.get('_chars_json') or '')
+
+    def _remember(self, digest: str, entry: Dict) -> None:
+        old = self._lru.pop(digest, None)
+        if old is not None:
+            self._bytes -= old['_size']
+        entry['_size'] = self._entry_size(entry)
+        self._lru[digest] = entry
+        self._bytes += entry['_size']
+        while self._bytes > self.max_bytes and len(self._lru) > 1:
+            _, evicted = self._lru.popitem(last=False)
+            self._bytes -= evicted['_size']
+
+    @staticmethod
+    def _from_row(row) -> Dict:
+        score, tags_json, chars_json = row
+        return {
+            'score': score,
+            'tags': json.loads(tags_json) if tags_json else None,
+            'characters': json.loads(chars_json) if chars_json else None,
+            '_tags_json': tags_json,
+            '_chars_json': chars_json,
+        }
+
+    async def get(self, digest: Optional[str], phash: Optional[str] = None) -> Optional[Dict]:
+        """
+        Looks up an appraisal.
+
+        Args:
+            digest (Optional[str]): SHA-256 hex digest of the image bytes.
+            phash (Optional[str]): Hex pHash, used when the digest is unknown.
+
+        Returns:
+            Optional[Dict]: {'score': float|None, 'tags': dict|None, 'characters': dict|None},
+            or None on a miss. Either part may be None if only one model has answered so far.
+        """
+        if digest:
+            entry = self._lru.get(digest)
+            if entry is not None:
+                self._lru.move_to_end(digest)
+                self.hits += 1
+                return entry
+
+            async with self.bank.pool.reader() as db:
+                cursor = await db.execute(
+                    "SELECT score, tag_confidences, character_confidences FROM ai_appraisals WHERE digest = ?",
+                    (digest,)
+                )
+                row = await cursor.fetchone()
+            if row:
+                entry = self._from_row(row)
+                self._remember(digest, entry)
+                self.hits += 1
+                return entry
+
+        if phash and self.phash_distance >= 0:
+            try:
+                found = self._phashes.search(phash, self.phash_distance)
+            except ValueError:
+                found = None
+            if found:
+                async with self.bank.pool.reader() as db:
+                    # Prefer the most complete appraisal for that pHash.
+                    cursor = await db.execute(
+                        """
+                        SELECT score, tag_confidences, character_confidences FROM ai_appraisals
+                        WHERE image_hash = ?
+                        ORDER BY (score IS NULL) + (tag_confidences IS NULL), created_at DESC
+                        LIMIT 1
+                        """,
+                        (format(found[0], '016x'),)
+                    )
+                    row = await cursor.fetchone()
+                if row:
+                    entry = self._from_row(row)
+                    if digest:
+                        self._remember(digest, entry)
+                    self.phash_hits += 1
+                    return entry
+
+        self.misses += 1
+        return None
+
+    async def put_score(self, digest: str, phash: Optional[str], score: float) -> None:
+        """Stores the aesthetic score for an image."""
+        now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        await self.bank.write(lambda db: db.execute(
+            """
+            INSERT INTO ai_appraisals (digest, image_hash, score, created_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(digest) DO UPDATE SET score = excluded.score
+            """,
+            (digest, phash, score, now_str)
+        ))
+        entry = self._lru.get(digest) or {'score': None, 'tags': None, 'characters': None, '_tags_json': None, '_chars_json': None}
+        entry['score'] = score
+        self._remember(digest, entry)
+        self._index(phash)
+
+    async def put_tags(self, digest: str, phash: Optional[str], tags: Dict[str, float], characters: Dict[str, float]) -> None:
+        """Stores the raw (unthresholded) general and character tag confidences for an image."""
+        tags_json = json.dumps(tags, ensure_ascii=False)
+        chars_json = json.dumps(characters, ensure_ascii=False)
+        now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        await self.bank.write(lambda db: db.execute(
+            """
+            INSERT INTO ai_appraisals (digest, image_hash, tag_confidences, character_confidences, created_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(digest) DO UPDATE SET tag_confidences = excluded.tag_confidences,
+                                              character_confidences = excluded.character_confidences
+            """,
+            (digest, phash, tags_json, chars_json, now_str)
+        ))
+        entry = self._lru.get(digest) or {'score': None}
+        entry.update({'tags': tags, 'characters': characters, '_tags_json': tags_json, '_chars_json': chars_json})
+        self._remember(digest, entry)
+        self._index(phash)
+
+    def _index(self, phash: Optional[str]) -> None:
+        if not phash:
+            return
+        try:
+            if phash not in self._phashes:
+                self._phashes.add(phash)
+        except ValueError:
+            pass
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'phash_hits': self.phash_hits,
+            'misses': self.misses,
+            'entries': len(self._lru),
+            'bytes': self._bytes,
+        }
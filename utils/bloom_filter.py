@@ -1,17 +1,25 @@
 import math
 import hashlib
-import pickle
+import mmap
 import os
-from typing import Iterator, Union
+import struct
+from typing import BinaryIO, Iterator, Tuple, Union
 
 class BloomFilter:
     """
     A probabilistic data structure that efficiently tests whether an element is a member of a set.
-    
-    False positives are possible (stating an element is in the set when it is not), 
+
+    False positives are possible (stating an element is in the set when it is not),
     but false negatives are not (stating an element is not in the set when it is).
     """
-    
+
+    # On-disk layout (little endian):
+    #   magic "BLMF" | version u16 | reserved u16 | capacity u64 | error_rate f64 | size u64 | hash_count u32
+    # followed by ceil(size / 8) bytes of bits (bit i lives in byte i // 8, mask 1 << (i % 8)).
+    MAGIC = b"BLMF"
+    VERSION = 1
+    _HEADER = struct.Struct("<4sHHQdQI")
+
     def __init__(self, capacity: int, error_rate: float = 0.001):
         """
         Initialize the Bloom Filter.
@@ -22,26 +30,37 @@ class BloomFilter:
         """
         self.capacity = capacity
         self.error_rate = error_rate
-        
+
         # Calculate size of bit array (m)
         # Formula: m = -(n * ln(p)) / (ln(2)^2)
         self.size = int(-(capacity * math.log(error_rate)) / (math.log(2) ** 2))
-        
+
         # Calculate optimal number of hash functions (k)
         # Formula: k = (m / n) * ln(2)
         self.hash_count = int((self.size / capacity) * math.log(2))
-        
-        # Initialize bit array.
-        # Python handles large integers automatically, effectively acting as a bitfield.
-        # This is more memory efficient than a list of booleans for sparse data.
-        self.bit_array = 0
-        
+
+        # Fixed-size bitset: set/test is O(1) per hash instead of copying a huge int.
+        self.bits = bytearray((self.size + 7) // 8)
+        self._mmap = None
+
         print(f"BloomFilter Initialized: Capacity={capacity}, Size={self.size} bits, HashFuncs={self.hash_count}")
 
+    @classmethod
+    def _from_parts(cls, capacity: int, error_rate: float, size: int, hash_count: int, bits) -> 'BloomFilter':
+        """Builds an instance around existing bits without re-allocating them."""
+        bf = cls.__new__(cls)
+        bf.capacity = capacity
+        bf.error_rate = error_rate
+        bf.size = size
+        bf.hash_count = hash_count
+        bf.bits = bits
+        bf._mmap = None
+        return bf
+
     def _hashes(self, item: Union[str, bytes]) -> Iterator[int]:
         """
         Generates k hash values for the given item using the Double Hashing technique.
-        
+
         Double Hashing helps in minimizing collisions without computing k independent hash functions.
         Formula: hash_i = (hash1 + i * hash2) % size
 
@@ -55,16 +74,16 @@ class BloomFilter:
             item_bytes = item.encode('utf-8')
         else:
             item_bytes = str(item).encode('utf-8')
-        
+
         # We use SHA256 to generate a sufficiently large cryptographic hash.
         # Splitting it gives us two independent 32-bit integers (h1 and h2) needed for double hashing.
         digest = hashlib.sha256(item_bytes).digest()
-        
+
         # h1: First 4 bytes (Big Endian)
         h1 = int.from_bytes(digest[0:4], 'big')
         # h2: Next 4 bytes (Big Endian)
         h2 = int.from_bytes(digest[4:8], 'big')
-        
+
         for i in range(self.hash_count):
             # Generate the ith hash index
             yield (h1 + i * h2) % self.size
@@ -72,14 +91,15 @@ class BloomFilter:
     def add(self, item: Union[str, bytes]) -> None:
         """
         Add an item to the Bloom Filter.
-        
+
         This sets the bits at the k positions generated by the hash functions to 1.
-        
+
         Args:
             item (Union[str, bytes]): The item to add.
         """
+        bits = self.bits
         for hash_val in self._hashes(item):
-            self.bit_array |= (1 << hash_val)
+            bits[hash_val >> 3] |= 1 << (hash_val & 7)
 
     def check(self, item: Union[str, bytes]) -> bool:
         """
@@ -89,70 +109,276 @@ class BloomFilter:
             item (Union[str, bytes]): The item to check.
 
         Returns:
-            bool: 
+            bool:
                 True -> The item is PROBABLY in the set.
                 False -> The item is DEFINITELY NOT in the set.
         """
+        bits = self.bits
         for hash_val in self._hashes(item):
             # If any of the bits is 0, the item was definitely not added.
-            if not (self.bit_array & (1 << hash_val)):
+            if not (bits[hash_val >> 3] & (1 << (hash_val & 7))):
                 return False
         return True
 
+    def bits_set(self) -> int:
+        """Number of 1 bits (popcount over the whole bitset in one C-level pass)."""
+        return int.from_bytes(self.bits, 'little').bit_count()
+
     def __len__(self) -> int:
         """
         Estimate the number of elements currently in the filter.
-        
+
         This uses the Swath-based approximation formula based on the density of 1s in the bit array.
         Formula: n* = -(m/k) * ln(1 - X/m)
-        
+
         Returns:
             int: Estimated number of elements.
         """
-        # Count the number of set bits (X)
-        bits_set = bin(self.bit_array).count('1')
-        
         if self.size == 0 or self.hash_count == 0:
             return 0
-            
+
+        # Count the number of set bits (X)
+        bits_set = self.bits_set()
+
         # Avoid log(0) if fully saturated (unlikely but possible)
         if bits_set >= self.size:
             return self.capacity # Return approximate max capacity
-            
+
         return int(-(self.size / self.hash_count) * math.log(1 - bits_set / self.size))
 
+    def write_to(self, f: BinaryIO) -> None:
+        """Writes the header and bits to an open binary file."""
+        f.write(self._HEADER.pack(self.MAGIC, self.VERSION, 0, self.capacity, self.error_rate, self.size, self.hash_count))
+        f.write(self.bits)
+
+    @classmethod
+    def from_buffer(cls, buf, offset: int = 0) -> Tuple['BloomFilter', int]:
+        """
+        Reads one filter from a buffer without copying its bits.
+
+        Args:
+            buf: A bytes-like object (bytes, bytearray, memoryview over an mmap).
+            offset (int): Where the filter's header starts.
+
+        Returns:
+            Tuple[BloomFilter, int]: The filter and the offset just past its bits.
+        """
+        view = memoryview(buf)
+        magic, version, _, capacity, error_rate, size, hash_count = cls._HEADER.unpack_from(view, offset)
+        if magic != cls.MAGIC:
+            raise ValueError("Not a Bloom Filter file")
+        if version != cls.VERSION:
+            raise ValueError(f"Unsupported Bloom Filter version: {version}")
+
+        start = offset + cls._HEADER.size
+        end = start + (size + 7) // 8
+        if end > len(view):
+            raise ValueError("Truncated Bloom Filter data")
+        return cls._from_parts(capacity, error_rate, size, hash_count, view[start:end]), end
+
+    def _detach(self) -> None:
+        """Copies mmap-backed bits into memory so the mapped file can be replaced."""
+        if self._mmap is not None:
+            self.bits = bytearray(self.bits)
+            self._mmap = None
+
     def save_to_file(self, filepath: str) -> None:
-        """Saves the Bloom Filter state to a file."""
-        data = {
-            'capacity': self.capacity,
-            'error_rate': self.error_rate,
-            'size': self.size,
-            'hash_count': self.hash_count,
-            'bit_array': self.bit_array
-        }
-        with open(filepath, 'wb') as f:
-            pickle.dump(data, f)
+        """Saves the Bloom Filter state to a file (atomically, via a temp file)."""
+        # Windows cannot replace a file that is still mapped.
+        if os.name == 'nt':
+            self._detach()
+        tmp_path = f"{filepath}.tmp"
+        with open(tmp_path, 'wb') as f:
+            self.write_to(f)
+        os.replace(tmp_path, filepath)
         print(f"Bloom Filter saved to {filepath}")
 
     @classmethod
-    def load_from_file(cls, filepath: str) -> Union['BloomFilter', None]:
-        """Loads a Bloom Filter from a file."""
+    def load_from_file(cls, filepath: str, use_mmap: bool = True) -> Union['BloomFilter', None]:
+        """
+        Loads a Bloom Filter from a file.
+
+        With use_mmap the bits are a copy-on-write mapping of the file (zero-copy
+        startup; later adds never touch the file). Otherwise they are read into a
+        bytearray. No pickle code is ever executed.
+        """
         if not os.path.exists(filepath):
             return None
-            
+
         try:
             with open(filepath, 'rb') as f:
-                data = pickle.load(f)
-            
-            # Create instance (bypass __init__ logic partially or just re-init)
-            # Re-init is safer to recalculate constants if needed, but we have them.
-            bf = cls(data['capacity'], data['error_rate'])
-            # Verify consistency if needed, but let's trust the file for now
-            bf.size = data['size']
-            bf.hash_count = data['hash_count']
-            bf.bit_array = data['bit_array']
+                if use_mmap:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+                    bf, _ = cls.from_buffer(mapped)
+                    bf._mmap = mapped
+                else:
+                    data = bytearray(os.fstat(f.fileno()).st_size)
+                    f.readinto(data)
+                    bf, _ = cls.from_buffer(data)
             print(f"Bloom Filter loaded from {filepath}")
             return bf
         except Exception as e:
             print(f"Failed to load Bloom Filter: {e}")
             return None
+
+
+class ScalableBloomFilter:
+    """
+    A Bloom Filter that grows by adding slices as it fills (Almeida et al., 2007).
+
+    Each new slice has `growth` times the capacity of the previous one and a
+    tighter error rate (multiplied by `tightening`), so the overall false
+    positive rate stays below `error_rate` no matter how many items are added.
+
+    It also remembers the highest market_items.item_id it has seen, so a
+    restart only has to replay rows added after the last save.
+    """
+
+    # On-disk layout (little endian):
+    #   magic "SBLF" | version u16 | reserved u16 | initial_capacity u64 | error_rate f64
+    #   | growth u32 | tightening f64 | last_item_id i64 | slice_count u32
+    # followed by, for each slice: item count u64 + an embedded BloomFilter (header + bits).
+    MAGIC = b"SBLF"
+    VERSION = 1
+    _HEADER = struct.Struct("<4sHHQdIdqI")
+    _COUNT = struct.Struct("<Q")
+
+    def __init__(self, initial_capacity: int = 10000, error_rate: float = 0.001, growth: int = 2, tightening: float = 0.9):
+        """
+        Initialize the filter with a single slice.
+
+        Args:
+            initial_capacity (int): Capacity of the first slice.
+            error_rate (float): Upper bound on the overall false positive probability.
+            growth (int): Capacity multiplier for each new slice.
+            tightening (float): Error rate multiplier for each new slice (0 < r < 1).
+        """
+        self.initial_capacity = initial_capacity
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+        self.last_item_id = 0
+        self.slices = []
+        self.counts = []
+        self._add_slice()
+
+    def _add_slice(self) -> None:
+        i = len(self.slices)
+        capacity = self.initial_capacity * (self.growth ** i)
+        # Sum over slices of error_rate * (1 - r) * r^i converges to error_rate.
+        slice_error = self.error_rate * (1 - self.tightening) * (self.tightening ** i)
+        self.slices.append(BloomFilter(capacity, slice_error))
+        self.counts.append(0)
+
+    def add(self, item: Union[str, bytes]) -> None:
+        """
+        Add an item. Items already (probably) present are not counted again.
+
+        Args:
+            item (Union[str, bytes]): The item to add.
+        """
+        if self.check(item):
+            return
+        if self.counts[-1] >= self.slices[-1].capacity:
+            self._add_slice()
+        self.slices[-1].add(item)
+        self.counts[-1] += 1
+
+    def check(self, item: Union[str, bytes]) -> bool:
+        """
+        Check if an item is possibly in any slice.
+
+        Returns:
+            bool:
+                True -> The item is PROBABLY in the set.
+                False -> The item is DEFINITELY NOT in the set.
+        """
+        # Newest slice first: recent items are the most likely to be re-checked.
+        for bf in reversed(self.slices):
+            if bf.check(item):
+                return True
+        return False
+
+    def seen_item(self, item_id: int) -> None:
+        """Records that rows up to `item_id` are reflected in the filter."""
+        if item_id and item_id > self.last_item_id:
+            self.last_item_id = item_id
+
+    def __len__(self) -> int:
+        """Number of distinct items added (exact count, not an estimate)."""
+        return sum(self.counts)
+
+    def save_to_file(self, filepath: str) -> None:
+        """Saves every slice and the last seen item id (atomically, via a temp file)."""
+        if os.name == 'nt':
+            for bf in self.slices:
+                bf._detach()
+        tmp_path = f"{filepath}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(self._HEADER.pack(
+                self.MAGIC, self.VERSION, 0, self.initial_capacity, self.error_rate,
+                self.growth, self.tightening, self.last_item_id, len(self.slices)
+            ))
+            for bf, count in zip(self.slices, self.counts):
+                f.write(self._COUNT.pack(count))
+                bf.write_to(f)
+        os.replace(tmp_path, filepath)
+        print(f"Scalable Bloom Filter saved to {filepath} ({len(self.slices)} slices)")
+
+    @classmethod
+    def load_from_file(cls, filepath: str, use_mmap: bool = True) -> Union['ScalableBloomFilter', None]:
+        """
+        Loads a filter saved by save_to_file.
+
+        A plain BloomFilter file (the pre-slice format) is not reused: its error
+        rate does not fit the slice series, so None is returned and the caller
+        rebuilds from market_items, which is all the old file ever held.
+        """
+        if not os.path.exists(filepath):
+            return None
+
+        try:
+            with open(filepath, 'rb') as f:
+                if use_mmap:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+                else:
+                    data = bytearray(os.fstat(f.fileno()).st_size)
+                    f.readinto(data)
+
+            magic = bytes(data[:4])
+            if magic == BloomFilter.MAGIC:
+                # Wrapping it as slice 0 would push the compound false positive rate past error_rate.
+                if use_mmap:
+                    data.close()
+                print(f"{filepath} is a single Bloom Filter; rebuilding from market_items.")
+                return None
+
+            (magic, version, _, initial_capacity, error_rate, growth, tightening,
+             last_item_id, slice_count) = cls._HEADER.unpack_from(data, 0)
+            if magic != cls.MAGIC:
+                raise ValueError("Not a Bloom Filter file")
+            if version != cls.VERSION:
+                raise ValueError(f"Unsupported Scalable Bloom Filter version: {version}")
+
+            sbf = cls.__new__(cls)
+            sbf.initial_capacity = initial_capacity
+            sbf.error_rate = error_rate
+            sbf.growth = growth
+            sbf.tightening = tightening
+            sbf.last_item_id = last_item_id
+            sbf.slices = []
+            sbf.counts = []
+            offset = cls._HEADER.size
+            for _ in range(slice_count):
+                (count,) = cls._COUNT.unpack_from(data, offset)
+                bf, offset = BloomFilter.from_buffer(data, offset + cls._COUNT.size)
+                bf._mmap = data if use_mmap else None
+                sbf.slices.append(bf)
+                sbf.counts.append(count)
+            if not sbf.slices:
+                sbf._add_slice()
+            print(f"Scalable Bloom Filter loaded from {filepath} ({slice_count} slices, last_item_id={last_item_id})")
+            return sbf
+        except Exception as e:
+            print(f"Failed to load Bloom Filter: {e}")
+            return None
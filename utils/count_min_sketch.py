@@ -0,0 +1,255 @@
+import hashlib
+import os
+import struct
+import sys
+import time
+from array import array
+from typing import BinaryIO, Dict, Iterable, List, Optional, Tuple, Union
+
+class CountMinSketch:
+    """
+    A fixed-size frequency table for a stream of items (Cormode & Muthukrishnan, 2005).
+
+    `depth` rows of `width` counters; an item increments one counter per row and
+    its estimate is the minimum of those counters. Estimates never undercount,
+    and overcount by at most e/width * total with probability 1 - e^-depth.
+    Memory is width * depth * 4 bytes regardless of how many distinct items are seen.
+    """
+
+    # On-disk layout (little endian):
+    #   magic "CMSK" | version u16 | reserved u16 | width u32 | depth u32 | total u64
+    # followed by width * depth uint32 counters (row-major).
+    MAGIC = b"CMSK"
+    VERSION = 1
+    _HEADER = struct.Struct("<4sHHIIQ")
+
+    def __init__(self, width: int = 2048, depth: int = 4):
+        """
+        Initialize an empty sketch.
+
+        Args:
+            width (int): Counters per row (error ~ 2.7 / width of the total count).
+            depth (int): Number of rows (failure probability ~ e^-depth).
+        """
+        self.width = width
+        self.depth = depth
+        # Row-major counters: row r, column c lives at r * width + c.
+        self.table = array('I', bytes(4 * width * depth))
+        self.total = 0
+
+    def _indexes(self, item: Union[str, bytes]) -> List[int]:
+        """
+        Counter position per row, by double hashing over one SHA-256 digest (same scheme as BloomFilter).
+        Sketches with the same width and depth share positions, so they can be computed once.
+        """
+        if isinstance(item, str):
+            item_bytes = item.encode('utf-8')
+        else:
+            item_bytes = bytes(item)
+        digest = hashlib.sha256(item_bytes).digest()
+        h1 = int.from_bytes(digest[0:4], 'big')
+        h2 = int.from_bytes(digest[4:8], 'big')
+        width = self.width
+        return [r * width + (h1 + r * h2) % width for r in range(self.depth)]
+
+    def add(self, item: Union[str, bytes], count: int = 1, indexes: Optional[List[int]] = None) -> int:
+        """
+        Count an item.
+
+        Args:
+            item (Union[str, bytes]): The item to count.
+            count (int): How many occurrences to add.
+            indexes (Optional[List[int]]): Precomputed `_indexes(item)`.
+
+        Returns:
+            int: The item's new estimate.
+        """
+        table = self.table
+        best = None
+        for i in indexes or self._indexes(item):
+            v = table[i] + count
+            table[i] = v
+            if best is None or v < best:
+                best = v
+        self.total += count
+        return best
+
+    def estimate(self, item: Union[str, bytes], indexes: Optional[List[int]] = None) -> int:
+        """Estimated count of an item (never below the true count)."""
+        table = self.table
+        return min(table[i] for i in (indexes or self._indexes(item)))
+
+    def clear(self) -> None:
+        self.table = array('I', bytes(4 * self.width * self.depth))
+        self.total = 0
+
+    def write_to(self, f: BinaryIO) -> None:
+        """Writes the header and counters to an open binary file."""
+        f.write(self._HEADER.pack(self.MAGIC, self.VERSION, 0, self.width, self.depth, self.total))
+        if sys.byteorder == 'little':
+            f.write(self.table.tobytes())
+        else:
+            swapped = array('I', self.table)
+            swapped.byteswap()
+            f.write(swapped.tobytes())
+
+    @classmethod
+    def from_buffer(cls, buf, offset: int = 0) -> Tuple['CountMinSketch', int]:
+        """
+        Reads one sketch from a buffer.
+
+        Returns:
+            Tuple[CountMinSketch, int]: The sketch and the offset just past its counters.
+        """
+        magic, version, _, width, depth, total = cls._HEADER.unpack_from(buf, offset)
+        if magic != cls.MAGIC:
+            raise ValueError("Not a Count-Min Sketch")
+        if version != cls.VERSION:
+            raise ValueError(f"Unsupported Count-Min Sketch version: {version}")
+        start = offset + cls._HEADER.size
+        end = start + width * depth * 4
+        if end > len(buf):
+            raise ValueError("Truncated Count-Min Sketch data")
+        cms = cls.__new__(cls)
+        cms.width = width
+        cms.depth = depth
+        cms.total = total
+        cms.table = array('I', bytes(buf[start:end]))
+        if sys.byteorder != 'little':
+            cms.table.byteswap()
+        return cms, end
+
+
+class TagActivity:
+    """
+    "How much has this tag been seen lately" in constant memory.
+
+    Keeps one CountMinSketch per day for the last `window_days` days (a ring that
+    rotates at midnight) plus a top-K list of the heaviest hitters of the window.
+    `count(tag)` sums the tag's estimate over the window; `hottest(n)` returns the
+    top-K candidates with their current window counts.
+    """
+
+    # On-disk layout (little endian):
+    #   magic "TACT" | version u16 | window_days u16 | day u32 | k u32 | candidates u32
+    # followed by window_days sketches (oldest first, see CountMinSketch.write_to),
+    # then for each candidate: name length u16 + UTF-8 name.
+    MAGIC = b"TACT"
+    VERSION = 1
+    _HEADER = struct.Struct("<4sHHIII")
+    _NAME_LEN = struct.Struct("<H")
+
+    def __init__(self, window_days: int = 7, width: int = 2048, depth: int = 4, k: int = 50):
+        """
+        Args:
+            window_days (int): Length of the sliding window in days.
+            width (int): Counters per sketch row.
+            depth (int): Rows per sketch.
+            k (int): Number of heavy hitters to track.
+        """
+        self.window_days = window_days
+        self.k = k
+        self.day = self._today()
+        self.sketches = [CountMinSketch(width, depth) for _ in range(window_days)]
+        # Heavy-hitter candidates: tag -> last known window count.
+        self.top: Dict[str, int] = {}
+
+    @staticmethod
+    def _today(now: Optional[float] = None) -> int:
+        return int((time.time() if now is None else now) // 86400)
+
+    def _rotate(self, now: Optional[float] = None) -> None:
+        """Moves the window forward, clearing the sketches of days that fell out of it."""
+        today = self._today(now)
+        steps = today - self.day
+        if steps <= 0:
+            return
+        for _ in range(min(steps, self.window_days)):
+            oldest = self.sketches.pop(0)
+            oldest.clear()
+            self.sketches.append(oldest)
+        self.day = today
+        # Counts of tracked candidates shrank; refresh them and drop those that vanished.
+        self.top = {tag: c for tag in self.top if (c := self.count(tag)) > 0}
+
+    def record(self, tags: Iterable[str], now: Optional[float] = None) -> None:
+        """Counts one occurrence of each tag (e.g. one upload or one purchase)."""
+        self._rotate(now)
+        current = self.sketches[-1]
+        for tag in tags:
+            indexes = current._indexes(tag)
+            current.add(tag, indexes=indexes)
+            self._offer(tag, self.count(tag, indexes))
+
+    def _offer(self, tag: str, count: int) -> None:
+        top = self.top
+        if tag in top or len(top) < self.k:
+            top[tag] = count
+            return
+        weakest = min(top, key=top.get)
+        if count > top[weakest]:
+            del top[weakest]
+            top[tag] = count
+
+    def count(self, tag: str, indexes: Optional[List[int]] = None) -> int:
+        """Estimated occurrences of a tag within the window."""
+        indexes = indexes or self.sketches[0]._indexes(tag)
+        return sum(s.estimate(tag, indexes) for s in self.sketches)
+
+    def hottest(self, n: int = 10, now: Optional[float] = None) -> List[Tuple[str, int]]:
+        """The n most frequent tags of the window, with their estimated counts."""
+        self._rotate(now)
+        return sorted(self.top.items(), key=lambda kv: kv[1], reverse=True)[:n]
+
+    def total(self) -> int:
+        return sum(s.total for s in self.sketches)
+
+    def save_to_file(self, filepath: str) -> None:
+        """Saves the window and heavy hitters (atomically, via a temp file)."""
+        tmp_path = f"{filepath}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(self._HEADER.pack(self.MAGIC, self.VERSION, self.window_days, self.day, self.k, len(self.top)))
+            for sketch in self.sketches:
+                sketch.write_to(f)
+            for tag in self.top:
+                name = tag.encode('utf-8')[:0xFFFF]
+                f.write(self._NAME_LEN.pack(len(name)))
+                f.write(name)
+        os.replace(tmp_path, filepath)
+
+    @classmethod
+    def load_from_file(cls, filepath: str) -> Union['TagActivity', None]:
+        """Loads a saved window. Returns None if the file is missing or invalid."""
+        if not os.path.exists(filepath):
+            return None
+        try:
+            with open(filepath, 'rb') as f:
+                data = f.read()
+            magic, version, window_days, day, k, n_top = cls._HEADER.unpack_from(data, 0)
+            if magic != cls.MAGIC:
+                raise ValueError("Not a tag activity file")
+            if version != cls.VERSION:
+                raise ValueError(f"Unsupported tag activity version: {version}")
+
+            activity = cls.__new__(cls)
+            activity.window_days = window_days
+            activity.k = k
+            activity.day = day
+            activity.sketches = []
+            offset = cls._HEADER.size
+            for _ in range(window_days):
+                sketch, offset = CountMinSketch.from_buffer(data, offset)
+                activity.sketches.append(sketch)
+            names = []
+            for _ in range(n_top):
+                (length,) = cls._NAME_LEN.unpack_from(data, offset)
+                offset += cls._NAME_LEN.size
+                names.append(data[offset:offset + length].decode('utf-8'))
+                offset += length
+            activity.top = {}
+            activity._rotate()
+            activity.top = {tag: c for tag in names if (c := activity.count(tag)) > 0}
+            return activity
+        except Exception as e:
+            print(f"Failed to load tag activity: {e}")
+            return None
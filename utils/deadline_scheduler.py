@@ -0,0 +1,96 @@
+import asyncio
+import heapq
+import time
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+class DeadlineScheduler:
+    """
+    Runs a callback for keys whose deadline has passed, sleeping until the earliest one.
+
+    Deadlines live in a min-heap of (deadline, key). Rescheduling a key pushes a
+    new entry and leaves the old one in place; stale entries (whose deadline no
+    longer matches `deadlines[key]`) are skipped when they reach the top.
+    Scheduling an earlier deadline wakes the sleeper, so nothing waits for a poll.
+    """
+
+    def __init__(self, callback: Callable[[List[Hashable]], Awaitable[None]], clock: Callable[[], float] = time.time,
+                 retry_delay: float = 5.0):
+        """
+        Args:
+            callback: `async fn(keys)` called with every key that came due together.
+            clock: Time source for deadlines (unix seconds by default).
+            retry_delay (float): Seconds before keys are retried when the callback raised.
+        """
+        self.callback = callback
+        self.clock = clock
+        self.retry_delay = retry_delay
+        self.deadlines: Dict[Hashable, float] = {}
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        self._seq = 0  # tie-breaker so keys never get compared
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.deadlines)
+
+    def schedule(self, key: Hashable, deadline: float) -> None:
+        """Sets (or moves) the deadline of a key."""
+        if self.deadlines.get(key) == deadline:
+            return
+        self.deadlines[key] = deadline
+        self._seq += 1
+        heapq.heappush(self._heap, (deadline, self._seq, key))
+        if self._heap[0][2] == key:
+            self._wake.set()
+
+    def cancel(self, key: Hashable) -> None:
+        self.deadlines.pop(key, None)
+
+    def next_deadline(self) -> Optional[float]:
+        heap = self._heap
+        while heap and self.deadlines.get(heap[0][2]) != heap[0][0]:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    def _pop_due(self, now: float) -> List[Hashable]:
+        due = []
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            deadline, _, key = heapq.heappop(heap)
+            if self.deadlines.get(key) == deadline:
+                del self.deadlines[key]
+                due.append(key)
+        return due
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            self._wake.clear()
+            deadline = self.next_deadline()
+            timeout = None if deadline is None else max(0.0, deadline - self.clock())
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout)
+                    continue  # An earlier deadline was added; recompute.
+                except asyncio.TimeoutError:
+                    pass
+            due = self._pop_due(self.clock())
+            if not due:
+                continue
+            try:
+                await self.callback(due)
+            except Exception as e:
+                print(f"Deadline callback error ({len(due)} keys): {e}")
+                # Try those keys again shortly instead of dropping them
+                retry_at = self.clock() + self.retry_delay
+                for key in due:
+                    if key not in self.deadlines:
+                        self.schedule(key, retry_at)
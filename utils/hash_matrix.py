@@ -0,0 +1,147 @@
+import numpy as np
+from typing import Iterable, List, Optional, Tuple, Union
+
+# numpy >= 2.0 ships a native popcount ufunc; older versions use a byte lookup table.
+_POPCOUNT_LUT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def popcount64(values: np.ndarray) -> np.ndarray:
+    """Counts set bits of every element of a uint64 array."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    as_bytes = values.reshape(values.shape + (1,)).view(np.uint8)
+    return _POPCOUNT_LUT[as_bytes].sum(axis=-1, dtype=np.uint8)
+
+class HashMatrix:
+    """
+    A contiguous numpy.uint64 array of 64-bit perceptual hashes with their item ids.
+
+    Hamming distances are computed in one vectorized XOR + popcount pass instead
+    of a Python loop over imagehash objects. It serves as the bulk path next to
+    PHashIndex: single queries when no index is available, and all-pairs audits
+    of the whole market_items table.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        """
+        Initialize an empty matrix.
+
+        Args:
+            capacity (int): Initial number of slots. Grows by doubling.
+        """
+        capacity = max(1, capacity)
+        self._hashes = np.zeros(capacity, dtype=np.uint64)
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._size = 0
+
+    @staticmethod
+    def to_int(value: Union[str, int]) -> int:
+        """Converts a hex pHash string to an int."""
+        if isinstance(value, int):
+            return value
+        return int(value, 16)
+
+    def _reserve(self, needed: int) -> None:
+        capacity = len(self._hashes)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        hashes = np.zeros(capacity, dtype=np.uint64)
+        ids = np.zeros(capacity, dtype=np.int64)
+        hashes[:self._size] = self._hashes[:self._size]
+        ids[:self._size] = self._ids[:self._size]
+        self._hashes, self._ids = hashes, ids
+
+    def append(self, item_id: int, value: Union[str, int]) -> None:
+        """
+        Append one hash (amortized O(1)).
+
+        Args:
+            item_id (int): market_items.item_id the hash belongs to.
+            value (Union[str, int]): Hex string or integer hash.
+        """
+        h = self.to_int(value)
+        self._reserve(self._size + 1)
+        self._hashes[self._size] = h
+        self._ids[self._size] = item_id
+        self._size += 1
+
+    def extend(self, rows: Iterable[Tuple[int, Union[str, int]]]) -> None:
+        """Append many (item_id, hash) pairs, skipping hashes that don't parse."""
+        for item_id, value in rows:
+            try:
+                self.append(item_id, value)
+            except (ValueError, OverflowError):
+                continue
+
+    def clear(self) -> None:
+        """Drop every hash, keeping the allocated capacity."""
+        self._size = 0
+
+    @property
+    def hashes(self) -> np.ndarray:
+        """View of the stored hashes."""
+        return self._hashes[:self._size]
+
+    @property
+    def item_ids(self) -> np.ndarray:
+        """View of the item ids, aligned with `hashes`."""
+        return self._ids[:self._size]
+
+    def distances(self, value: Union[str, int]) -> np.ndarray:
+        """
+        Hamming distance from one hash to every stored hash.
+
+        Returns:
+            np.ndarray: uint8 distances aligned with `item_ids`.
+        """
+        q = np.uint64(self.to_int(value))
+        return popcount64(np.bitwise_xor(self.hashes, q))
+
+    def nearest(self, value: Union[str, int], max_distance: int = 64) -> Optional[Tuple[int, int]]:
+        """
+        Find the closest stored hash.
+
+        Returns:
+            Optional[Tuple[int, int]]:
+                (item_id, distance) of the closest hash if it is within max_distance,
+                otherwise None.
+        """
+        if not self._size:
+            return None
+        dists = self.distances(value)
+        pos = int(np.argmin(dists))
+        dist = int(dists[pos])
+        if dist > max_distance:
+            return None
+        return int(self._ids[pos]), dist
+
+    def find_duplicates(self, max_distance: int = 5, block: int = 256, span: int = 16384) -> List[Tuple[int, int, int]]:
+        """
+        All-pairs audit: every pair of stored hashes within max_distance.
+
+        Work is tiled (block x span) so memory stays bounded regardless of size.
+
+        Returns:
+            List[Tuple[int, int, int]]: (item_id_a, item_id_b, distance), item_id_a listed first.
+        """
+        hashes = self.hashes
+        ids = self.item_ids
+        n = self._size
+        pairs = []
+        for i0 in range(0, n, block):
+            i1 = min(i0 + block, n)
+            rows = hashes[i0:i1, None]
+            for j0 in range(i0, n, span):
+                j1 = min(j0 + span, n)
+                dists = popcount64(np.bitwise_xor(rows, hashes[None, j0:j1]))
+                ii, jj = np.nonzero(dists <= max_distance)
+                ii += i0
+                jj += j0
+                upper = jj > ii  # each unordered pair once, no self-pairs
+                for a, b in zip(ii[upper], jj[upper]):
+                    pairs.append((int(ids[a]), int(ids[b]), int(dists[a - i0, b - j0])))
+        return pairs
+
+    def __len__(self) -> int:
+        return self._size
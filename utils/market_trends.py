@@ -0,0 +1,116 @@
+import math
+import time
+from collections import Counter
+from typing import Dict, Iterable, Optional, Tuple
+
+class MarketTrends:
+    """
+    In-memory view of `market_trends` saturation, loaded once and kept in sync write-through.
+
+    Saturation decays continuously: each row stores `(saturation, saturation_updated)`
+    and the current value is `saturation * 0.5 ** (elapsed / HALF_LIFE)`, computed on
+    read. The half-life matches the old nightly `saturation * 0.9` sweep
+    (ln 0.5 / ln 0.9 ~ 6.58 days), so no batch job is needed.
+
+    Reads (the saturation multiplier) never touch the database. Writes are
+    issued inside the caller's transaction, and the in-memory copy is updated
+    with `apply()` once that transaction committed.
+    """
+
+    HALF_LIFE = math.log(0.5) / math.log(0.9) * 86400  # seconds
+
+    def __init__(self, bank):
+        """
+        Args:
+            bank: The bot's BankSystem (for pool.reader() and write()).
+        """
+        self.bank = bank
+        # tag -> (saturation at `updated`, updated unix time)
+        self.saturation: Dict[str, Tuple[float, float]] = {}
+
+    async def load(self) -> None:
+        """Loads every tag's saturation."""
+        now = time.time()
+        async with self.bank.pool.reader() as db:
+            cursor = await db.execute("SELECT tag_name, saturation, saturation_updated FROM market_trends")
+            self.saturation = {tag: (sat or 0, ts or now) for tag, sat, ts in await cursor.fetchall()}
+        print(f"Market Trends Loaded: {len(self.saturation)} tags.")
+
+    @classmethod
+    def decayed(cls, value: float, updated: float, now: float) -> float:
+        """Saturation `value` recorded at `updated`, decayed to `now`."""
+        if value <= 0 or now <= updated:
+            return value
+        return value * 0.5 ** ((now - updated) / cls.HALF_LIFE)
+
+    def current(self, tag: str, now: Optional[float] = None) -> Optional[float]:
+        """Current (decayed) saturation of a tag, or None if the tag has no row."""
+        entry = self.saturation.get(tag)
+        if entry is None:
+            return None
+        return self.decayed(entry[0], entry[1], time.time() if now is None else now)
+
+    def modifier(self, tags: Iterable[str], now: Optional[float] = None) -> float:
+        """
+        Saturation multiplier for an item's tags (single pass, no I/O).
+
+        Each known tag scores 1 / log10(saturation + 2); the item takes the
+        minimum (the most saturated tag pulls the whole value down), floored at 0.1.
+        Tags without a market_trends row count as 1.0.
+        """
+        now = time.time() if now is None else now
+        multiplier = 1.0
+        saturation = self.saturation
+        for tag in tags:
+            entry = saturation.get(tag)
+            if entry is not None:
+                sat = self.decayed(entry[0], entry[1], now)
+                sat_mult = 1.0 / math.log10(max(sat, 0) + 2)
+                if sat_mult < multiplier:
+                    multiplier = sat_mult
+        return max(multiplier, 0.1)
+
+    @classmethod
+    async def record_uploads(cls, db, tags: Iterable[str], now: Optional[float] = None) -> Dict[str, Tuple[float, float]]:
+        """
+        Adds one saturation per tag occurrence (inside a write transaction).
+
+        The stored values are read, decayed to `now` and incremented in one pass,
+        then written back with a single executemany.
+
+        Returns:
+            Dict[str, Tuple[float, float]]: The new (saturation, updated) per tag, for apply().
+        """
+        counts = Counter(tags)
+        if not counts:
+            return {}
+        now = time.time() if now is None else now
+        names = list(counts)
+        placeholders = ",".join("?" * len(names))
+        cursor = await db.execute(
+            f"SELECT tag_name, saturation, saturation_updated FROM market_trends WHERE tag_name IN ({placeholders})",
+            names
+        )
+        stored = {tag: (sat or 0, ts or now) for tag, sat, ts in await cursor.fetchall()}
+
+        new_values = {}
+        for tag, n in counts.items():
+            value, updated = stored.get(tag, (0, now))
+            new_values[tag] = (cls.decayed(value, updated, now) + n, now)
+
+        await db.executemany(
+            """
+            INSERT INTO market_trends (tag_name, saturation, saturation_updated) VALUES (?, ?, ?)
+            ON CONFLICT(tag_name) DO UPDATE SET saturation = excluded.saturation,
+                                                saturation_updated = excluded.saturation_updated
+            """,
+            [(tag, value, ts) for tag, (value, ts) in new_values.items()]
+        )
+        return new_values
+
+    def apply(self, new_values: Dict[str, Tuple[float, float]]) -> None:
+        """Mirrors a committed record_uploads() in memory."""
+        self.saturation.update(new_values)
+
+    def clear(self) -> None:
+        self.saturation = {}
@@ -0,0 +1,66 @@
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+class MessageRoutes:
+    """
+    Bounded LRU map of item message -> (item_id, status) for the persistent buttons.
+
+    BuyView / AuctionView only know the message they were clicked on. Every item
+    has its own message (market_items.message_id), even inside gallery threads
+    that hold many items, so a hit gives exactly that item's id (the transaction
+    reads the row by primary key) and its last known status (clicks on sold or
+    finished items are answered without touching the database). Write paths call
+    `put()` / `set_status()` after their transaction commits; a miss falls back
+    to the indexed message_id query.
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        """
+        Args:
+            max_entries (int): Messages kept before the least recently used is evicted.
+        """
+        self.max_entries = max_entries
+        self._routes: "OrderedDict[int, Tuple[int, str]]" = OrderedDict()
+        self._messages: Dict[int, int] = {}  # item_id -> message_id
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._routes)
+
+    def get(self, message_id: int) -> Optional[Tuple[int, str]]:
+        """(item_id, status) for a message, or None if not cached."""
+        route = self._routes.get(message_id)
+        if route is None:
+            self.misses += 1
+            return None
+        self._routes.move_to_end(message_id)
+        self.hits += 1
+        return route
+
+    def put(self, message_id: int, item_id: int, status: str) -> None:
+        """Records where an item lives now (its previous message is forgotten)."""
+        if not message_id:
+            return
+        old_message = self._messages.get(item_id)
+        if old_message is not None and old_message != message_id:
+            self._routes.pop(old_message, None)
+        self._routes[message_id] = (item_id, status)
+        self._routes.move_to_end(message_id)
+        self._messages[item_id] = message_id
+        while len(self._routes) > self.max_entries:
+            _, (evicted_item, _) = self._routes.popitem(last=False)
+            self._messages.pop(evicted_item, None)
+
+    def set_status(self, item_id: int, status: str) -> None:
+        """Updates the status of a cached item (no-op if its message isn't cached)."""
+        message_id = self._messages.get(item_id)
+        if message_id is not None and message_id in self._routes:
+            self._routes[message_id] = (item_id, status)
+
+    def clear(self) -> None:
+        self._routes.clear()
+        self._messages.clear()
+
+    def stats(self) -> dict:
+        return {'entries': len(self._routes), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,325 @@
+"""
+スキーマ移行 (Schema migrations)
+
+Numbered schema steps tracked with `PRAGMA user_version`, plus background jobs
+for work that can be slow on a large database (index builds, backfills).
+
+- `migrate(db)` runs every step above the database's user_version, one
+  transaction per step, bumping user_version in the same transaction. An
+  up-to-date database executes no DDL at all. Errors are raised, not swallowed.
+- `BackgroundMigrator` runs the `BACKGROUND_JOBS` that are not recorded in
+  `schema_jobs` yet, one batch per write transaction through the write queue,
+  so startup never waits for them and other writes interleave.
+
+To change the schema, append a step to MIGRATIONS (never edit a released one).
+"""
+import asyncio
+import time
+from typing import Awaitable, Callable, List, Tuple
+
+async def column_exists(db, table: str, column: str) -> bool:
+    cursor = await db.execute(f"PRAGMA table_info({table})")
+    return any(row[1] == column for row in await cursor.fetchall())
+
+async def add_column(db, table: str, column: str, decl: str) -> None:
+    """ALTER TABLE ... ADD COLUMN, skipped if the column is already there (databases from before user_version)."""
+    if not await column_exists(db, table, column):
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+# -----------------------------------------------------------
+# Schema steps
+# -----------------------------------------------------------
+async def _v1_core_tables(db):
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS bank (
+            user_id INTEGER,
+            guild_id INTEGER,
+            balance INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, guild_id)
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS market_items (
+            item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            seller_id INTEGER NOT NULL,
+            image_url TEXT NOT NULL,
+            image_hash TEXT,
+            aesthetic_score REAL NOT NULL,
+            price INTEGER NOT NULL,
+            status TEXT DEFAULT 'on_sale',
+            tags TEXT,
+            grade TEXT,
+            thread_id INTEGER,
+            message_id INTEGER,
+            buyer_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    # Columns added to market_items over time (no-ops on tables created above)
+    for column, decl in (
+        ("image_hash", "TEXT"),
+        ("tags", "TEXT"),
+        ("grade", "TEXT"),
+        ("thread_id", "INTEGER"),
+        ("message_id", "INTEGER"),
+        ("buyer_id", "INTEGER"),
+        ("auction_end_time", "TEXT"),
+        ("current_bid", "INTEGER DEFAULT 0"),
+        ("top_bidder_id", "INTEGER"),
+    ):
+        await add_column(db, "market_items", column, decl)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_market_status ON market_items(status)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_market_hash ON market_items(image_hash)")
+
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS market_trends (
+            tag_name TEXT PRIMARY KEY,
+            current_price INTEGER DEFAULT 100,
+            saturation INTEGER DEFAULT 0,
+            trend_bonus INTEGER DEFAULT 0
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS user_galleries (
+            user_id INTEGER PRIMARY KEY,
+            thread_id INTEGER
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS daily_trends (
+            date_key TEXT PRIMARY KEY,
+            pose TEXT,
+            costume TEXT,
+            body TEXT
+        )
+    """)
+    # Danbooru cache
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS tag_metadata (
+            tag_name TEXT PRIMARY KEY,
+            post_count INTEGER,
+            last_updated TIMESTAMP
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS tag_stocks (
+            tag_name TEXT PRIMARY KEY,
+            current_price REAL DEFAULT 100.0,
+            total_volume INTEGER DEFAULT 0
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS user_stocks (
+            user_id INTEGER,
+            tag_name TEXT,
+            amount INTEGER DEFAULT 0,
+            average_cost REAL DEFAULT 0,
+            PRIMARY KEY (user_id, tag_name)
+        )
+    """)
+
+async def _v2_ai_appraisals(db):
+    # AI appraisal cache (keyed by SHA-256 of the image bytes)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS ai_appraisals (
+            digest TEXT PRIMARY KEY,
+            image_hash TEXT,
+            score REAL,
+            tag_confidences TEXT,
+            character_confidences TEXT,
+            created_at TIMESTAMP
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_appraisal_hash ON ai_appraisals(image_hash)")
+
+async def _v3_saturation_updated(db):
+    # Lazy saturation decay: saturation is the value at saturation_updated (unix time).
+    # Existing rows are backfilled by the 'backfill_saturation_updated' job; NULL reads as "now".
+    await add_column(db, "market_trends", "saturation_updated", "REAL")
+
+async def _v4_tag_metadata_source(db):
+    # 'api' (live fetch, expires) or 'dump' (bulk import, see import_tags.py)
+    await add_column(db, "tag_metadata", "source", "TEXT DEFAULT 'api'")
+
+async def _v5_stock_volatility(db):
+    # Per-tag sigma for the GBM step (NULL = STOCK_VOLATILITY)
+    await add_column(db, "tag_stocks", "volatility", "REAL")
+
+async def _v6_stock_history(db):
+    # Raw ticks (compacted after a few days) and OHLC candles, see utils/stock_history.py
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS stock_ticks (
+            tag_name TEXT NOT NULL,
+            ts REAL NOT NULL,
+            price REAL NOT NULL
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_ticks_tag_ts ON stock_ticks(tag_name, ts)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_ticks_ts ON stock_ticks(ts)")
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS stock_candles (
+            tag_name TEXT NOT NULL,
+            resolution INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            open REAL,
+            high REAL,
+            low REAL,
+            close REAL,
+            ticks INTEGER DEFAULT 0,
+            PRIMARY KEY (tag_name, resolution, bucket)
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_candles_res_bucket ON stock_candles(resolution, bucket)")
+
+async def _v7_schema_jobs(db):
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS schema_jobs (
+            name TEXT PRIMARY KEY,
+            finished_at REAL
+        )
+    """)
+    # Superseded by idx_market_buyer_status (built in the background)
+    await db.execute("DROP INDEX IF EXISTS idx_market_buyer")
+
+MIGRATIONS: List[Tuple[int, str, Callable[..., Awaitable[None]]]] = [
+    (1, "core tables", _v1_core_tables),
+    (2, "ai_appraisals", _v2_ai_appraisals),
+    (3, "market_trends.saturation_updated", _v3_saturation_updated),
+    (4, "tag_metadata.source", _v4_tag_metadata_source),
+    (5, "tag_stocks.volatility", _v5_stock_volatility),
+    (6, "stock_ticks / stock_candles", _v6_stock_history),
+    (7, "schema_jobs", _v7_schema_jobs),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+async def migrate(db) -> int:
+    """
+    Brings the schema up to SCHEMA_VERSION on the (autocommit) writer connection.
+
+    Returns:
+        int: Number of steps applied (0 for an up-to-date database).
+    """
+    cursor = await db.execute("PRAGMA user_version")
+    current = (await cursor.fetchone())[0]
+    if current > SCHEMA_VERSION:
+        raise RuntimeError(f"データベースのスキーマ (v{current}) がこのBot (v{SCHEMA_VERSION}) より新しいです。")
+
+    applied = 0
+    for version, name, step in MIGRATIONS:
+        if version <= current:
+            continue
+        started = time.perf_counter()
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            await step(db)
+            await db.execute(f"PRAGMA user_version = {int(version)}")
+            await db.execute("COMMIT")
+        except Exception:
+            await db.execute("ROLLBACK")
+            print(f"Migration v{version} ({name}) failed")
+            raise
+        applied += 1
+        print(f"Migration v{version}: {name} ({(time.perf_counter() - started) * 1000:.1f} ms)")
+    return applied
+
+# -----------------------------------------------------------
+# Background jobs
+# -----------------------------------------------------------
+def _index_job(sql: str) -> Callable[..., Awaitable[bool]]:
+    """An index build as a single background step."""
+    async def job(db) -> bool:
+        await db.execute(sql)
+        return True
+    return job
+
+BACKFILL_BATCH = 2000
+
+async def _backfill_saturation_updated(db) -> bool:
+    cursor = await db.execute(
+        """
+        UPDATE market_trends SET saturation_updated = ?
+        WHERE rowid IN (SELECT rowid FROM market_trends WHERE saturation_updated IS NULL LIMIT ?)
+        """,
+        (time.time(), BACKFILL_BATCH)
+    )
+    return cursor.rowcount < BACKFILL_BATCH
+
+# (name, step): a step does one batch inside a write transaction and returns True once the job is complete.
+BACKGROUND_JOBS: List[Tuple[str, Callable[..., Awaitable[bool]]]] = [
+    ("idx_market_url", _index_job("CREATE INDEX IF NOT EXISTS idx_market_url ON market_items(image_url)")),
+    ("idx_market_auction", _index_job("CREATE INDEX IF NOT EXISTS idx_market_auction ON market_items(status, auction_end_time)")),
+    ("idx_market_buyer_status", _index_job("CREATE INDEX IF NOT EXISTS idx_market_buyer_status ON market_items(buyer_id, status)")),
+    ("idx_market_seller_status", _index_job("CREATE INDEX IF NOT EXISTS idx_market_seller_status ON market_items(seller_id, status)")),
+    ("idx_market_thread", _index_job("CREATE INDEX IF NOT EXISTS idx_market_thread ON market_items(thread_id)")),
+    # Persistent buy/bid buttons find their item by the message they are on
+    ("idx_market_message", _index_job("CREATE INDEX IF NOT EXISTS idx_market_message ON market_items(message_id)")),
+    ("backfill_saturation_updated", _backfill_saturation_updated),
+]
+
+class BackgroundMigrator:
+    """Runs unfinished BACKGROUND_JOBS through the bank's write queue after startup."""
+
+    def __init__(self, bank, jobs=None, pause: float = 0.05):
+        """
+        Args:
+            bank: The BankSystem (its write queue must be running).
+            jobs: (name, step) pairs; defaults to BACKGROUND_JOBS.
+            pause (float): Seconds between batches, leaving room for other writes.
+        """
+        self.bank = bank
+        self.jobs = BACKGROUND_JOBS if jobs is None else jobs
+        self.pause = pause
+        self.pending: List[str] = []
+        self.batches = 0
+        self._task = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        async with self.bank.pool.reader() as db:
+            cursor = await db.execute("SELECT name FROM schema_jobs")
+            finished = {row[0] for row in await cursor.fetchall()}
+        self.pending = [name for name, _ in self.jobs if name not in finished]
+
+        for name, step in self.jobs:
+            if name in finished:
+                continue
+
+            async def txn(db, step=step, name=name):
+                done = await step(db)
+                if done:
+                    await db.execute(
+                        "INSERT OR REPLACE INTO schema_jobs (name, finished_at) VALUES (?, ?)", (name, time.time())
+                    )
+                return done
+
+            started = time.perf_counter()
+            try:
+                while True:
+                    done = await self.bank.write(txn)
+                    self.batches += 1
+                    if done:
+                        break
+                    await asyncio.sleep(self.pause)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Left unfinished; retried on the next start
+                print(f"Background migration {name} failed: {e}")
+                continue
+            self.pending.remove(name)
+            print(f"Background migration {name} done ({time.perf_counter() - started:.2f}s)")
+
+    def stats(self) -> dict:
+        return {'pending': list(self.pending), 'batches': self.batches}
@@ -0,0 +1,108 @@
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+# (tag, amount, average_cost, current price)
+Holding = Tuple[str, int, float, float]
+
+class NetWorthService:
+    """
+    Per-user net worth: cash (`bank`) + stock holdings + owned `market_items`.
+
+    Holdings are valued with one `user_stocks` x `tag_stocks` join (tags without
+    a stock row count at the initial 100.0; nothing is created on read). Owned
+    items are valued at their base appraisal (1000 * score^2, as in BrokerCog);
+    items the user has up for auction at MAX(price, current_bid), i.e. the
+    start price until someone bids.
+
+    Results are cached for `ttl` seconds. Trades call `invalidate()` for the
+    users involved, so the cache only hides changes made elsewhere (e.g. plain
+    deposits), and only until the TTL runs out.
+    """
+
+    HOLDINGS_SQL = """
+        SELECT s.tag_name, s.amount, s.average_cost, COALESCE(t.current_price, 100.0)
+        FROM user_stocks s LEFT JOIN tag_stocks t ON t.tag_name = s.tag_name
+        WHERE s.user_id = ? AND s.amount > 0
+        ORDER BY s.amount DESC
+    """
+
+    def __init__(self, bank, price_multiplier: Optional[Callable[[str], float]] = None, ttl: float = 30.0):
+        """
+        Args:
+            bank: The bot's BankSystem (for pool.reader()).
+            price_multiplier (Optional[Callable[[str], float]]): Pending impact per tag not yet in
+                tag_stocks (StockImpactBuffer.multiplier), applied on top of the stored price.
+            ttl (float): Seconds a computed net worth is reused.
+        """
+        self.bank = bank
+        self.price_multiplier = price_multiplier
+        self.ttl = ttl
+        # user_id -> {guild_id: (expires, result)}
+        self._cache: Dict[int, Dict[int, Tuple[float, dict]]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _price(self, tag: str, stored: float) -> float:
+        if self.price_multiplier is None:
+            return stored
+        return max(1.0, stored * self.price_multiplier(tag))
+
+    async def holdings(self, user_id: int, db=None) -> List[Holding]:
+        """A user's stocks with their current prices (one query)."""
+        if db is None:
+            async with self.bank.pool.reader() as db:
+                return await self.holdings(user_id, db)
+        cursor = await db.execute(self.HOLDINGS_SQL, (user_id,))
+        return [(tag, amt, cost, self._price(tag, price)) for tag, amt, cost, price in await cursor.fetchall()]
+
+    async def get(self, user_id: int, guild_id: int) -> dict:
+        """
+        Net worth of a user in a guild.
+
+        Returns:
+            dict: cash, stocks, items and total (all int).
+        """
+        now = time.monotonic()
+        entry = self._cache.get(user_id, {}).get(guild_id)
+        if entry is not None and entry[0] > now:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+
+        # One reader connection, one consistent snapshot for all three parts
+        async with self.bank.pool.reader() as db:
+            await db.execute("BEGIN")
+            try:
+                cursor = await db.execute(
+                    "SELECT balance FROM bank WHERE user_id = ? AND guild_id = ?", (user_id, guild_id)
+                )
+                row = await cursor.fetchone()
+                cash = row[0] if row else 0
+                holdings = await self.holdings(user_id, db)
+                cursor = await db.execute(
+                    """
+                    SELECT COALESCE(SUM(
+                        CASE WHEN status = 'on_auction' THEN MAX(price, COALESCE(current_bid, 0))
+                             ELSE 1000 * aesthetic_score * aesthetic_score END
+                    ), 0) FROM market_items
+                    WHERE buyer_id = ? AND status IN ('owned', 'sold', 'on_auction')
+                    """,
+                    (user_id,)
+                )
+                items = (await cursor.fetchone())[0]
+            finally:
+                await db.execute("COMMIT")
+
+        stocks = sum(amt * price for _, amt, _, price in holdings)
+        result = {'cash': int(cash), 'stocks': int(stocks), 'items': int(items)}
+        result['total'] = result['cash'] + result['stocks'] + result['items']
+        self._cache.setdefault(user_id, {})[guild_id] = (now + self.ttl, result)
+        return result
+
+    def invalidate(self, *user_ids: int) -> None:
+        """Drops cached net worth of the given users (call after their trades commit)."""
+        for user_id in user_ids:
+            self._cache.pop(user_id, None)
+
+    def stats(self) -> dict:
+        return {'cached': sum(len(v) for v in self._cache.values()), 'hits': self.hits, 'misses': self.misses}
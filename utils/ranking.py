@@ -0,0 +1,146 @@
+import random
+from typing import Dict, Hashable, List, Optional, Tuple
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, level: int):
+        self.key = key
+        self.next: List[Optional['_Node']] = [None] * level
+        # width[i]: how many level-0 steps next[i] skips
+        self.width: List[int] = [1] * level
+
+class RankedSet:
+    """
+    Members ordered by score (highest first) with O(log n) updates and rank lookups.
+
+    An indexable skip list (each link stores how many elements it skips) keyed by
+    (-score, member), plus a member -> score dict. `rank()` sums link widths on the
+    way down; `top(n)` walks the bottom level.
+    """
+
+    MAX_LEVEL = 32
+    P = 0.5
+
+    def __init__(self):
+        self._head = _Node(None, self.MAX_LEVEL)
+        self._level = 1
+        self._scores: Dict[Hashable, float] = {}
+        self._rng = random.Random()
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    def __contains__(self, member: Hashable) -> bool:
+        return member in self._scores
+
+    def score(self, member: Hashable) -> Optional[float]:
+        return self._scores.get(member)
+
+    def _random_level(self) -> int:
+        level = 1
+        while level < self.MAX_LEVEL and self._rng.random() < self.P:
+            level += 1
+        return level
+
+    def _insert_key(self, key) -> None:
+        update = [self._head] * self.MAX_LEVEL
+        # steps[i]: position (0-based count of elements) of update[i]
+        steps = [0] * self.MAX_LEVEL
+        node = self._head
+        pos = 0
+        for i in range(self._level - 1, -1, -1):
+            while node.next[i] is not None and node.next[i].key < key:
+                pos += node.width[i]
+                node = node.next[i]
+            update[i] = node
+            steps[i] = pos
+
+        level = self._random_level()
+        if level > self._level:
+            for i in range(self._level, level):
+                update[i] = self._head
+                steps[i] = 0
+                # Unused head levels point past the end: one step per element, plus one.
+                # (set() has already counted the new member, so this is the old size + 1.)
+                self._head.width[i] = len(self._scores)
+            self._level = level
+
+        new = _Node(key, level)
+        for i in range(level):
+            prev = update[i]
+            new.next[i] = prev.next[i]
+            prev.next[i] = new
+            skipped = pos - steps[i]
+            new.width[i] = prev.width[i] - skipped
+            prev.width[i] = skipped + 1
+        for i in range(level, self._level):
+            update[i].width[i] += 1
+
+    def _remove_key(self, key) -> None:
+        update = [self._head] * self.MAX_LEVEL
+        node = self._head
+        for i in range(self._level - 1, -1, -1):
+            while node.next[i] is not None and node.next[i].key < key:
+                node = node.next[i]
+            update[i] = node
+        target = node.next[0]
+        if target is None or target.key != key:
+            raise KeyError(key)
+        for i in range(self._level):
+            if update[i].next[i] is target:
+                update[i].next[i] = target.next[i]
+                update[i].width[i] += target.width[i] - 1
+            else:
+                update[i].width[i] -= 1
+        while self._level > 1 and self._head.next[self._level - 1] is None:
+            self._level -= 1
+
+    def set(self, member: Hashable, score: float) -> None:
+        """Adds a member or moves it to a new score."""
+        old = self._scores.get(member)
+        if old == score:
+            return
+        if old is not None:
+            self._remove_key((-old, member))
+        self._scores[member] = score
+        self._insert_key((-score, member))
+
+    def discard(self, member: Hashable) -> None:
+        old = self._scores.pop(member, None)
+        if old is not None:
+            self._remove_key((-old, member))
+
+    def rank(self, member: Hashable) -> Optional[int]:
+        """0-based position of a member (0 = highest score), or None if absent."""
+        score = self._scores.get(member)
+        if score is None:
+            return None
+        key = (-score, member)
+        node = self._head
+        pos = 0
+        for i in range(self._level - 1, -1, -1):
+            while node.next[i] is not None and node.next[i].key <= key:
+                pos += node.width[i]
+                node = node.next[i]
+        return pos - 1
+
+    def top(self, n: int, offset: int = 0) -> List[Tuple[Hashable, float]]:
+        """Members at positions offset .. offset + n - 1 with their scores."""
+        if offset < 0 or offset >= len(self._scores):
+            return []
+        # Jump to the element at `offset` in O(log n), then walk the bottom level.
+        node = self._head
+        pos = -1
+        for i in range(self._level - 1, -1, -1):
+            while node.next[i] is not None and pos + node.width[i] <= offset:
+                pos += node.width[i]
+                node = node.next[i]
+        result = []
+        while node is not None and len(result) < n:
+            result.append((node.key[1], -node.key[0]))
+            node = node.next[0]
+        return result
+
+    def clear(self) -> None:
+        self.__init__()
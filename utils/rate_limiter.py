@@ -0,0 +1,36 @@
+import asyncio
+import time
+
+class TokenBucket:
+    """
+    An asyncio token-bucket rate limiter.
+
+    Allows bursts of up to `capacity` calls, refilled at `rate` tokens per second.
+    `acquire()` sleeps until a token is available.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        """
+        Args:
+            rate (float): Tokens added per second.
+            capacity (float): Maximum number of stored tokens (burst size).
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        # The lock keeps waiters in FIFO order.
+        async with self._lock:
+            self._refill()
+            while self._tokens < tokens:
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= tokens
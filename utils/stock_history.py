@@ -0,0 +1,196 @@
+import time
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+# (bucket start unix time, open, high, low, close)
+Candle = Tuple[int, float, float, float, float]
+
+class StockHistory:
+    """
+    Price history of tag stocks: raw ticks plus OHLC candles.
+
+    - `stock_ticks` is append-only (tag, ts, price), written in the same
+      transaction as the price change that produced it, or with `record_batched()`
+      right after a market-wide step commits.
+    - `stock_candles` holds 1-minute, 1-hour and 1-day OHLC candles. Every
+      recorded tick upserts its candle at each resolution, so candles are always
+      current and never need a batch rebuild.
+    - `compact()` drops raw ticks and 1-minute candles past their retention;
+      hourly and daily candles are kept, so long windows stay cheap to read.
+
+    Both tables are keyed by tag first and time second, so a window query is an
+    index range scan that reads only the rows inside the window.
+    """
+
+    MINUTE = 60
+    HOUR = 3600
+    DAY = 86400
+    RESOLUTIONS = (MINUTE, HOUR, DAY)
+
+    CANDLE_UPSERT = """
+        INSERT INTO stock_candles (tag_name, resolution, bucket, open, high, low, close, ticks)
+        VALUES (?, ?, ?, ?, ?, ?, ?, 1)
+        ON CONFLICT(tag_name, resolution, bucket) DO UPDATE SET
+            high = max(high, excluded.high),
+            low = min(low, excluded.low),
+            close = excluded.close,
+            ticks = ticks + 1
+    """
+
+    def __init__(self, bank, tick_retention: float = 2 * 86400, minute_retention: float = 14 * 86400,
+                 compact_batch: int = 5000, record_batch: int = 2000):
+        """
+        Args:
+            bank: The bot's BankSystem (for pool.reader() and write()).
+            tick_retention (float): Seconds raw ticks are kept.
+            minute_retention (float): Seconds 1-minute candles are kept.
+            compact_batch (int): Rows deleted per write transaction during compaction.
+            record_batch (int): Ticks written per write transaction by record_batched().
+        """
+        self.bank = bank
+        self.tick_retention = tick_retention
+        self.minute_retention = minute_retention
+        self.compact_batch = compact_batch
+        self.record_batch = record_batch
+
+    @classmethod
+    async def record(cls, db, ticks: Iterable[Tuple[str, float]], now: Optional[float] = None) -> int:
+        """
+        Appends ticks and rolls them into the candles (inside a write transaction).
+
+        Args:
+            db: The writer connection of the current transaction.
+            ticks (Iterable[Tuple[str, float]]): (tag, new price) pairs.
+            now (Optional[float]): Tick time (defaults to now).
+
+        Returns:
+            int: Number of ticks written.
+        """
+        ticks = list(ticks)
+        if not ticks:
+            return 0
+        now = time.time() if now is None else now
+        await db.executemany(
+            "INSERT INTO stock_ticks (tag_name, ts, price) VALUES (?, ?, ?)",
+            [(tag, now, price) for tag, price in ticks]
+        )
+        for res in cls.RESOLUTIONS:
+            bucket = int(now // res) * res
+            await db.executemany(
+                cls.CANDLE_UPSERT,
+                [(tag, res, bucket, price, price, price, price) for tag, price in ticks]
+            )
+        return len(ticks)
+
+    @classmethod
+    async def record_current(cls, db, tags: Iterable[str], now: Optional[float] = None) -> int:
+        """Records the stored price of each tag as a tick (call right after updating tag_stocks)."""
+        tags = list(dict.fromkeys(tags))
+        ticks = []
+        for i in range(0, len(tags), 500):
+            chunk = tags[i:i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            cursor = await db.execute(
+                f"SELECT tag_name, current_price FROM tag_stocks WHERE tag_name IN ({placeholders})",
+                chunk
+            )
+            ticks.extend(await cursor.fetchall())
+        return await cls.record(db, ticks, now)
+
+    async def record_batched(self, ticks: Sequence[Tuple[str, float]], now: Optional[float] = None) -> int:
+        """
+        Records many ticks (e.g. after a market-wide step such as volatility) in
+        `record_batch`-sized write transactions of their own, so other writes
+        interleave instead of waiting for the whole market.
+
+        Returns:
+            int: Number of ticks written.
+        """
+        now = time.time() if now is None else now
+        written = 0
+        for i in range(0, len(ticks), self.record_batch):
+            chunk = ticks[i:i + self.record_batch]
+            written += await self.bank.write(lambda db, chunk=chunk: self.record(db, chunk, now))
+        return written
+
+    async def candles(self, tag: str, resolution: int, start: float, end: Optional[float] = None) -> List[Candle]:
+        """Candles of one resolution whose bucket starts in [start, end], oldest first."""
+        end = time.time() if end is None else end
+        async with self.bank.pool.reader() as db:
+            cursor = await db.execute(
+                """
+                SELECT bucket, open, high, low, close FROM stock_candles
+                WHERE tag_name = ? AND resolution = ? AND bucket BETWEEN ? AND ?
+                ORDER BY bucket
+                """,
+                (tag, resolution, int(start // resolution) * resolution, end)
+            )
+            return await cursor.fetchall()
+
+    async def ticks(self, tag: str, start: float, end: Optional[float] = None) -> List[Tuple[float, float]]:
+        """Raw (ts, price) ticks in [start, end] (only as far back as tick_retention)."""
+        end = time.time() if end is None else end
+        async with self.bank.pool.reader() as db:
+            cursor = await db.execute(
+                "SELECT ts, price FROM stock_ticks WHERE tag_name = ? AND ts BETWEEN ? AND ? ORDER BY ts",
+                (tag, start, end)
+            )
+            return await cursor.fetchall()
+
+    @staticmethod
+    def downsample(candles: Sequence[Candle], points: int) -> List[Candle]:
+        """Merges consecutive candles into at most `points` candles (first open, max high, min low, last close)."""
+        if len(candles) <= points:
+            return list(candles)
+        merged = []
+        step = len(candles) / points
+        for i in range(points):
+            group = candles[int(i * step):int((i + 1) * step)]
+            if not group:
+                continue
+            merged.append((
+                group[0][0], group[0][1],
+                max(c[2] for c in group), min(c[3] for c in group),
+                group[-1][4]
+            ))
+        return merged
+
+    async def compact(self, now: Optional[float] = None) -> int:
+        """
+        Deletes raw ticks older than tick_retention and 1-minute candles older than
+        minute_retention, `compact_batch` rows per transaction so the writer is
+        never held for long.
+
+        Returns:
+            int: Rows deleted.
+        """
+        now = time.time() if now is None else now
+        tick_cutoff = now - self.tick_retention
+        minute_cutoff = now - self.minute_retention
+        batch = self.compact_batch
+
+        async def delete_ticks(db):
+            cursor = await db.execute(
+                "DELETE FROM stock_ticks WHERE rowid IN (SELECT rowid FROM stock_ticks WHERE ts < ? LIMIT ?)",
+                (tick_cutoff, batch)
+            )
+            return cursor.rowcount
+
+        async def delete_minutes(db):
+            cursor = await db.execute(
+                """
+                DELETE FROM stock_candles WHERE rowid IN (
+                    SELECT rowid FROM stock_candles WHERE resolution = ? AND bucket < ? LIMIT ?
+                )
+                """,
+                (self.MINUTE, minute_cutoff, batch)
+            )
+            return cursor.rowcount
+
+        deleted = 0
+        for step in (delete_ticks, delete_minutes):
+            while True:
+                n = await self.bank.write(step)
+                deleted += n
+                if n < batch:
+                    break
+        return deleted
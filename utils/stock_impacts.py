@@ -0,0 +1,114 @@
+import asyncio
+from typing import Dict, Optional
+
+from utils.stock_history import StockHistory
+
+class StockImpactBuffer:
+    """
+    Write-behind buffer for multiplicative stock price impacts.
+
+    Impacts on the same tag are multiplied together in memory and written
+    with one `executemany` upsert, `flush_interval` seconds after the first
+    pending impact or as soon as `max_updates` impacts have piled up.
+    Readers apply `multiplier(tag)` to the stored price to see the pending value.
+    Each flush also records the resulting prices as ticks (StockHistory).
+    """
+
+    # A new tag starts at 100 with the impact already applied, so no buffered impact is lost.
+    UPSERT = """
+        INSERT INTO tag_stocks (tag_name, current_price) VALUES (?1, max(1.0, 100 * ?2))
+        ON CONFLICT(tag_name) DO UPDATE SET current_price = max(1.0, current_price * ?2)
+    """
+
+    def __init__(self, bank, flush_interval: float = 0.5, max_updates: int = 200):
+        """
+        Args:
+            bank: The bot's BankSystem (for write()).
+            flush_interval (float): Seconds an impact may wait before being written.
+            max_updates (int): Pending impacts that trigger an immediate flush.
+        """
+        self.bank = bank
+        self.flush_interval = flush_interval
+        self.max_updates = max_updates
+        self._pending: Dict[str, float] = {}
+        # Taken out of _pending, but not yet written by the flush transaction.
+        self._flushing: Dict[str, float] = {}
+        self._updates = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self.flushes = 0
+        self.impacts = 0
+
+    def add(self, tag: str, multiplier: float) -> None:
+        """Queues `current_price *= multiplier` for a tag (no I/O)."""
+        self._pending[tag] = self._pending.get(tag, 1.0) * multiplier
+        self._updates += 1
+        self.impacts += 1
+        if self._updates >= self.max_updates:
+            self._schedule_flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.flush_interval, self._schedule_flush)
+
+    def multiplier(self, tag: str) -> float:
+        """Product of the impacts on a tag that are not in the database yet."""
+        return self._pending.get(tag, 1.0) * self._flushing.get(tag, 1.0)
+
+    def _schedule_flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self.flush())
+
+    async def flush(self) -> int:
+        """
+        Writes every pending impact in one transaction.
+
+        Returns:
+            int: Number of tags written.
+        """
+        async with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            self._updates = 0
+            self._flushing = batch
+
+            async def txn(db):
+                await db.executemany(self.UPSERT, list(batch.items()))
+                await StockHistory.record_current(db, batch)
+
+            try:
+                await self.bank.write(txn)
+            except Exception as e:
+                print(f"Stock impact flush failed ({len(batch)} tags): {e}")
+                self._flushing = {}
+                for tag, mult in batch.items():
+                    self._pending[tag] = self._pending.get(tag, 1.0) * mult
+                self._updates += len(batch)
+                if self._timer is None:
+                    self._timer = asyncio.get_running_loop().call_later(self.flush_interval, self._schedule_flush)
+                return 0
+            # Committed: readers now see the new prices, so stop applying the batch on top.
+            self._flushing = {}
+            self.flushes += 1
+            # Impacts added while this batch was being written wait for the next flush.
+            if self._pending and self._timer is None:
+                self._timer = asyncio.get_running_loop().call_later(self.flush_interval, self._schedule_flush)
+            return len(batch)
+
+    async def close(self) -> None:
+        """Flushes whatever is still pending (call on unload)."""
+        if self._flush_task is not None and not self._flush_task.done():
+            await self._flush_task
+        await self.flush()
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def stats(self) -> dict:
+        return {'pending': len(self._pending), 'impacts': self.impacts, 'flushes': self.flushes}
@@ -0,0 +1,41 @@
+import numpy as np
+from typing import Optional
+
+def uniform_step(prices: np.ndarray, spread: float = 0.05, rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    """
+    The classic hourly shake: every price moves by a uniform -spread..+spread.
+
+    Args:
+        prices (np.ndarray): Current prices (float64).
+        spread (float): Maximum relative change per step.
+        rng (Optional[np.random.Generator]): Random source (a fresh default_rng if omitted).
+
+    Returns:
+        np.ndarray: New prices, floored at 1.0.
+    """
+    rng = rng or np.random.default_rng()
+    multipliers = 1.0 + rng.uniform(-spread, spread, size=prices.shape)
+    return np.maximum(1.0, prices * multipliers)
+
+def gbm_step(prices: np.ndarray, volatility: np.ndarray, drift: float = 0.0, dt: float = 1.0,
+             rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    """
+    One geometric Brownian motion step: price * exp((mu - sigma^2 / 2) * dt + sigma * sqrt(dt) * Z).
+
+    Prices stay positive and the per-tag `volatility` (sigma per step) controls how
+    wild each tag is; with drift 0 the expected price is unchanged.
+
+    Args:
+        prices (np.ndarray): Current prices (float64).
+        volatility (np.ndarray): Sigma per tag, same shape as prices.
+        drift (float): Mu per step.
+        dt (float): Step length in the unit sigma and mu are given in.
+        rng (Optional[np.random.Generator]): Random source (a fresh default_rng if omitted).
+
+    Returns:
+        np.ndarray: New prices, floored at 1.0.
+    """
+    rng = rng or np.random.default_rng()
+    z = rng.standard_normal(prices.shape)
+    log_return = (drift - 0.5 * volatility ** 2) * dt + volatility * np.sqrt(dt) * z
+    return np.maximum(1.0, prices * np.exp(log_return))
@@ -0,0 +1,245 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+import aiohttp
+
+class TagMetadataService:
+    """
+    Danbooru post counts per tag, backed by the `tag_metadata` table (30-day cache).
+
+    - All cached tags of a request are read with one query.
+    - Misses are fetched together with one `search[name_comma]` request per batch.
+    - Concurrent lookups of the same uncached tag share one in-flight request.
+    - HTTP 429 / 5xx responses are retried with exponential backoff (Retry-After wins).
+    - Fetched counts are written back with a single `executemany`. Names a
+      successful response leaves out don't exist on Danbooru and are cached as 0.
+
+    One aiohttp session is reused for every request. `base_url` can point to a
+    local HTTP stub for testing.
+    """
+
+    def __init__(self, bank, base_url: str = "https://danbooru.donmai.us", ttl: timedelta = timedelta(days=30),
+                 batch_size: int = 100, default_count: int = 9999999, session: Optional[aiohttp.ClientSession] = None,
+                 max_retries: int = 3, backoff: float = 1.0):
+        """
+        Initialize the service.
+
+        Args:
+            bank: The bot's BankSystem (for pool.reader() and write()).
+            base_url (str): Danbooru (or stub) root URL.
+            ttl (timedelta): How long a cached count stays fresh.
+            batch_size (int): Maximum tags per HTTP request.
+            default_count (int): Count reported when a tag can't be resolved (treated as common).
+            session (Optional[aiohttp.ClientSession]): Shared session. Created lazily if omitted.
+            max_retries (int): Retries of a batch after HTTP 429 / 5xx.
+            backoff (float): First retry delay in seconds (doubled per retry).
+        """
+        self.bank = bank
+        self.base_url = base_url.rstrip('/')
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.default_count = default_count
+        self._session = session
+        self._owns_session = session is None
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.requests = 0
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+            self._owns_session = True
+        return self._session
+
+    async def close(self) -> None:
+        if self._owns_session and self._session and not self._session.closed:
+            await self._session.close()
+
+    async def _read_cached(self, tags: List[str]) -> Dict[str, int]:
+        """Fresh counts from tag_metadata for the given tags (one query)."""
+        placeholders = ",".join("?" * len(tags))
+        async with self.bank.pool.reader() as db:
+            cursor = await db.execute(
+                f"SELECT tag_name, post_count, last_updated FROM tag_metadata WHERE tag_name IN ({placeholders})",
+                tags
+            )
+            rows = await cursor.fetchall()
+
+        now = datetime.now()
+        cached = {}
+        for tag_name, post_count, last_updated_str in rows:
+            try:
+                last_updated = datetime.strptime(last_updated_str, "%Y-%m-%d %H:%M:%S")
+            except (TypeError, ValueError):
+                continue
+            if now - last_updated < self.ttl:
+                cached[tag_name] = post_count
+        return cached
+
+    def _retry_delay(self, resp: aiohttp.ClientResponse, attempt: int) -> float:
+        try:
+            return max(0.0, float(resp.headers.get('Retry-After', '')))
+        except ValueError:
+            return self.backoff * (2 ** attempt)
+
+    async def _fetch_batch(self, tags: List[str]) -> Optional[Dict[str, int]]:
+        """
+        One Danbooru request for up to batch_size tags (retried on 429 / 5xx).
+
+        Returns:
+            Optional[Dict[str, int]]: Counts of the tags Danbooru knows (others are left out),
+            or None if the request failed.
+        """
+        print(f"Fetching counts for tags: {', '.join(tags)}")
+        params = {"search[name_comma]": ",".join(tags), "limit": str(len(tags))}
+        for attempt in range(self.max_retries + 1):
+            self.requests += 1
+            async with self._get_session().get(f"{self.base_url}/tags.json", params=params) as resp:
+                if resp.status == 200:
+                    data = await resp.json()
+                    break
+                if (resp.status == 429 or resp.status >= 500) and attempt < self.max_retries:
+                    delay = self._retry_delay(resp, attempt)
+                    print(f"Danbooru API Error: HTTP {resp.status}, retrying in {delay:.1f}s")
+                else:
+                    print(f"Danbooru API Error: HTTP {resp.status}")
+                    return None
+            await asyncio.sleep(delay)
+        if not isinstance(data, list):
+            return None
+        return {row['name']: row.get('post_count', 0) for row in data if isinstance(row, dict) and 'name' in row}
+
+    async def _fetch_and_store(self, tags: List[str]) -> Dict[str, int]:
+        counts = {}
+        for i in range(0, len(tags), self.batch_size):
+            batch = tags[i:i + self.batch_size]
+            try:
+                found = await self._fetch_batch(batch)
+            except Exception as e:
+                print(f"Danbooru API Error ({len(batch)} tags): {e}")
+                continue
+            if found is None:
+                continue
+            # A name the (successful) response leaves out has no posts; cache that instead of asking again.
+            for tag in batch:
+                counts[tag] = found.get(tag, 0)
+
+        if counts:
+            now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            rows = [(tag, count, now_str) for tag, count in counts.items()]
+            # Upsert rather than REPLACE: a refreshed dump row keeps source = 'dump' (TagRarityTable loads those).
+            await self.bank.write(lambda db: db.executemany(
+                """
+                INSERT INTO tag_metadata (tag_name, post_count, last_updated) VALUES (?, ?, ?)
+                ON CONFLICT(tag_name) DO UPDATE SET post_count = excluded.post_count,
+                                                    last_updated = excluded.last_updated
+                """,
+                rows
+            ))
+        return counts
+
+    async def get_counts(self, tags: Iterable[str]) -> Dict[str, int]:
+        """
+        Post counts for several tags.
+
+        Returns:
+            Dict[str, int]: tag -> post_count. Unresolvable tags get `default_count`.
+        """
+        tags = list(dict.fromkeys(tags))
+        if not tags:
+            return {}
+
+        result = await self._read_cached(tags)
+        missing = [t for t in tags if t not in result]
+        if not missing:
+            return result
+
+        fetched = await self._fetch_singleflight(missing)
+        for t in missing:
+            result[t] = fetched.get(t, self.default_count)
+        return result
+
+    async def get_count(self, tag: str) -> int:
+        """Post count for a single tag."""
+        return (await self.get_counts([tag]))[tag]
+
+    async def _fetch_singleflight(self, tags: List[str]) -> Dict[str, int]:
+        """Fetches tags from Danbooru, joining requests already in flight for any of them."""
+        result = {}
+        waiting = {t: self._inflight[t] for t in tags if t in self._inflight}
+        to_fetch = [t for t in tags if t not in waiting]
+
+        if to_fetch:
+            loop = asyncio.get_running_loop()
+            futures = {t: loop.create_future() for t in to_fetch}
+            self._inflight.update(futures)
+            fetched = {}
+            try:
+                fetched = await self._fetch_and_store(to_fetch)
+            except Exception as e:
+                print(f"Tag Metadata Error: {e}")
+                fetched = {}
+            finally:
+                for t, future in futures.items():
+                    self._inflight.pop(t, None)
+                    if not future.done():
+                        future.set_result(fetched.get(t, self.default_count))
+            for t in to_fetch:
+                if t in fetched:
+                    result[t] = fetched[t]
+
+        for t, future in waiting.items():
+            count = await future
+            if count != self.default_count:
+                result[t] = count
+        return result
+
+    async def refresh(self, tags: Iterable[str]) -> Dict[str, int]:
+        """
+        Re-fetches tags from Danbooru regardless of the cache (used by the background prefetcher).
+
+        Returns:
+            Dict[str, int]: Counts for the tags Danbooru returned.
+        """
+        tags = list(dict.fromkeys(tags))
+        if not tags:
+            return {}
+        return await self._fetch_singleflight(tags)
+
+    async def stale_tags(self, tags: Iterable[str], margin: timedelta = timedelta(0)) -> List[str]:
+        """
+        Tags whose cached count is missing or expires within `margin`, soonest first
+        (never fetched, then oldest `last_updated`). Bulk-imported ('dump') rows never expire.
+        """
+        tags = list(dict.fromkeys(tags))
+        updated = {}
+        skip = set()
+        async with self.bank.pool.reader() as db:
+            for i in range(0, len(tags), 500):
+                chunk = tags[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                cursor = await db.execute(
+                    f"SELECT tag_name, last_updated, source FROM tag_metadata WHERE tag_name IN ({placeholders})",
+                    chunk
+                )
+                for tag_name, last_updated, source in await cursor.fetchall():
+                    if source == 'dump':
+                        skip.add(tag_name)
+                    else:
+                        updated[tag_name] = last_updated
+
+        cutoff = datetime.now() - self.ttl + margin
+        stale = []
+        for t in tags:
+            if t in skip:
+                continue
+            try:
+                ts = datetime.strptime(updated[t], "%Y-%m-%d %H:%M:%S")
+            except (KeyError, TypeError, ValueError):
+                ts = datetime.min
+            if ts <= cutoff:
+                stale.append((ts, t))
+        stale.sort()
+        return [t for _, t in stale]
@@ -0,0 +1,71 @@
+from array import array
+from typing import Iterable, Optional, Tuple
+
+class TagRarityTable:
+    """
+    A compact, read-only `tag -> post_count` map for offline rarity lookups.
+
+    Tag names are stored UTF-8 encoded and sorted in one bytes blob, with
+    parallel arrays of offsets and counts, so a million tags take roughly
+    name bytes + 12 bytes per tag instead of a dict of Python objects.
+    Lookups are a binary search over the blob (about 20 comparisons for 1M tags).
+    """
+
+    def __init__(self):
+        self._blob = b""
+        self._offsets = array('I', [0])
+        self._counts = array('q')
+
+    @classmethod
+    def from_sorted(cls, rows: Iterable[Tuple[str, int]]) -> 'TagRarityTable':
+        """
+        Builds a table from (tag_name, post_count) rows.
+
+        Rows must be sorted by the UTF-8 bytes of the name, which is SQLite's
+        default BINARY collation (`ORDER BY tag_name`). Duplicates keep the first row.
+        """
+        table = cls()
+        blob = bytearray()
+        offsets = table._offsets
+        counts = table._counts
+        last = None
+        for name, count in rows:
+            key = name.encode('utf-8')
+            if key == last:
+                continue
+            if last is not None and key < last:
+                raise ValueError("rows must be sorted by tag name")
+            blob += key
+            offsets.append(len(blob))
+            counts.append(int(count or 0))
+            last = key
+        table._blob = bytes(blob)
+        return table
+
+    def _key(self, i: int) -> bytes:
+        return self._blob[self._offsets[i]:self._offsets[i + 1]]
+
+    def get(self, tag: str) -> Optional[int]:
+        """Post count for a tag, or None if the tag isn't in the table."""
+        key = tag.encode('utf-8')
+        lo, hi = 0, len(self._counts)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k = self._key(mid)
+            if k < key:
+                lo = mid + 1
+            elif k > key:
+                hi = mid
+            else:
+                return self._counts[mid]
+        return None
+
+    def __contains__(self, tag: str) -> bool:
+        return self.get(tag) is not None
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    def nbytes(self) -> int:
+        """Approximate memory used by the table's buffers."""
+        return len(self._blob) + self._offsets.itemsize * len(self._offsets) + self._counts.itemsize * len(self._counts)